@@ -2,7 +2,7 @@ from rest_framework import viewsets
 # from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from squac.mixins import SetUserMixin, DefaultPermissionsMixin, \
     SharedPermissionsMixin, OverrideParamsMixin, \
-    EnablePartialUpdateMixin
+    EnablePartialUpdateMixin, SparseFieldsMixin
 from dashboard.models import Dashboard, Widget
 from dashboard import serializers
 from django_filters import rest_framework as filters
@@ -41,8 +41,9 @@ class WidgetFilter(filters.FilterSet):
         fields = ('dashboard',)
 
 
-class BaseDashboardViewSet(SetUserMixin, DefaultPermissionsMixin,
-                           OverrideParamsMixin, viewsets.ModelViewSet):
+class BaseDashboardViewSet(SparseFieldsMixin, SetUserMixin,
+                           DefaultPermissionsMixin, OverrideParamsMixin,
+                           viewsets.ModelViewSet):
     pass
 
 
@@ -0,0 +1,2 @@
+# to register custom lookups in App.ready()
+default_app_config = 'measurement.apps.MeasurementConfig'
@@ -1,3 +1,4 @@
+from django.contrib.postgres.fields import ArrayField
 from django.db.models import Aggregate, FloatField
 
 
@@ -9,3 +10,20 @@ class Percentile(Aggregate):
     output_field = FloatField()
     template = '%(function)s(%(percentile)s) WITHIN GROUP \
                 (ORDER BY %(expressions)s)'
+
+
+class Percentiles(Aggregate):
+    """
+    PERCENTILE_CONT for an array of fractions at once, sorting the values
+    only once. Returns an array with a value for each fraction
+    """
+
+    function = 'PERCENTILE_CONT'
+    name = 'percentiles'
+    output_field = ArrayField(FloatField())
+    template = '%(function)s(ARRAY[%(fractions)s]::double precision[]) \
+                WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fractions, **extra):
+        fractions = ', '.join(str(float(fraction)) for fraction in fractions)
+        super().__init__(expression, fractions=fractions, **extra)
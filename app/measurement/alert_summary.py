@@ -0,0 +1,238 @@
+'''
+Alert history summaries
+
+Summarizes a filtered Alert queryset per trigger and monitor without
+loading the alerts themselves: alert counts per time bucket (date_trunc),
+the time spent in alarm and the channels that were breaching most often.
+A monitor is in alarm while any of its triggers is, so its time in alarm
+is the union of theirs rather than the sum. Everything is aggregated by
+Postgres, in three queries plus one for the names of the top channels.
+'''
+from collections import OrderedDict
+
+import pytz
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from measurement.models import ChannelContext
+
+BUCKETS = ('hour', 'day', 'week', 'month')
+
+# Seconds from each in alarm alert to the next alert of its trigger, or to
+# endtime, summed per trigger. The next alert may be outside of the selected
+# alerts. Monitors are in alarm while any of their triggers is, the union of
+# the intervals of their triggers: each interval only adds the part after
+# the latest end of the intervals that started before it
+IN_ALARM_SQL = '''
+    WITH selected AS ({selected}),
+    intervals AS (
+        SELECT history.trigger_id, trig.monitor_id,
+            history."timestamp" AS starttime,
+            LEAST(COALESCE(history.next_timestamp, %s), %s) AS endtime
+        FROM (
+            SELECT alert.id, alert.trigger_id, alert."timestamp",
+                alert.in_alarm,
+                LEAD(alert."timestamp") OVER (
+                    PARTITION BY alert.trigger_id ORDER BY alert."timestamp"
+                ) AS next_timestamp
+            FROM measurement_alert AS alert
+            WHERE alert.trigger_id IN (SELECT trigger_id FROM selected)
+                AND alert."timestamp" >= (
+                    SELECT MIN("timestamp") FROM selected)
+        ) AS history
+        JOIN measurement_trigger AS trig ON trig.id = history.trigger_id
+        WHERE history.in_alarm
+            AND history.id IN (SELECT id FROM selected)
+            AND history."timestamp" < %s
+    ),
+    ordered AS (
+        SELECT monitor_id, starttime, endtime,
+            MAX(endtime) OVER (
+                PARTITION BY monitor_id ORDER BY starttime, endtime
+                ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ) AS covered_until
+        FROM intervals
+    )
+    SELECT 'trigger', trigger_id,
+        SUM(EXTRACT(EPOCH FROM endtime - starttime))
+    FROM intervals
+    GROUP BY trigger_id
+    UNION ALL
+    SELECT 'monitor', monitor_id,
+        SUM(GREATEST(EXTRACT(EPOCH FROM endtime - GREATEST(
+            starttime, COALESCE(covered_until, starttime))), 0))
+    FROM ordered
+    GROUP BY monitor_id
+    '''
+
+# Number of alerts each channel was breaching in, per trigger and per
+# monitor. Older alerts store their channels as JSON in breaching_channels
+TOP_CHANNELS_SQL = '''
+    WITH selected AS ({selected}),
+    breaching AS (
+        SELECT alert.trigger_id, trig.monitor_id, channels.channel_id
+        FROM selected AS alert
+        JOIN measurement_trigger AS trig ON trig.id = alert.trigger_id
+        CROSS JOIN LATERAL (
+            SELECT UNNEST(alert.breaching_channel_ids) AS channel_id
+            UNION ALL
+            SELECT (channel ->> 'channel_id')::integer
+            FROM jsonb_array_elements(
+                COALESCE(alert.breaching_channels, '[]'::jsonb)) AS channel
+        ) AS channels
+    )
+    SELECT kind, id, channel_id, alerts
+    FROM (
+        SELECT 'trigger' AS kind, trigger_id AS id, channel_id,
+            COUNT(*) AS alerts,
+            ROW_NUMBER() OVER (
+                PARTITION BY trigger_id ORDER BY COUNT(*) DESC, channel_id
+            ) AS rank
+        FROM breaching
+        GROUP BY trigger_id, channel_id
+        UNION ALL
+        SELECT 'monitor', monitor_id, channel_id, COUNT(*),
+            ROW_NUMBER() OVER (
+                PARTITION BY monitor_id ORDER BY COUNT(*) DESC, channel_id
+            )
+        FROM breaching
+        GROUP BY monitor_id, channel_id
+    ) AS ranked
+    WHERE rank <= %s
+    ORDER BY kind, id, rank
+    '''
+
+
+def selected_sql(queryset):
+    '''SQL and params selecting the columns used by the raw queries'''
+    return queryset.order_by().values(
+        'id', 'trigger_id', 'timestamp', 'in_alarm', 'breaching_channel_ids',
+        'legacy_breaching_channels').query.sql_with_params()
+
+
+def bucket_counts(queryset, bucket):
+    '''Alert and in alarm counts per trigger and bucket'''
+    return queryset.order_by().annotate(
+        bucket=Trunc('timestamp', bucket, tzinfo=pytz.UTC)
+    ).values('trigger', 'trigger__monitor', 'bucket').annotate(
+        alerts=Count('id'),
+        in_alarm=Count('id', filter=Q(in_alarm=True))
+    ).order_by('trigger', 'bucket')
+
+
+def in_alarm_seconds(queryset, endtime):
+    '''
+    Seconds in alarm until endtime as a dict of 'trigger' and 'monitor' ->
+    dict of trigger or monitor id -> seconds
+    '''
+    seconds = {'trigger': {}, 'monitor': {}}
+    sql, params = selected_sql(queryset)
+    with connection.cursor() as cursor:
+        cursor.execute(IN_ALARM_SQL.format(selected=sql),
+                       list(params) + [endtime, endtime, endtime])
+        for kind, key, total in cursor.fetchall():
+            seconds[kind][key] = float(total)
+    return seconds
+
+
+def top_channels(queryset, top):
+    '''
+    Most often breaching channels as a dict of 'trigger' and 'monitor' ->
+    dict of trigger or monitor id -> list of (channel id, number of alerts)
+    '''
+    channels = {'trigger': {}, 'monitor': {}}
+    if not top:
+        return channels
+    sql, params = selected_sql(queryset)
+    with connection.cursor() as cursor:
+        cursor.execute(TOP_CHANNELS_SQL.format(selected=sql),
+                       list(params) + [top])
+        for kind, key, channel_id, alerts in cursor.fetchall():
+            channels[kind].setdefault(key, []).append((channel_id, alerts))
+    return channels
+
+
+def summarize_alerts(queryset, bucket='day', top=5, endtime=None):
+    '''
+    Summarize the alerts in queryset per trigger and per monitor.
+
+    bucket: one of BUCKETS, the period alerts are counted in
+    top: number of most often breaching channels returned per trigger
+        and monitor
+    endtime: in alarm time is counted up to here, default now
+    '''
+    now = timezone.now()
+    endtime = min(endtime, now) if endtime else now
+
+    triggers = OrderedDict()
+    for row in bucket_counts(queryset, bucket):
+        trigger = triggers.setdefault(row['trigger'], {
+            'trigger': row['trigger'],
+            'monitor': row['trigger__monitor'],
+            'alerts': 0,
+            'in_alarm_alerts': 0,
+            'in_alarm_seconds': 0.0,
+            'buckets': [],
+            'top_channels': []
+        })
+        trigger['alerts'] += row['alerts']
+        trigger['in_alarm_alerts'] += row['in_alarm']
+        trigger['buckets'].append({
+            'timestamp': row['bucket'],
+            'alerts': row['alerts'],
+            'in_alarm_alerts': row['in_alarm']
+        })
+
+    monitors = OrderedDict()
+    for trigger in triggers.values():
+        monitor = monitors.setdefault(trigger['monitor'], {
+            'monitor': trigger['monitor'],
+            'alerts': 0,
+            'in_alarm_alerts': 0,
+            'in_alarm_seconds': 0.0,
+            'buckets': OrderedDict(),
+            'top_channels': []
+        })
+        monitor['alerts'] += trigger['alerts']
+        monitor['in_alarm_alerts'] += trigger['in_alarm_alerts']
+        for trigger_bucket in trigger['buckets']:
+            monitor_bucket = monitor['buckets'].setdefault(
+                trigger_bucket['timestamp'], {
+                    'timestamp': trigger_bucket['timestamp'],
+                    'alerts': 0,
+                    'in_alarm_alerts': 0
+                })
+            monitor_bucket['alerts'] += trigger_bucket['alerts']
+            monitor_bucket['in_alarm_alerts'] += \
+                trigger_bucket['in_alarm_alerts']
+    for monitor in monitors.values():
+        monitor['buckets'] = sorted(monitor['buckets'].values(),
+                                    key=lambda b: b['timestamp'])
+
+    if triggers:
+        summaries = {'trigger': triggers, 'monitor': monitors}
+        for kind, totals in in_alarm_seconds(queryset, endtime).items():
+            for key, seconds in totals.items():
+                summaries[kind][key]['in_alarm_seconds'] = seconds
+
+        channels = top_channels(queryset, top)
+        context = ChannelContext.for_channels(
+            {channel_id for kind_channels in channels.values()
+             for key_channels in kind_channels.values()
+             for channel_id, alerts in key_channels})
+        for kind, kind_channels in channels.items():
+            for key, key_channels in kind_channels.items():
+                summaries[kind][key]['top_channels'] = [{
+                    'channel_id': channel_id,
+                    'channel': context.names.get(channel_id),
+                    'alerts': alerts
+                } for channel_id, alerts in key_channels]
+
+    return {
+        'bucket': bucket,
+        'endtime': endtime,
+        'monitors': list(monitors.values()),
+        'triggers': list(triggers.values())
+    }
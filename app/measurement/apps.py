@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MeasurementConfig(AppConfig):
     name = 'measurement'
+
+    def ready(self):
+        from measurement.lookups import register_lookups
+        register_lookups()
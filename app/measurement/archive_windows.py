@@ -0,0 +1,295 @@
+'''
+Aggregate long monitor windows from archives
+
+Hour and day monitors with long windows would rescan a lot of raw
+measurements every hour. Whole days and hours of the window that have been
+archived are read from ArchiveDay and ArchiveHour instead, and raw
+measurements are only read for the rest of the window: the unarchived tail
+and any partial periods at either end. The number of queries and the rows
+read no longer grow with the window length.
+
+count, sum, avg, min, max, minabs and maxabs are exact. median, p90 and p95
+are combined from the quantiles stored with each archive, and are exact when
+the whole window comes from a single source. Archives created before
+quantiles were stored fall back to their p05, p10, median, p90 and p95.
+Archives created before min_abs was stored only give minabs when their
+range doesn't cross zero, otherwise it is read from their raw measurements.
+
+Periods between the first and the latest archive of the metric in the
+window count as archived. Measurements posted after their period was
+archived are missed until the archive is rebuilt by backfill_archives.
+'''
+from datetime import datetime, timedelta
+from functools import reduce
+import operator
+
+import numpy as np
+import pytz
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Abs
+
+from measurement.aggregates.percentile import Percentiles
+from measurement.models import (ArchiveBase, ArchiveDay, ArchiveHour,
+                                Measurement, default_channel_value)
+
+# Only windows at least this long are aggregated from archives
+MIN_WINDOW_SECONDS = 6 * 60 * 60
+
+# Archive levels to try, coarsest first
+LEVELS = (
+    (ArchiveDay, timedelta(days=1)),
+    (ArchiveHour, timedelta(hours=1)),
+)
+
+PERCENTILES = {'median': 0.5, 'p90': 0.90, 'p95': 0.95}
+# Fractions of the percentile fields of archives without quantiles
+LEGACY_QUANTILES = (0.0, 0.05, 0.10, 0.5, 0.90, 0.95, 1.0)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def use_archives(window):
+    '''Whether a (starttime, endtime) window should use archives'''
+    starttime, endtime = window
+    return settings.ARCHIVE_ALARMS_ENABLED and \
+        (endtime - starttime).total_seconds() >= MIN_WINDOW_SECONDS
+
+
+def floor_time(time, period):
+    '''Round a time down to a whole period (UTC)'''
+    return EPOCH + (time - EPOCH) // period * period
+
+
+def ceil_time(time, period):
+    '''Round a time up to a whole period (UTC)'''
+    floor = floor_time(time, period)
+    return floor if floor == time else floor + period
+
+
+def archived_range(model, period, metric_id, starttime):
+    '''
+    Return the (start, end) of the periods of the metric archived after
+    starttime, or None if there are no archives
+    '''
+    archived = model.objects.filter(
+        metric_id=metric_id,
+        starttime__gte=starttime
+    ).aggregate(first=Min('starttime'), last=Max('starttime'))
+    if archived['first'] is None:
+        return None
+    return (floor_time(archived['first'], period),
+            floor_time(archived['last'], period) + period)
+
+
+def plan_window(metric_id, starttime, endtime):
+    '''
+    Split [starttime, endtime) into archived periods and ranges to read raw.
+    Returns a list of (archive model, [(start, end)]) and a list of raw
+    (start, end) ranges
+    '''
+    archived = []
+    uncovered = [(starttime, endtime)]
+    for model, period in LEVELS:
+        archived_periods = archived_range(model, period, metric_id,
+                                          starttime)
+        if archived_periods is None:
+            continue
+        ranges = []
+        remaining = []
+        for start, end in uncovered:
+            archive_start = max(ceil_time(start, period), archived_periods[0])
+            archive_end = min(floor_time(end, period), archived_periods[1])
+            if archive_start < archive_end:
+                ranges.append((archive_start, archive_end))
+                remaining += [(a, b) for a, b in ((start, archive_start),
+                                                  (archive_end, end))
+                              if a < b]
+            else:
+                remaining.append((start, end))
+        if ranges:
+            archived.append((model, ranges))
+        uncovered = remaining
+    return archived, uncovered
+
+
+def in_ranges(ranges):
+    '''Q matching starttimes in any of the half open ranges'''
+    return reduce(operator.or_, [Q(starttime__gte=start, starttime__lt=end)
+                                 for start, end in ranges])
+
+
+def raw_parts(metric_id, ranges, endtime, channel_ids):
+    '''
+    Aggregate raw measurements in ranges, and at endtime since monitor
+    windows include their end. Yields (channel id, part)
+    '''
+    q_ranges = Q(starttime=endtime)
+    if ranges:
+        q_ranges |= in_ranges(ranges)
+    rows = Measurement.objects.filter(
+        q_ranges,
+        metric_id=metric_id,
+        channel_id__in=channel_ids
+    ).values('channel').annotate(
+        count=Count('value'),
+        sum=Sum('value'),
+        min=Min('value'),
+        max=Max('value'),
+        minabs=Min(Abs('value')),
+        maxabs=Max(Abs('value')),
+        quantiles=Percentiles('value', ArchiveBase.QUANTILES)
+    )
+    for row in rows:
+        yield row['channel'], {
+            'count': row['count'],
+            'sum': row['sum'],
+            'min': row['min'],
+            'max': row['max'],
+            'minabs': row['minabs'],
+            'maxabs': row['maxabs'],
+            'fractions': ArchiveBase.QUANTILES,
+            'values': row['quantiles']
+        }
+
+
+def archive_minabs(min_, max_, min_abs):
+    '''
+    minabs of an archive, None if it can't be told from its min and max
+    because the archive predates min_abs and its range crosses zero
+    '''
+    if min_abs is not None:
+        return min_abs
+    if min_ <= 0 <= max_:
+        return None
+    return min(abs(min_), abs(max_))
+
+
+def raw_minabs(metric_id, periods):
+    '''
+    Return a dict of channel id -> smallest absolute value of raw
+    measurements, for a dict of channel id -> [(start, end)] periods
+    '''
+    q_periods = reduce(operator.or_, [
+        Q(channel_id=channel_id) & in_ranges(ranges)
+        for channel_id, ranges in periods.items()])
+    return dict(Measurement.objects.filter(
+        q_periods, metric_id=metric_id
+    ).values('channel').annotate(
+        minabs=Min(Abs('value'))).values_list('channel', 'minabs'))
+
+
+def archive_parts(model, ranges, metric_id, channel_ids, unknown_minabs):
+    '''
+    Yields (channel id, part) for each archive in ranges. The periods of
+    archives whose minabs is unknown are added to the unknown_minabs dict of
+    channel id -> [(start, end)], and their part has an infinite minabs
+    '''
+    rows = model.objects.filter(
+        in_ranges(ranges),
+        metric_id=metric_id,
+        channel_id__in=channel_ids
+    ).values_list('channel_id', 'num_samps', 'mean', 'min', 'max', 'p05',
+                  'p10', 'median', 'p90', 'p95', 'quantiles', 'min_abs',
+                  'starttime')
+    period = dict(LEVELS)[model]
+    for (channel_id, count, mean, min_, max_, p05, p10, median, p90, p95,
+         quantiles, min_abs, starttime) in rows:
+        minabs = archive_minabs(min_, max_, min_abs)
+        if minabs is None:
+            start = floor_time(starttime, period)
+            unknown_minabs.setdefault(channel_id, []).append(
+                (start, start + period))
+            minabs = float('inf')
+        if quantiles:
+            fractions, values = ArchiveBase.QUANTILES, quantiles
+        else:
+            fractions = LEGACY_QUANTILES
+            values = (min_, p05, p10, median, p90, p95, max_)
+        yield channel_id, {
+            'count': count,
+            'sum': mean * count,
+            'min': min_,
+            'max': max_,
+            'minabs': minabs,
+            'maxabs': max(abs(min_), abs(max_)),
+            'fractions': fractions,
+            'values': values
+        }
+
+
+def combine_percentiles(parts, count):
+    '''
+    Percentiles of the combined parts. The quantiles of each part are
+    interpolated into a CDF and the count weighted CDFs are summed
+    '''
+    if len(parts) == 1:
+        part = parts[0]
+        return {stat: float(np.interp(fraction, part['fractions'],
+                                      part['values']))
+                for stat, fraction in PERCENTILES.items()}
+
+    xs = np.unique(np.concatenate([part['values'] for part in parts]))
+    cdf = sum(part['count'] * np.interp(xs, part['values'],
+                                        part['fractions'])
+              for part in parts) / count
+    return {stat: float(np.interp(fraction, cdf, xs))
+            for stat, fraction in PERCENTILES.items()}
+
+
+def combine_parts(channel_id, parts):
+    '''Combine the parts of a channel into agg_channel_values form'''
+    parts = [part for part in parts if part['count']]
+    if not parts:
+        return default_channel_value(channel_id)
+
+    count = sum(part['count'] for part in parts)
+    total = sum(part['sum'] for part in parts)
+    value = {
+        'channel': channel_id,
+        'count': count,
+        'sum': total,
+        'avg': total / count,
+        'min': min(part['min'] for part in parts),
+        'max': max(part['max'] for part in parts),
+        'minabs': min(part['minabs'] for part in parts),
+        'maxabs': max(part['maxabs'] for part in parts),
+    }
+    value.update(combine_percentiles(parts, count))
+    return value
+
+
+def agg_window(metric_id, window, channel_ids):
+    '''
+    Calculate aggregate values for every channel in channel_ids over the
+    window, including its end like Monitor.agg_measurements. Returns a dict
+    of channel id -> aggregate values for channels with measurements
+    '''
+    if not channel_ids:
+        return {}
+    starttime, endtime = window
+    archived, uncovered = plan_window(metric_id, starttime, endtime)
+
+    unknown_minabs = {}
+    sources = [raw_parts(metric_id, uncovered, endtime, channel_ids)]
+    sources += [archive_parts(model, ranges, metric_id, channel_ids,
+                              unknown_minabs)
+                for model, ranges in archived]
+    parts = {}
+    for source in sources:
+        for channel_id, part in source:
+            parts.setdefault(channel_id, []).append(part)
+
+    values = {channel_id: combine_parts(channel_id, channel_parts)
+              for channel_id, channel_parts in parts.items()}
+    if unknown_minabs:
+        for channel_id, minabs in raw_minabs(
+                metric_id, unknown_minabs).items():
+            value = values[channel_id]
+            value['minabs'] = min(value['minabs'], minabs)
+        for channel_id in unknown_minabs:
+            if values[channel_id]['minabs'] == float('inf'):
+                # The raw measurements are gone, the range crosses zero
+                values[channel_id]['minabs'] = 0.0
+    return {channel_id: value for channel_id, value in values.items()
+            if value['count']}
@@ -0,0 +1,349 @@
+'''
+Backtest a monitor over a historical range
+
+The monitor is evaluated at every hour in the range, as evaluate_alarms
+does, and the alerts its triggers would have created are returned. Nothing
+is written to the database.
+
+Aggregates for all of the windows are loaded at once:
+* Windows shorter than an hour (minute monitors) don't overlap, so each
+  measurement belongs to at most one evaluation and the database aggregates
+  every (channel, window) exactly in a single query.
+* Longer windows are combined from hourly buckets. These are aggregated from
+  raw measurements for short ranges and read from ArchiveHour otherwise.
+  Hours before the first or after the latest hour archive of the metric are
+  aggregated from raw measurements, like archive_windows does. count, sum,
+  avg, min, max, minabs and maxabs are exact. median, p90 and p95
+  are approximated by the count weighted mean of the hourly values, and
+  windows that aren't a whole number of hours are rounded up.
+
+Each stat ends up in a (channels x evaluations) array that the engine
+evaluates for all triggers and times at once. Only the alert state machine
+of Trigger.evaluate_alert runs per evaluation.
+
+Unlike Monitor.agg_measurements, windows are half open [starttime, endtime).
+The backtest starts as if the triggers had no previous alerts.
+'''
+from datetime import timedelta
+
+import numpy as np
+import pytz
+from django.db.models import Min
+from django.db.models.functions import Abs, Trunc
+
+from measurement.archive_windows import archive_minabs, archived_range
+from measurement.engine import breaching_masks, in_alarm_states
+from measurement.models import (ArchiveHour, ChannelContext, Measurement,
+                                Trigger, agg_channel_values)
+
+HOUR = timedelta(hours=1)
+# Aggregate hourly buckets from raw measurements when the data needed for
+# the backtest spans at most this many hours, otherwise use ArchiveHour
+RAW_MAX_HOURS = 48
+# About three months of hourly evaluations
+MAX_EVALUATIONS = 24 * 93
+
+SOURCES = ('raw', 'archive')
+# Stats loaded for each channel and bucket
+BUCKET_STATS = ('count', 'sum', 'min', 'max', 'minabs', 'maxabs',
+                'median', 'p90', 'p95')
+PERCENTILE_STATS = ('median', 'p90', 'p95')
+
+
+def evaluation_times(starttime, endtime):
+    '''Return every whole hour from starttime up to and including endtime'''
+    first = starttime.replace(minute=0, second=0, microsecond=0)
+    if first < starttime:
+        first += HOUR
+    if endtime < first:
+        return []
+    return [first + i * HOUR for i in range((endtime - first) // HOUR + 1)]
+
+
+def get_source(monitor, times, source=None):
+    '''
+    Return where window values are loaded from. Windows shorter than an hour
+    are always aggregated exactly from raw measurements
+    '''
+    window = timedelta(seconds=monitor.calc_interval_seconds())
+    if window < HOUR:
+        return 'raw'
+    if source:
+        return source
+    hours = (times[-1] - times[0] + window) / HOUR
+    return 'raw' if hours <= RAW_MAX_HOURS else 'archive'
+
+
+def bucket_arrays(rows, channel_index, first, n_buckets):
+    '''
+    Convert rows of (channel, bucket starttime, *BUCKET_STATS) into a
+    (channels x buckets) array per stat. Missing values are NaN, except for
+    count which is 0
+    '''
+    shape = (len(channel_index), n_buckets)
+    arrays = {stat: np.full(shape, np.nan) for stat in BUCKET_STATS}
+    arrays['count'] = np.zeros(shape)
+    rows = [row for row in rows
+            if 0 <= (row[1] - first) // HOUR < n_buckets]
+    if not rows:
+        return arrays
+
+    channels, buckets, *values = zip(*rows)
+    i = np.array([channel_index[channel] for channel in channels])
+    j = np.array([(bucket - first) // HOUR for bucket in buckets])
+    for stat, stat_values in zip(BUCKET_STATS, values):
+        arrays[stat][i, j] = np.array(stat_values, dtype=float)
+    return arrays
+
+
+def raw_rows(monitor, channel_ids, starttime, endtime, minutes=None):
+    '''
+    Aggregate raw measurements per channel and hour. If minutes is given only
+    the last minutes of each hour are included
+    '''
+    queryset = Measurement.objects.filter(
+        metric=monitor.metric_id,
+        channel__in=channel_ids,
+        starttime__gte=starttime,
+        starttime__lt=endtime)
+    if minutes is not None:
+        queryset = queryset.filter(starttime__minute__gte=60 - minutes)
+    queryset = queryset.annotate(
+        bucket=Trunc('starttime', 'hour', tzinfo=pytz.UTC))
+    return agg_channel_values(queryset, 'bucket').values_list(
+        'channel', 'bucket', *BUCKET_STATS)
+
+
+def raw_minabs(monitor, buckets):
+    '''
+    Return a dict of (channel, bucket) -> smallest absolute value of raw
+    measurements for a list of (channel, bucket starttime)
+    '''
+    channels, starts = zip(*buckets)
+    rows = Measurement.objects.filter(
+        metric=monitor.metric_id,
+        channel__in=set(channels),
+        starttime__gte=min(starts),
+        starttime__lt=max(starts) + HOUR
+    ).annotate(
+        bucket=Trunc('starttime', 'hour', tzinfo=pytz.UTC)
+    ).values('channel', 'bucket').annotate(
+        minabs=Min(Abs('value'))
+    ).values_list('channel', 'bucket', 'minabs')
+    wanted = set(buckets)
+    return {(channel, bucket): minabs for channel, bucket, minabs in rows
+            if (channel, bucket) in wanted}
+
+
+def archive_rows(monitor, channel_ids, starttime, endtime):
+    '''
+    Hourly buckets from ArchiveHour in the same form as raw_rows. minabs of
+    archives that predate min_abs and cross zero is read from raw data
+    '''
+    rows = list(ArchiveHour.objects.filter(
+        metric=monitor.metric_id,
+        channel__in=channel_ids,
+        starttime__gte=starttime,
+        starttime__lt=endtime
+    ).values_list('channel', 'starttime', 'num_samps', 'mean', 'min', 'max',
+                  'min_abs', 'median', 'p90', 'p95'))
+    unknown = [(row[0], row[1]) for row in rows
+               if archive_minabs(*row[4:7]) is None]
+    unknown_minabs = raw_minabs(monitor, unknown) if unknown else {}
+    for (channel, bucket, count, mean, min_, max_, min_abs, median, p90,
+         p95) in rows:
+        minabs = archive_minabs(min_, max_, min_abs)
+        if minabs is None:
+            # The raw measurements are gone, the range crosses zero
+            minabs = unknown_minabs.get((channel, bucket), 0.0)
+        maxabs = max(abs(min_), abs(max_))
+        yield (channel, bucket, count, mean * count, min_, max_, minabs,
+               maxabs, median, p90, p95)
+
+
+def hour_rows(monitor, channel_ids, starttime, endtime):
+    '''
+    Hourly buckets read from ArchiveHour for the archived hours and
+    aggregated from raw measurements before and after them
+    '''
+    archived = archived_range(ArchiveHour, HOUR, monitor.metric_id,
+                              starttime)
+    if archived is None:
+        return list(raw_rows(monitor, channel_ids, starttime, endtime))
+    archive_start = max(archived[0], starttime)
+    archive_end = min(archived[1], endtime)
+    rows = list(archive_rows(monitor, channel_ids, archive_start,
+                             archive_end))
+    for start, end in ((starttime, archive_start), (archive_end, endtime)):
+        if start < end:
+            rows += raw_rows(monitor, channel_ids, start, end)
+    return rows
+
+
+def sliding_sum(values, width):
+    '''Sum each run of width columns'''
+    cumulative = np.cumsum(values, axis=1)
+    cumulative = np.concatenate(
+        [np.zeros((values.shape[0], 1)), cumulative], axis=1)
+    return cumulative[:, width:] - cumulative[:, :-width]
+
+
+def sliding_reduce(func, values, width):
+    '''Reduce each run of width columns with a binary ufunc'''
+    n = values.shape[1] - width + 1
+    result = values[:, :n].copy()
+    for k in range(1, width):
+        result = func(result, values[:, k:k + n])
+    return result
+
+
+def combine_buckets(buckets, width):
+    '''
+    Combine hourly bucket arrays into window values, where window e is made
+    of buckets e to e + width - 1
+    '''
+    count = sliding_sum(buckets['count'], width)
+    empty = count == 0
+    values = {'count': count}
+    values['sum'] = sliding_sum(np.nan_to_num(buckets['sum']), width)
+    values['sum'][empty] = np.nan
+    for stat, func in (('min', np.fmin), ('max', np.fmax),
+                       ('minabs', np.fmin), ('maxabs', np.fmax)):
+        values[stat] = sliding_reduce(func, buckets[stat], width)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for stat in PERCENTILE_STATS:
+            weights = np.where(np.isnan(buckets[stat]), 0, buckets['count'])
+            values[stat] = sliding_sum(
+                np.nan_to_num(buckets[stat]) * weights, width
+            ) / sliding_sum(weights, width)
+    return values
+
+
+def window_values(monitor, channel_ids, times, source):
+    '''
+    Return a dict of stat -> (channels x evaluations) array of the aggregate
+    values the monitor would have evaluated at each time
+    '''
+    channel_index = {channel_id: i for i, channel_id in enumerate(channel_ids)}
+    seconds = monitor.calc_interval_seconds()
+    if seconds < 3600:
+        # Windows don't overlap, the bucket of each evaluation is the hour
+        # before it
+        values = bucket_arrays(
+            raw_rows(monitor, channel_ids, times[0] - HOUR, times[-1],
+                     minutes=seconds // 60),
+            channel_index, times[0] - HOUR, len(times))
+    else:
+        width = -(-seconds // 3600)
+        first = times[0] - width * HOUR
+        n_buckets = len(times) + width - 1
+        if source == 'raw':
+            rows = raw_rows(monitor, channel_ids, first, times[-1])
+        else:
+            rows = hour_rows(monitor, channel_ids, first, times[-1])
+        values = combine_buckets(
+            bucket_arrays(rows, channel_index, first, n_buckets), width)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values['avg'] = values['sum'] / values['count']
+    return values
+
+
+def simulate_alerts(trigger, masks, in_alarm, values, times, channel_ids,
+                    context):
+    '''
+    Follow Trigger.evaluate_alert through every evaluation and return the
+    alerts that would have been created
+
+    masks: (channels x evaluations) breaching channels for this trigger
+    in_alarm: alarm state at each evaluation
+    values: (channels x evaluations) values of the monitor stat
+    '''
+    stat = trigger.monitor.stat
+    any_operator = trigger.num_channels_operator == \
+        Trigger.NumChannelsOperator.ANY
+    alerts = []
+    # (in_alarm, breaching channel ids) of the last alert
+    previous = None
+    for e, timestamp in enumerate(times):
+        breaching = np.flatnonzero(masks[:, e])
+        breaching_ids = {channel_ids[j] for j in breaching}
+        create_new, send_new = False, False
+        if in_alarm[e]:
+            create_new = True
+            send_new = previous is None or not previous[0]
+        elif previous and previous[0]:
+            create_new, send_new = True, trigger.alert_on_out_of_alarm
+
+        if any_operator:
+            previous_ids = previous[1] if previous else set()
+            if breaching_ids - previous_ids:
+                send_new = True
+            elif previous_ids - breaching_ids:
+                send_new = trigger.alert_on_out_of_alarm
+
+        if trigger.monitor.do_daily_digest:
+            send_new = False
+
+        if create_new:
+            breaching_channels = []
+            for j in breaching:
+                value = float(values[j, e])
+                breaching_channels.append({
+                    'channel': context.names[channel_ids[j]],
+                    'channel_id': channel_ids[j],
+                    stat: value,
+                    'value': value
+                })
+            breaching_channels.sort(key=lambda channel: channel['channel'])
+            alerts.append({
+                'timestamp': timestamp,
+                'in_alarm': bool(in_alarm[e]),
+                'send': bool(send_new),
+                'breaching_channels': breaching_channels
+            })
+            previous = (bool(in_alarm[e]), breaching_ids)
+    return alerts
+
+
+def backtest_monitor(monitor, starttime, endtime, source=None):
+    '''
+    Evaluate a time-based monitor every hour from starttime to endtime and
+    return the alerts each of its triggers would have created.
+
+    source is 'raw' or 'archive' to force where hourly buckets are loaded
+    from, by default raw measurements are used for short ranges
+    '''
+    times = evaluation_times(starttime, endtime)
+    triggers = list(monitor.triggers.order_by('id'))
+    result = {
+        'monitor': monitor.id,
+        'starttime': times[0] if times else None,
+        'endtime': times[-1] if times else None,
+        'source': None,
+        'evaluations': len(times),
+        'triggers': []
+    }
+    if not times or not triggers:
+        return result
+
+    result['source'] = get_source(monitor, times, source)
+    context = ChannelContext.for_group(monitor.channel_group)
+    channel_ids = sorted(context.names)
+    values = window_values(
+        monitor, channel_ids, times, result['source'])[monitor.stat]
+
+    masks = breaching_masks(values, triggers)
+    in_alarm = in_alarm_states(masks.sum(axis=1), triggers, context.count)
+    for i, trigger in enumerate(triggers):
+        trigger.monitor = monitor
+        alerts = simulate_alerts(trigger, masks[i], in_alarm[i], values,
+                                 times, channel_ids, context)
+        result['triggers'].append({
+            'trigger': trigger.id,
+            'in_alarm_count': int(in_alarm[i].sum()),
+            'alert_count': len(alerts),
+            'send_count': sum(alert['send'] for alert in alerts),
+            'alerts': alerts
+        })
+    return result
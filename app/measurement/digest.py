@@ -0,0 +1,66 @@
+'''
+Daily digests for many monitors at once
+
+All triggers of the digest monitors are loaded in one query and all of the
+previous day's alerts in another, ordered so they can be grouped per trigger
+in Python. Breaching channel names are looked up once for all alerts, and
+trigger descriptions that render the same text are only rendered once.
+The number of queries no longer depends on the number of monitors and
+triggers, apart from queueing the emails themselves.
+'''
+from collections import defaultdict
+
+from measurement.models import (Alert, Trigger, get_digest_range,
+                                load_breaching_channels)
+
+
+def build_daily_digests(monitors, digesttime):
+    '''
+    Return a dict of monitor id -> list of (trigger, digest context) for the
+    day before digesttime
+    '''
+    monitors = {monitor.id: monitor for monitor in monitors}
+    if not monitors:
+        return {}
+
+    triggers = list(Trigger.objects.filter(
+        monitor_id__in=monitors).order_by('monitor_id', 'id'))
+    for trigger in triggers:
+        # Share the already loaded monitor, metric and channel group
+        trigger.monitor = monitors[trigger.monitor_id]
+    trigger_map = {trigger.id: trigger for trigger in triggers}
+
+    alerts = defaultdict(list)
+    all_alerts = list(Alert.objects.filter(
+        trigger__monitor_id__in=monitors,
+        timestamp__range=get_digest_range(digesttime)
+    ).order_by('trigger_id', 'timestamp'))
+    for alert in all_alerts:
+        alert.trigger = trigger_map[alert.trigger_id]
+        alerts[alert.trigger_id].append(alert)
+    # Channel names for all alerts at once
+    load_breaching_channels(all_alerts)
+
+    descriptions = {}
+    digests = {monitor_id: [] for monitor_id in monitors}
+    for trigger in triggers:
+        digests[trigger.monitor_id].append((
+            trigger,
+            trigger.get_daily_trigger_digest(
+                digesttime,
+                alerts=alerts[trigger.id],
+                descriptions=descriptions)))
+    return digests
+
+
+def send_daily_digests(monitors, digesttime):
+    '''
+    Queue the daily digest for every monitor with do_daily_digest set.
+    monitors should have metric and channel_group selected
+    '''
+    monitors = [monitor for monitor in monitors if monitor.do_daily_digest]
+    digests = build_daily_digests(monitors, digesttime)
+    for monitor in monitors:
+        monitor.check_daily_digest(digesttime,
+                                   trigger_digests=digests[monitor.id])
+    return monitors
@@ -0,0 +1,128 @@
+'''
+Vectorized trigger evaluation
+
+The aggregate values for a monitor are converted to a NumPy array once per
+stat, and each trigger's value_operator is applied to the whole array as a
+boolean mask. Breaching counts and num_channels_operator outcomes are then
+derived with array operations for all triggers at once.
+
+Results match Trigger.is_breaching, Trigger.get_breaching_channels and
+Trigger.in_alarm_state. Channels without measurements (value None) are never
+breaching, which NaN comparisons give us for free.
+'''
+import numpy as np
+
+# Keys match Trigger.ValueOperator values
+VALUE_OPERATORS = {
+    'outsideof': lambda vals, val1, val2: (vals < val1) | (vals > val2),
+    'within': lambda vals, val1, val2: (vals > val1) & (vals < val2),
+    '==': lambda vals, val1, val2: vals == val1,
+    '<': lambda vals, val1, val2: vals < val1,
+    '<=': lambda vals, val1, val2: vals <= val1,
+    '>': lambda vals, val1, val2: vals > val1,
+    '>=': lambda vals, val1, val2: vals >= val1,
+}
+
+# Keys match Trigger.NumChannelsOperator values, 'any' and 'all' are
+# handled separately
+NUM_CHANNELS_OPERATORS = {
+    '==': np.equal,
+    '<': np.less,
+    '>': np.greater,
+}
+
+
+def stat_array(channel_values, stat):
+    '''Return the stat for each channel as a float array, None -> NaN'''
+    return np.array(
+        [np.nan if channel_value[stat] is None else channel_value[stat]
+         for channel_value in channel_values],
+        dtype=float)
+
+
+def breaching_masks(values, triggers):
+    '''
+    Return a (triggers x channels) boolean array of which channels are
+    breaching each trigger. values may have extra trailing axes, e.g.
+    (channels x times), which are kept in the result
+    '''
+    values = np.asarray(values, dtype=float)
+    masks = np.zeros((len(triggers),) + values.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for i, trigger in enumerate(triggers):
+            masks[i] = VALUE_OPERATORS[trigger.value_operator](
+                values, trigger.val1, trigger.val2)
+    return masks
+
+
+def in_alarm_states(n_breaching, triggers, total_channels):
+    '''
+    Return a boolean array of whether each trigger is in alarm given the
+    number of breaching channels for each trigger. n_breaching may have a
+    trailing axis of evaluation times, i.e. (triggers x times)
+    '''
+    n_breaching = np.asarray(n_breaching)
+    operators = np.array(
+        [trigger.num_channels_operator for trigger in triggers], dtype=object)
+    # num_channels may be null. As in Trigger.in_alarm_state, == is then
+    # never true and < or > raise TypeError
+    unset = np.array(
+        [trigger.num_channels is None for trigger in triggers], dtype=bool)
+    num_channels = np.array(
+        [trigger.num_channels or 0 for trigger in triggers], dtype=int)
+
+    # Broadcast num_channels over any trailing axes of n_breaching
+    num_channels = num_channels.reshape(
+        (-1,) + (1,) * (n_breaching.ndim - 1))
+
+    in_alarm = np.zeros(n_breaching.shape, dtype=bool)
+    any_mask = operators == 'any'
+    in_alarm[any_mask] = n_breaching[any_mask] > 0
+    all_mask = operators == 'all'
+    in_alarm[all_mask] = n_breaching[all_mask] == total_channels
+    for op, func in NUM_CHANNELS_OPERATORS.items():
+        mask = operators == op
+        if op != '==' and (mask & unset).any():
+            raise TypeError(f"'{op}' not supported between instances of "
+                            "'int' and 'NoneType'")
+        in_alarm[mask] = func(n_breaching[mask], num_channels[mask])
+    in_alarm[(operators == '==') & unset] = False
+    return in_alarm
+
+
+def evaluate_triggers(stat, triggers, channel_values, context):
+    '''
+    Evaluate all triggers of a monitor against its aggregate values.
+
+    stat: the monitor stat to compare
+    triggers: list of Trigger
+    channel_values: list of dicts from Monitor.agg_measurements
+    context: ChannelContext with channel names and count
+
+    Returns a list of (trigger, breaching_channels, in_alarm)
+    '''
+    triggers = list(triggers)
+    if not triggers:
+        return []
+
+    # Channels that no longer exist are never breaching
+    channel_values = [channel_value for channel_value in channel_values
+                      if channel_value['channel'] in context.names]
+    masks = breaching_masks(stat_array(channel_values, stat), triggers)
+    in_alarm = in_alarm_states(masks.sum(axis=1), triggers, context.count)
+
+    results = []
+    for i, trigger in enumerate(triggers):
+        breaching_channels = []
+        for j in np.flatnonzero(masks[i]):
+            channel_value = channel_values[j]
+            value = channel_value[stat]
+            breaching_channels.append({
+                'channel': context.names[channel_value['channel']],
+                'channel_id': channel_value['channel'],
+                stat: value,
+                'value': value
+            })
+        breaching_channels.sort(key=lambda channel: channel['channel'])
+        results.append((trigger, breaching_channels, bool(in_alarm[i])))
+    return results
@@ -0,0 +1,258 @@
+'''
+Batched evaluation of monitors
+
+Monitors that share a metric and an interval window are aggregated with a
+single query over the union of their channels. The per-channel results are
+then fanned out to each monitor, so the number of aggregate queries per run
+grows with the number of distinct (metric, window) pairs rather than with the
+number of monitors.
+
+Batches can be evaluated concurrently in a thread pool. Each thread uses its
+own database connection, and every monitor runs with a time budget that is
+enforced both by Postgres (statement_timeout) and between queries. The
+aggregate of a batch gets the budgets of all of its monitors, and if it
+fails anyway the monitors are evaluated one by one.
+'''
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.db import connection, DatabaseError
+
+from measurement.archive_windows import agg_window, use_archives
+from measurement.models import (Measurement, ChannelContext,
+                                agg_channel_values, default_channel_value)
+from nslc.models import Group
+
+
+def get_group_channels(group_ids):
+    '''Return a dict of group id -> list of channel ids in one query'''
+    group_channels = {group_id: [] for group_id in group_ids}
+    memberships = Group.channels.through.objects.filter(
+        group_id__in=group_ids).values_list('group_id', 'channel_id')
+    for group_id, channel_id in memberships:
+        group_channels[group_id].append(channel_id)
+    return group_channels
+
+
+def batch_monitors(monitors, endtime):
+    '''
+    Group monitors by (metric, window). Monitors that are not time-based
+    are returned separately since they can't share aggregates
+    '''
+    batches = defaultdict(list)
+    unbatched = []
+    for monitor in monitors:
+        window = monitor.get_window(endtime)
+        if window is None:
+            unbatched.append(monitor)
+        else:
+            batches[(monitor.metric_id, window)].append(monitor)
+    return batches, unbatched
+
+
+def agg_batch(metric_id, window, channel_ids):
+    '''
+    Calculate aggregate values for every channel in channel_ids. Returns a
+    dict of channel id -> aggregate values. Long windows are read from
+    archives where possible, see measurement.archive_windows
+    '''
+    if not channel_ids:
+        return {}
+    if use_archives(window):
+        return agg_window(metric_id, window, channel_ids)
+    q_data = Measurement.objects.filter(
+        metric_id=metric_id,
+        starttime__range=window,
+        channel_id__in=channel_ids
+    )
+    return {obj['channel']: obj for obj in agg_channel_values(q_data)}
+
+
+def fan_out(channel_ids, agg_values):
+    '''Build the agg_measurements() style list for a single monitor'''
+    return [agg_values.get(channel_id, default_channel_value(channel_id))
+            for channel_id in channel_ids]
+
+
+class BudgetExceeded(Exception):
+    '''Raised when a monitor runs past its time budget'''
+    pass
+
+
+class MonitorRun:
+    '''
+    Tracks the duration and number of queries used to evaluate a single
+    monitor. Used as a database execute wrapper so it sees every query run
+    on the current thread's connection
+    '''
+
+    def __init__(self, monitor, budget_seconds=None):
+        self.monitor = monitor
+        self.budget_seconds = budget_seconds
+        self.queries = 0
+        self.duration = 0
+        self.error = None
+        self.skipped = False
+        self.starttime = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.budget_seconds and self.elapsed() > self.budget_seconds:
+            raise BudgetExceeded(
+                f'Exceeded budget of {self.budget_seconds} seconds')
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def elapsed(self):
+        return time.monotonic() - self.starttime
+
+    def run(self, func, *args, **kwargs):
+        '''Call func, recording time and queries instead of raising'''
+        self.starttime = time.monotonic()
+        set_statement_timeout(self.budget_seconds)
+        try:
+            with connection.execute_wrapper(self):
+                func(*args, **kwargs)
+        except (BudgetExceeded, DatabaseError) as e:
+            self.error = e
+        finally:
+            set_statement_timeout(None)
+            self.duration = self.elapsed()
+        return self
+
+    def __str__(self):
+        if self.skipped:
+            status = 'skipped'
+        elif self.error:
+            status = f'failed ({self.error})'
+        else:
+            status = 'ok'
+        return (f'{self.monitor.id}: {str(self.monitor)}, '
+                f'{self.duration:.2f}s, {self.queries} queries, {status}')
+
+
+def set_statement_timeout(seconds):
+    '''Set the postgres statement timeout for the current connection'''
+    with connection.cursor() as cursor:
+        if seconds:
+            cursor.execute('SET statement_timeout = %s',
+                           [int(seconds * 1000)])
+        else:
+            cursor.execute('SET statement_timeout = DEFAULT')
+
+
+def evaluate_batch(monitors, window, group_channels, endtime,
+                   budget_seconds=None, deadline=None):
+    '''
+    Aggregate once for a batch of monitors and evaluate each of them.
+    Returns a MonitorRun for each monitor. Monitors that have not started by
+    the deadline (a time.monotonic() value) are skipped
+    '''
+    runs = [MonitorRun(monitor, budget_seconds) for monitor in monitors]
+    if deadline and time.monotonic() > deadline:
+        for run in runs:
+            run.skipped = True
+        return runs
+
+    # The shared aggregate and channel names have a budget for the whole
+    # batch, and are reported as part of the first monitor
+    agg_values = {}
+    contexts = []
+    channel_ids = set()
+    for monitor in monitors:
+        channel_ids.update(group_channels[monitor.channel_group_id])
+
+    def aggregate():
+        agg_values.update(
+            agg_batch(monitors[0].metric_id, window, channel_ids))
+        contexts.append(ChannelContext.for_channels(channel_ids))
+
+    shared = MonitorRun(
+        monitors[0], budget_seconds and budget_seconds * len(monitors))
+    shared.run(aggregate)
+    if shared.error:
+        # Fall back to aggregating for each monitor on its own budget
+        runs = []
+        for monitor in monitors:
+            runs += evaluate_single(monitor, endtime, budget_seconds,
+                                    deadline)
+        return runs
+
+    for run in runs:
+        if deadline and time.monotonic() > deadline:
+            run.skipped = True
+            continue
+        monitor = run.monitor
+        channel_ids = group_channels[monitor.channel_group_id]
+        run.run(monitor.evaluate_alarm,
+                endtime=endtime,
+                channel_values=fan_out(channel_ids, agg_values),
+                context=contexts[0].subset(channel_ids),
+                check_digest=False)
+    runs[0].queries += shared.queries
+    runs[0].duration += shared.duration
+    return runs
+
+
+def evaluate_single(monitor, endtime, budget_seconds=None, deadline=None):
+    '''Evaluate a monitor that can't be batched'''
+    run = MonitorRun(monitor, budget_seconds)
+    if deadline and time.monotonic() > deadline:
+        run.skipped = True
+        return [run]
+    return [run.run(monitor.evaluate_alarm, endtime=endtime,
+                    check_digest=False)]
+
+
+def run_in_thread(func, *args):
+    '''
+    Run a task in a worker thread. Django opens a connection per thread, so
+    close it once the task is done rather than leaving it to the pool
+    '''
+    try:
+        return func(*args)
+    finally:
+        connection.close()
+
+
+def evaluate_monitors(monitors, endtime, workers=1, budget_seconds=None,
+                      deadline_seconds=None):
+    '''
+    Evaluate all monitors, sharing aggregates where possible. Returns a list
+    of MonitorRun. Daily digests are left to measurement.digest.
+
+    workers: number of threads to evaluate batches in. Each thread gets its
+        own database connection
+    budget_seconds: time budget for each monitor
+    deadline_seconds: monitors that have not started this many seconds
+        after the run began are skipped, which bounds the total wall time
+    '''
+    monitors = list(monitors)
+    deadline = None
+    if deadline_seconds:
+        deadline = time.monotonic() + deadline_seconds
+    batches, unbatched = batch_monitors(monitors, endtime)
+    group_channels = get_group_channels(
+        {monitor.channel_group_id for monitor in monitors})
+
+    tasks = [
+        (evaluate_batch,
+         (batch, window, group_channels, endtime, budget_seconds, deadline))
+        for (metric_id, window), batch in batches.items()
+    ]
+    tasks += [
+        (evaluate_single, (monitor, endtime, budget_seconds, deadline))
+        for monitor in unbatched
+    ]
+
+    runs = []
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_in_thread, func, *args)
+                       for func, args in tasks]
+            for future in futures:
+                runs += future.result()
+    else:
+        for func, args in tasks:
+            runs += func(*args)
+    return runs
@@ -0,0 +1,289 @@
+'''
+Incremental alarm evaluation
+
+Minute-interval monitors can be evaluated as measurements arrive instead of
+once an hour. On ingest, every (monitor, channel) pair the measurement falls
+into gets its sliding window state updated (ChannelWindow). The state holds
+one bucket per minute with count/sum/min/max/minabs/maxabs and a small
+sorted sketch of [value, weight] pairs for median/p90/p95. Expired buckets
+are dropped, so the state stays the size of the monitor window.
+
+Monitors whose windows changed are marked with window_changed_at and picked
+up by the evaluate_incremental_alarms command once the first change is older
+than the debounce period, so a burst of posts results in one evaluation.
+The sketch is exact while a bucket has at most SKETCH_SIZE values.
+'''
+from bisect import insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import DateTimeField, Value
+from django.db.models.functions import Coalesce
+import numpy as np
+import pytz
+
+from measurement.evaluation import get_group_channels
+from measurement.models import (ChannelContext, ChannelWindow, Measurement,
+                                Monitor, default_channel_value)
+from nslc.models import Group
+
+SKETCH_SIZE = 64
+
+PERCENTILES = {'median': 50, 'p90': 90, 'p95': 95}
+
+
+def minute_key(time):
+    '''Bucket key for a datetime, minutes since epoch as a string'''
+    return str(int(time.timestamp()) // 60)
+
+
+def new_bucket():
+    return {'n': 0, 's': 0.0, 'min': None, 'max': None, 'amin': None,
+            'amax': None, 'q': [], 't': []}
+
+
+def add_value(bucket, starttime, value):
+    '''Add a single measurement value to a bucket'''
+    bucket['n'] += 1
+    bucket['s'] += value
+    bucket['min'] = value if bucket['min'] is None else min(bucket['min'],
+                                                            value)
+    bucket['max'] = value if bucket['max'] is None else max(bucket['max'],
+                                                            value)
+    bucket['amin'] = (abs(value) if bucket['amin'] is None
+                      else min(bucket['amin'], abs(value)))
+    bucket['amax'] = (abs(value) if bucket['amax'] is None
+                      else max(bucket['amax'], abs(value)))
+    bucket['t'].append(starttime.timestamp())
+    insort(bucket['q'], [value, 1])
+    if len(bucket['q']) > SKETCH_SIZE:
+        # Merge the lightest pair of neighbouring values into their
+        # weighted mean
+        q = bucket['q']
+        i = min(range(len(q) - 1), key=lambda i: q[i][1] + q[i + 1][1])
+        (value1, weight1), (value2, weight2) = q[i], q[i + 1]
+        weight = weight1 + weight2
+        q[i:i + 2] = [[(value1 * weight1 + value2 * weight2) / weight,
+                       weight]]
+
+
+def build_bucket(measurements):
+    bucket = new_bucket()
+    for measurement in measurements:
+        add_value(bucket, measurement.starttime, measurement.value)
+    return bucket
+
+
+def weighted_percentiles(buckets):
+    '''
+    Percentiles over the sketches of several buckets. If every sketch is
+    exact this matches postgres percentile_cont
+    '''
+    pairs = np.array([pair for bucket in buckets for pair in bucket['q']],
+                     dtype=float)
+    values, weights = pairs[:, 0], pairs[:, 1]
+    if np.all(weights == 1):
+        return dict(zip(PERCENTILES, np.percentile(
+            values, list(PERCENTILES.values())).tolist()))
+
+    order = np.argsort(values)
+    values, weights = values[order], weights[order]
+    # Interpolate on the midpoint of each value's weight
+    positions = np.cumsum(weights) - weights / 2
+    total = weights.sum()
+    return {stat: float(np.interp(percentile / 100 * total, positions,
+                                  values))
+            for stat, percentile in PERCENTILES.items()}
+
+
+def window_value(channel_id, buckets, starttime, endtime):
+    '''
+    Aggregate the buckets that fall in [starttime, endtime) into the same
+    form as Monitor.agg_measurements
+    '''
+    start_key, end_key = int(minute_key(starttime)), int(minute_key(endtime))
+    buckets = [bucket for key, bucket in buckets.items()
+               if start_key <= int(key) < end_key and bucket['n']]
+    if not buckets:
+        return default_channel_value(channel_id)
+
+    count = sum(bucket['n'] for bucket in buckets)
+    total = sum(bucket['s'] for bucket in buckets)
+    channel_value = {
+        'channel': channel_id,
+        'count': count,
+        'sum': total,
+        'avg': total / count,
+        'min': min(bucket['min'] for bucket in buckets),
+        'max': max(bucket['max'] for bucket in buckets),
+        'minabs': min(bucket['amin'] for bucket in buckets),
+        'maxabs': max(bucket['amax'] for bucket in buckets),
+    }
+    channel_value.update(weighted_percentiles(buckets))
+    return channel_value
+
+
+def get_incremental_monitors():
+    return Monitor.objects.filter(interval_type=Monitor.IntervalType.MINUTE)
+
+
+def record_measurements(measurements, now=None):
+    '''
+    Update the window state of every incremental monitor that the
+    measurements fall into and mark those monitors as changed
+    '''
+    if not measurements:
+        return []
+    if not now:
+        now = datetime.now(tz=pytz.UTC)
+
+    by_metric_channel = defaultdict(list)
+    for measurement in measurements:
+        by_metric_channel[(measurement.metric_id,
+                           measurement.channel_id)].append(measurement)
+    metric_ids = {key[0] for key in by_metric_channel}
+    channel_ids = {key[1] for key in by_metric_channel}
+
+    monitors = list(get_incremental_monitors().filter(
+        metric_id__in=metric_ids,
+        channel_group__channels__in=channel_ids).distinct())
+    if not monitors:
+        return []
+
+    group_channels = defaultdict(set)
+    memberships = Group.channels.through.objects.filter(
+        group_id__in={monitor.channel_group_id for monitor in monitors},
+        channel_id__in=channel_ids).values_list('group_id', 'channel_id')
+    for group_id, channel_id in memberships:
+        group_channels[group_id].add(channel_id)
+
+    # Only keep measurements that are still inside the monitor's window
+    updates = {}
+    oldest = {}
+    for monitor in monitors:
+        oldest[monitor.id] = now - timedelta(
+            seconds=monitor.calc_interval_seconds() + 60)
+        for channel_id in group_channels[monitor.channel_group_id]:
+            recent = [
+                measurement for measurement in by_metric_channel.get(
+                    (monitor.metric_id, channel_id), [])
+                if measurement.starttime >= oldest[monitor.id]]
+            if recent:
+                updates[(monitor.id, channel_id)] = recent
+    if not updates:
+        return []
+
+    changed_monitors = {key[0] for key in updates}
+    with transaction.atomic():
+        windows = lock_windows(updates)
+        missing = [key for key in updates if key not in windows]
+        if missing:
+            # Create empty windows and lock them like the others, so that
+            # when another request creates the same window first, this one
+            # waits and adds its buckets to it instead of losing them
+            ChannelWindow.objects.bulk_create(
+                [ChannelWindow(monitor_id=monitor_id, channel_id=channel_id,
+                               buckets={})
+                 for monitor_id, channel_id in missing],
+                ignore_conflicts=True)
+            windows.update(lock_windows(missing))
+
+        for (monitor_id, channel_id), recent in updates.items():
+            window = windows[(monitor_id, channel_id)]
+            update_window(window, recent, oldest[monitor_id])
+            window.updated_at = now
+        ChannelWindow.objects.bulk_update(
+            [windows[key] for key in updates], ['buckets', 'updated_at'])
+
+        # Keep the time of the first unevaluated change for debouncing
+        Monitor.objects.filter(id__in=changed_monitors).update(
+            window_changed_at=Coalesce(
+                'window_changed_at',
+                Value(now, output_field=DateTimeField())))
+    return changed_monitors
+
+
+def lock_windows(keys):
+    '''
+    Select the existing windows of (monitor_id, channel_id) keys for update,
+    in a consistent order. Returns a dict of key -> window
+    '''
+    windows = ChannelWindow.objects.select_for_update().filter(
+        monitor_id__in={key[0] for key in keys},
+        channel_id__in={key[1] for key in keys}
+    ).order_by('monitor_id', 'channel_id')
+    return {(window.monitor_id, window.channel_id): window
+            for window in windows}
+
+
+def update_window(window, measurements, oldest):
+    '''Add measurements to a window and drop buckets older than oldest'''
+    rebuild = set()
+    for measurement in measurements:
+        key = minute_key(measurement.starttime)
+        bucket = window.buckets.setdefault(key, new_bucket())
+        if measurement.starttime.timestamp() in bucket['t']:
+            # Measurement was updated, rebuild the bucket from the database
+            rebuild.add(key)
+        else:
+            add_value(bucket, measurement.starttime, measurement.value)
+
+    metric_id = measurements[0].metric_id
+    for key in rebuild:
+        starttime = datetime.fromtimestamp(int(key) * 60, tz=pytz.UTC)
+        window.buckets[key] = build_bucket(Measurement.objects.filter(
+            metric_id=metric_id,
+            channel_id=window.channel_id,
+            starttime__gte=starttime,
+            starttime__lt=starttime + timedelta(minutes=1)))
+
+    oldest_key = int(minute_key(oldest))
+    for key in [key for key in window.buckets if int(key) < oldest_key]:
+        del window.buckets[key]
+
+
+def evaluate_pending(debounce_seconds=0, now=None):
+    '''
+    Evaluate incremental monitors whose windows changed at least
+    debounce_seconds ago. Returns the evaluated monitors
+    '''
+    if not now:
+        now = datetime.now(tz=pytz.UTC)
+    endtime = now.replace(second=0, microsecond=0)
+
+    monitors = list(get_incremental_monitors().filter(
+        window_changed_at__lte=now - timedelta(seconds=debounce_seconds)
+    ).select_related('channel_group', 'metric'))
+    if not monitors:
+        return []
+
+    group_channels = get_group_channels(
+        {monitor.channel_group_id for monitor in monitors})
+    windows = {
+        (monitor_id, channel_id): buckets
+        for monitor_id, channel_id, buckets in ChannelWindow.objects.filter(
+            monitor__in=monitors).values_list(
+                'monitor_id', 'channel_id', 'buckets')
+    }
+    context = ChannelContext.for_channels(
+        {channel_id for channel_ids in group_channels.values()
+         for channel_id in channel_ids})
+
+    for monitor in monitors:
+        starttime, endtime = monitor.get_window(endtime)
+        channel_ids = group_channels[monitor.channel_group_id]
+        channel_values = [
+            window_value(channel_id, windows.get((monitor.id, channel_id), {}),
+                         starttime, endtime)
+            for channel_id in channel_ids]
+        monitor.evaluate_alarm(endtime=endtime,
+                               channel_values=channel_values,
+                               context=context.subset(channel_ids),
+                               check_digest=False)
+        # Leave the monitor marked if it changed again while evaluating
+        Monitor.objects.filter(
+            pk=monitor.pk,
+            window_changed_at=monitor.window_changed_at
+        ).update(window_changed_at=None)
+    return monitors
@@ -0,0 +1,28 @@
+'''
+Custom field lookups, registered in MeasurementConfig.ready()
+'''
+from django.db.models import ForeignKey, IntegerField, Lookup
+
+
+class AnyArray(Lookup):
+    """
+    column = ANY(%s) with the values passed as a single array parameter.
+    Unlike __in the query text doesn't grow with the number of values
+
+        Measurement.objects.filter(channel__any=[1, 2, 3])
+    """
+    lookup_name = 'any'
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        return [int(value) for value in self.rhs]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        db_type = self.lhs.output_field.rel_db_type(connection)
+        return f'{lhs} = ANY(%s::{db_type}[])', lhs_params + [self.rhs]
+
+
+def register_lookups():
+    ForeignKey.register_lookup(AnyArray)
+    IntegerField.register_lookup(AnyArray)
@@ -0,0 +1,125 @@
+'''
+Dispatch queued emails
+
+Alerts and digests are queued as OutboundEmail rows during evaluation. The
+dispatcher sends them with a single mail connection per batch, combines
+everything waiting for a recipient into one message, and backs off
+exponentially when sending to a recipient fails. Emails that failed
+MAX_ATTEMPTS times are logged as errors, which also mails the admins, and
+kept for FAILED_KEEP_DAYS to be looked into.
+'''
+from collections import defaultdict
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from measurement.models import OutboundEmail
+
+RETRY_SECONDS = 60
+MAX_ATTEMPTS = 6
+# Sent emails are deleted after this long
+KEEP_DAYS = 7
+# Emails that were given up on are deleted this long after being queued
+FAILED_KEEP_DAYS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def combine(emails):
+    '''Build a single message for a list of OutboundEmail to one recipient'''
+    if len(emails) == 1:
+        email = emails[0]
+        return email.subject, email.message, email.html_message
+
+    subject = f"SQUAC: {len(emails)} notifications"
+    separator = '\n\n' + '-' * 72 + '\n\n'
+    message = separator.join(
+        f"{email.subject}\n\n{email.message}" for email in emails)
+    html_message = ''
+    if all(email.html_message for email in emails):
+        html_message = '<hr>'.join(email.html_message for email in emails)
+    return subject, message, html_message
+
+
+def build_message(recipient, emails, connection):
+    subject, message, html_message = combine(emails)
+    email_message = EmailMultiAlternatives(
+        subject, message, settings.EMAIL_NO_REPLY, [recipient],
+        connection=connection)
+    if html_message:
+        email_message.attach_alternative(html_message, 'text/html')
+    return email_message
+
+
+def mark_failed(emails, error, now):
+    for email in emails:
+        email.attempts += 1
+        email.last_error = str(error)
+        email.send_after = now + timedelta(
+            seconds=RETRY_SECONDS * 2 ** (email.attempts - 1))
+    OutboundEmail.objects.bulk_update(
+        emails, ['attempts', 'last_error', 'send_after'])
+    for email in emails:
+        if email.attempts >= MAX_ATTEMPTS:
+            logger.error(
+                'Gave up sending email %s "%s" to %s after %s attempts: %s',
+                email.id, email.subject, email.recipient, email.attempts,
+                email.last_error)
+
+
+def dispatch_emails(batch_size=500, now=None):
+    '''
+    Send queued emails that are due. Returns the number of (sent, failed)
+    messages, where each message can hold several queued emails
+    '''
+    if not now:
+        now = timezone.now()
+    old_sent = Q(sent_at__lt=now - timedelta(days=KEEP_DAYS))
+    given_up = Q(sent_at__isnull=True, attempts__gte=MAX_ATTEMPTS,
+                 created_at__lt=now - timedelta(days=FAILED_KEEP_DAYS))
+    OutboundEmail.objects.filter(old_sent | given_up).delete()
+
+    sent, failed = 0, 0
+    with transaction.atomic():
+        # Rows stay locked while sending so concurrent dispatchers skip them
+        pending = list(OutboundEmail.objects.select_for_update(
+            skip_locked=True).filter(
+                sent_at__isnull=True,
+                attempts__lt=MAX_ATTEMPTS,
+                send_after__lte=now
+        ).order_by('created_at')[:batch_size])
+        if not pending:
+            return sent, failed
+
+        by_recipient = defaultdict(list)
+        for email in pending:
+            by_recipient[email.recipient].append(email)
+
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            mark_failed(pending, e, now)
+            return sent, len(by_recipient)
+
+        sent_ids = []
+        try:
+            for recipient, emails in by_recipient.items():
+                try:
+                    connection.send_messages(
+                        [build_message(recipient, emails, connection)])
+                except Exception as e:
+                    mark_failed(emails, e, now)
+                    failed += 1
+                else:
+                    sent_ids += [email.id for email in emails]
+                    sent += 1
+        finally:
+            connection.close()
+        OutboundEmail.objects.filter(id__in=sent_ids).update(sent_at=now)
+    return sent, failed
@@ -1,22 +1,33 @@
 from django.core.management.base import BaseCommand
 from django.db.models import (Avg, StdDev, Min, Max, Count, F, FloatField,
                               Value as V)
-from django.db.models.functions import (TruncDay, TruncMonth, TruncWeek,
-                                        Coalesce, Concat)
-from measurement.models import (Measurement, ArchiveDay, ArchiveMonth,
-                                ArchiveWeek)
-from measurement.aggregates.percentile import Percentile
+from django.db.models.functions import (TruncHour, TruncDay, TruncMonth,
+                                        TruncWeek, Coalesce, Concat, Abs)
+from measurement.models import (Measurement, ArchiveBase, ArchiveHour,
+                                ArchiveDay, ArchiveMonth, ArchiveWeek)
+from measurement.aggregates.percentile import Percentile, Percentiles
 from datetime import datetime
 from dateutil.relativedelta import relativedelta, MO
 import pytz
 
 
+def parse_period_end(value):
+    '''Parse mm-dd-yyyy or mm-dd-yyyyThh as UTC'''
+    for date_format in ("%m-%d-%Y", "%m-%d-%YT%H"):
+        try:
+            return pytz.utc.localize(datetime.strptime(value, date_format))
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid period_end: {value}")
+
+
 class Command(BaseCommand):
     """ Command for creating archive entries"""
 
     help = 'Archives Measurements for the given time period'
 
     TIME_TRUNCATOR = {
+        'hour': TruncHour,
         'day': TruncDay,
         'week': TruncWeek,
         'month': TruncMonth,
@@ -24,6 +35,7 @@ class Command(BaseCommand):
     """" Django datetime extractors for dealing with portions of datetimes """
 
     DURATIONS = {
+        'hour': lambda count: relativedelta(hours=count),
         'day': lambda count: relativedelta(days=count),
         'week': lambda count: relativedelta(weeks=count),
         'month': lambda count: relativedelta(months=count),
@@ -31,6 +43,7 @@ class Command(BaseCommand):
     """ functions for generating timesteps of sizes """
 
     ARCHIVE_TYPE = {
+        'hour': ArchiveHour,
         'day': ArchiveDay,
         'week': ArchiveWeek,
         'month': ArchiveMonth
@@ -39,17 +52,19 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('archive_type',
-                            choices=['day', 'week', 'month'],
+                            choices=['hour', 'day', 'week', 'month'],
                             help=('The granularity of the desired archive '
-                                  '(i.e. day, week, month, etc.)'))
+                                  '(i.e. hour, day, week, month, etc.)'))
         parser.add_argument('--period_end',
-                            type=lambda s: pytz.utc.localize(
-                                datetime.strptime(s, "%m-%d-%Y")),
+                            type=parse_period_end,
                             nargs='?',
-                            default=datetime.now(tz=pytz.utc).replace(
-                                hour=0, minute=0, second=0, microsecond=0),
+                            default=None,
                             help=('The end of the archiving period, '
-                                  'non-inclusive (format: mm-dd-yyyy)'))
+                                  'non-inclusive (format: mm-dd-yyyy or '
+                                  'mm-dd-yyyyThh for hour archives). '
+                                  'Defaults to the start of the current '
+                                  'hour for hour archives, otherwise the '
+                                  'start of today'))
         parser.add_argument('--metric', action='append',
                             help='id of the metric to be archived',
                             default=[])
@@ -64,6 +79,11 @@ class Command(BaseCommand):
         metrics = kwargs['metric']
         overwrite = kwargs['overwrite']
         period_end = kwargs['period_end']
+        if period_end is None:
+            period_end = datetime.now(tz=pytz.utc).replace(
+                minute=0, second=0, microsecond=0)
+            if archive_type != 'hour':
+                period_end = period_end.replace(hour=0)
         # in order to make archives for longer periods use backfill_archives,
         # which calls this command
         period_size = 1
@@ -163,13 +183,16 @@ class Command(BaseCommand):
             p05=Percentile('value', percentile=0.05),
             p10=Percentile('value', percentile=0.10),
             p90=Percentile('value', percentile=0.90),
-            p95=Percentile('value', percentile=0.95)
+            p95=Percentile('value', percentile=0.95),
+            quantiles=Percentiles('value', ArchiveBase.QUANTILES),
+            min_abs=Min(Abs('value'))
         )
 
         # select only columns that will be stored in Archive model
         filtered_archive_data = archive_data.values(
             'channel_id', 'metric_id', 'min', 'max', 'mean',
-            'median', 'stdev', 'p05', 'p10', 'p90', 'p95',
+            'median', 'stdev', 'p05', 'p10', 'p90', 'p95', 'quantiles',
+            'min_abs',
             'num_samps', 'starttime', 'endtime')
 
         return filtered_archive_data
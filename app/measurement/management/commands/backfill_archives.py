@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.management import call_command
+from measurement.management.commands.archive_measurements import \
+    parse_period_end
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
@@ -20,6 +22,7 @@ class Command(BaseCommand):
     """
 
     DURATIONS = {
+        'hour': lambda count: relativedelta(hours=count),
         'day': lambda count: relativedelta(days=count),
         'week': lambda count: relativedelta(weeks=count),
         'month': lambda count: relativedelta(months=count)
@@ -28,7 +31,7 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
             'archive_type',
-            choices=['day', 'week', 'month']
+            choices=['hour', 'day', 'week', 'month']
         )
         parser.add_argument(
             '--start_time',
@@ -41,11 +44,12 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             '--end_time',
-            type=lambda s: pytz.utc.localize(datetime.strptime(s, "%m-%d-%Y")),
+            type=parse_period_end,
             nargs='?',
-            default=datetime.now(tz=pytz.utc).replace(
-                hour=0, minute=0, second=0, microsecond=0),
-            help="When to stop calling backup (inclusive, format: MM-DD-YYYY)"
+            default=None,
+            help=("When to stop calling backup (inclusive, format: MM-DD-YYYY "
+                  "or MM-DD-YYYYTHH). Defaults to the start of the current "
+                  "hour for hour archives, otherwise the start of today")
         )
         parser.add_argument(
             '--period_size',
@@ -66,6 +70,13 @@ class Command(BaseCommand):
         current_time = kwargs['start_time']
         end_time = kwargs['end_time']
         period_size = kwargs['period_size']
+        if end_time is None:
+            end_time = datetime.now(tz=pytz.utc).replace(
+                minute=0, second=0, microsecond=0)
+            if archive_type != 'hour':
+                end_time = end_time.replace(hour=0)
+        # Hour archives need the hour in period_end
+        date_format = "%m-%d-%YT%H" if archive_type == 'hour' else "%m-%d-%Y"
 
         if kwargs['overwrite']:
             overwrite = '--overwrite'
@@ -78,15 +89,15 @@ class Command(BaseCommand):
 
         self.stdout.write(
             f'Calling archive_measurement for each {archive_type} from'
-            f' {current_time.strftime("%m-%d-%Y")} to'
-            f' {end_time.strftime("%m-%d-%Y")} with {overwrite}'
+            f' {current_time.strftime(date_format)} to'
+            f' {end_time.strftime(date_format)} with {overwrite}'
         )
 
         while current_time <= end_time:
             call_command('archive_measurements',
                          archive_type,
                          overwrite,
-                         f'--period_end={current_time.strftime("%m-%d-%Y")}',
+                         f'--period_end={current_time.strftime(date_format)}',
                          stdout=self.stdout)
 
             current_time = current_time + self.DURATIONS[archive_type](1)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from datetime import datetime, timedelta
+import pytz
+
+
+class Command(BaseCommand):
+    '''
+    Apply the alert retention policy. Alerts older than compact_after_days
+    that repeat the previous alert of the same trigger (still in alarm with
+    the same breaching channels) are deleted, so only state transitions are
+    kept. Alerts older than delete_after_days are deleted, except for the
+    latest alert of each trigger.
+    '''
+
+    # Repeated in alarm rows, the first row of each run is kept. Older
+    # alerts store their channels as JSON in breaching_channels
+    COMPACT_SQL = '''
+        DELETE FROM measurement_alert AS alert
+        USING (
+            SELECT id, "timestamp"
+            FROM (
+                SELECT id, "timestamp", in_alarm, breaching_channel_ids,
+                    breaching_channels,
+                    LAG(in_alarm) OVER w AS prev_in_alarm,
+                    LAG(breaching_channel_ids) OVER w AS prev_channel_ids,
+                    LAG(breaching_channels) OVER w AS prev_channels
+                FROM measurement_alert
+                WHERE "timestamp" < %s
+                WINDOW w AS (PARTITION BY trigger_id ORDER BY "timestamp")
+            ) AS history
+            WHERE in_alarm AND prev_in_alarm
+                AND breaching_channel_ids = prev_channel_ids
+                AND breaching_channels IS NOT DISTINCT FROM prev_channels
+        ) AS repeated
+        WHERE alert.id = repeated.id
+            AND alert."timestamp" = repeated."timestamp";
+        '''
+
+    DELETE_SQL = '''
+        DELETE FROM measurement_alert
+        WHERE "timestamp" < %s
+            AND id NOT IN (
+                SELECT DISTINCT ON (trigger_id) id
+                FROM measurement_alert
+                ORDER BY trigger_id, "timestamp" DESC
+            );
+        '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact_after_days', type=int,
+                            default=settings.ALERT_COMPACT_AFTER_DAYS,
+                            help='Compact alerts older than this')
+        parser.add_argument('--delete_after_days', type=int,
+                            default=settings.ALERT_DELETE_AFTER_DAYS,
+                            help='Delete alerts older than this')
+
+    def handle(self, *args, **options):
+        '''method called by manager'''
+        now = datetime.now(tz=pytz.UTC)
+        n_compacted, n_deleted = 0, 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            if options['compact_after_days'] is not None:
+                cursor.execute(self.COMPACT_SQL, [
+                    now - timedelta(days=options['compact_after_days'])])
+                n_compacted = cursor.rowcount
+            if options['delete_after_days'] is not None:
+                cursor.execute(self.DELETE_SQL, [
+                    now - timedelta(days=options['delete_after_days'])])
+                n_deleted = cursor.rowcount
+
+        self.stdout.write(
+            f"Compacted {n_compacted} alerts, deleted {n_deleted} alerts")
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.utils import DatabaseError
+from psycopg2.extensions import AsIs
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.mail import send_mail
+
+
+class Command(BaseCommand):
+    '''
+    CREATE monthly partitions of measurement_alert for the current month and
+    the next [num_months]. Does nothing if measurement_alert has not been
+    partitioned, see sql/alert.sql
+    '''
+    NUM_MONTHS = 3
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--num_months',
+            type=int,
+            default=self.NUM_MONTHS,
+            help="number of months ahead to create partitions for"
+        )
+
+    def is_partitioned(self, cursor):
+        '''check whether measurement_alert is a partitioned table'''
+        cursor.execute('''
+            SELECT 1
+            FROM pg_partitioned_table
+            WHERE partrelid = 'measurement_alert'::regclass;
+            ''')
+        return cursor.fetchone() is not None
+
+    def handle(self, *args, **options):
+        '''method called by manager'''
+        sql = '''CREATE TABLE IF NOT EXISTS measurement_alert_%s
+                PARTITION OF measurement_alert
+                FOR VALUES FROM (%s) TO (%s);'''
+        sql_grant = '''GRANT ALL PRIVILEGES
+                ON TABLE measurement_alert_%s
+                TO %s; '''
+
+        month = datetime.now().date().replace(day=1)
+        errors = []
+        with connection.cursor() as cursor:
+            if not self.is_partitioned(cursor):
+                self.stdout.write('measurement_alert is not partitioned')
+                return
+
+            for i in range(options['num_months'] + 1):
+                suffix = AsIs(month.strftime("%Y_%m"))
+                next_month = month + relativedelta(months=1)
+                try:
+                    # NOTE: AsIS required for formating table names
+                    cursor.execute(sql, [
+                        suffix,
+                        month.strftime("%Y-%m-%d"),
+                        next_month.strftime("%Y-%m-%d")
+                    ])
+                    cursor.execute(sql_grant, [
+                        suffix,
+                        AsIs(settings.DATABASES['default']['USER'])])
+                except DatabaseError as e:
+                    errors.append(str(e))
+                month = next_month
+
+        if len(errors) > 0:
+            send_mail("Error in alert table partitioning",
+                      " ".join(errors),
+                      settings.EMAIL_NO_REPLY,
+                      [settings.EMAIL_ADMIN, ],
+                      fail_silently=False)
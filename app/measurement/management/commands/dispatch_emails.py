@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from measurement.mailer import dispatch_emails
+
+
+class Command(BaseCommand):
+    """
+    Command to send queued alert and digest emails
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum number of queued emails to send')
+
+    def handle(self, *args, **options):
+        '''method called by manager'''
+        sent, failed = dispatch_emails(batch_size=options['batch_size'])
+
+        # Report back to user
+        self.stdout.write(f'Sent {sent} emails, {failed} failed')
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from measurement.models import Monitor
+from measurement.evaluation import evaluate_monitors
+from measurement.digest import send_daily_digests
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
@@ -11,6 +13,8 @@ class Command(BaseCommand):
     Command to loop through all alarms and evaluate if they should be turned
     on/off
     """
+    # Leave time to finish before the next hourly run starts
+    DEADLINE_SECONDS = 50 * 60
 
     def add_arguments(self, parser):
         parser.add_argument('--channel_group', action='append',
@@ -21,6 +25,15 @@ class Command(BaseCommand):
                             help='Alarms to check should contain these\
                                   metrics',
                             default=[])
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads to evaluate monitors in')
+        parser.add_argument('--budget-seconds', type=float, default=None,
+                            help='Time budget for evaluating each monitor. \
+                                  Also used as the postgres statement_timeout')
+        parser.add_argument('--deadline-seconds', type=float,
+                            default=self.DEADLINE_SECONDS,
+                            help='Skip monitors that have not started this \
+                                  many seconds after the run began')
 
     def handle(self, *args, **options):
         '''method called by manager'''
@@ -32,7 +45,7 @@ class Command(BaseCommand):
         metrics = options['metric']
 
         # Get all alarms
-        monitors = Monitor.objects.all()
+        monitors = Monitor.objects.select_related('channel_group', 'metric')
 
         # Filter for specific channel_groups, metrics if they were selected
         if len(channel_groups) != 0:
@@ -40,6 +53,28 @@ class Command(BaseCommand):
         if len(metrics) != 0:
             monitors = monitors.filter(metric__name__in=metrics)
 
-        # Evaluate each alarm
-        for monitor in monitors:
-            monitor.evaluate_alarm(endtime=endtime)
+        # Evaluate each alarm. Monitors with the same metric and interval
+        # share their aggregate query
+        runs = evaluate_monitors(
+            monitors, endtime,
+            workers=options['workers'],
+            budget_seconds=options['budget_seconds'],
+            deadline_seconds=options['deadline_seconds'])
+
+        # Report back to user
+        for run in runs:
+            self.stdout.write(str(run))
+        n_failed = len([run for run in runs if run.error])
+        n_skipped = len([run for run in runs if run.skipped])
+        self.stdout.write(
+            f"Evaluated {len(runs) - n_failed - n_skipped} monitors, "
+            f"{n_failed} failed, {n_skipped} skipped")
+
+        # Daily digests are built for all monitors at once after evaluation
+        digesttime = datetime.now(tz=pytz.UTC) - relativedelta(
+            hour=0, minute=0, second=0, microsecond=0)
+        if endtime == digesttime:
+            digest_monitors = send_daily_digests(
+                monitors.filter(do_daily_digest=True), digesttime)
+            self.stdout.write(
+                f"Checked daily digest for {len(digest_monitors)} monitors")
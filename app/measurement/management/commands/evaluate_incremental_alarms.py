@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from measurement.incremental import evaluate_pending
+
+
+class Command(BaseCommand):
+    """
+    Command to evaluate minute monitors whose windows changed since they were
+    last evaluated. Requires INCREMENTAL_ALARMS_ENABLED so that windows are
+    updated on ingest. The hourly evaluate_alarms run is still the backstop
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debounce-seconds', type=float, default=30,
+                            help='Wait until the first change to a monitor \
+                                  is this old before evaluating it')
+
+    def handle(self, *args, **options):
+        '''method called by manager'''
+        monitors = evaluate_pending(options['debounce_seconds'])
+
+        # Report back to user
+        for monitor in monitors:
+            self.stdout.write(f'{monitor.id}: {str(monitor)}')
+        self.stdout.write(f'Evaluated {len(monitors)} monitors')
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.13 on 2026-10-19 04:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nslc', '0020_auto_20220919_2123'),
+        ('measurement', '0061_remove_trigger_email_list'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monitor',
+            name='window_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ChannelWindow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('buckets', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nslc.channel')),
+                ('monitor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='channel_windows', to='measurement.monitor')),
+            ],
+            options={
+                'unique_together': {('monitor', 'channel')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.13 on 2026-10-19 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurement', '0063_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['trigger', '-timestamp'], name='measurement_trigger_7ed4e0_idx'),
+        ),
+    ]
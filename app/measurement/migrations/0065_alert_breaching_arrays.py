@@ -0,0 +1,35 @@
+# Generated by Django 3.1.13 on 2026-10-19 06:12
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurement', '0064_alert_trigger_timestamp_index'),
+    ]
+
+    operations = [
+        # Existing alerts keep their JSON in the same column
+        migrations.RenameField(
+            model_name='alert',
+            old_name='breaching_channels',
+            new_name='legacy_breaching_channels',
+        ),
+        migrations.AlterField(
+            model_name='alert',
+            name='legacy_breaching_channels',
+            field=models.JSONField(db_column='breaching_channels', null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='breaching_channel_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='breaching_values',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), default=list, size=None),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.13 on 2026-10-19 06:40
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurement', '0065_alert_breaching_arrays'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archiveday',
+            name='quantiles',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='archivehour',
+            name='quantiles',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='archivemonth',
+            name='quantiles',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='archiveweek',
+            name='quantiles',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.13 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('measurement', '0066_archive_quantiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archiveday',
+            name='min_abs',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivehour',
+            name='min_abs',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivemonth',
+            name='min_abs',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archiveweek',
+            name='min_abs',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
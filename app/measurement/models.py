@@ -1,14 +1,15 @@
-from django.db import models
-from django.db.models import (Avg, Count, Max, Min, Sum, F, Value,
-                              IntegerField, FloatField)
-from django.db.models.functions import Abs
+from django.db import models, transaction
+from django.db.models import (Avg, Count, Max, Min, OuterRef, Subquery,
+                              Sum)
+from django.db.models.functions import Abs, Now
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 
 from measurement.aggregates.percentile import Percentile
+from measurement.engine import evaluate_triggers
 from nslc.models import Channel, Group
 
 from datetime import datetime, timedelta
@@ -16,6 +17,7 @@ from dateutil.relativedelta import relativedelta
 import pytz
 import operator
 from measurement.fields import EmailListArrayField
+from django.contrib.postgres.fields import ArrayField
 import os
 
 from bulk_update_or_create import BulkUpdateOrCreateQuerySet
@@ -94,6 +96,43 @@ class Measurement(MeasurementBase):
                 )
 
 
+class ChannelContext:
+    '''
+    Channel information shared by every trigger of a monitor during one
+    evaluation, so that triggers don't need to query channels themselves.
+
+    names: dict of channel id -> channel display name (NET.STA.LOC.CHA)
+    count: number of channels in the channel group
+    '''
+
+    def __init__(self, names):
+        self.names = names
+        self.count = len(names)
+
+    @classmethod
+    def for_channels(cls, channel_ids):
+        '''Load names for the given channel ids in a single query'''
+        if not channel_ids:
+            return cls({})
+        return cls.from_queryset(Channel.objects.filter(id__in=channel_ids))
+
+    @classmethod
+    def for_group(cls, group):
+        return cls.from_queryset(group.channels.all())
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        rows = queryset.values_list(
+            'id', 'network_id', 'station_code', 'loc', 'code')
+        return cls({row[0]: '.'.join(row[1:]).upper() for row in rows})
+
+    def subset(self, channel_ids):
+        '''Return a context for a subset of these channels'''
+        return ChannelContext({channel_id: self.names[channel_id]
+                               for channel_id in channel_ids
+                               if channel_id in self.names})
+
+
 class Monitor(MeasurementBase):
     '''Describes alarms on metrics and channel_groups'''
 
@@ -141,6 +180,9 @@ class Monitor(MeasurementBase):
     )
     name = models.CharField(max_length=255, default='')
     do_daily_digest = models.BooleanField(default=False)
+    # Set when incremental window state changes, cleared once the monitor
+    # has been re-evaluated. See measurement.incremental
+    window_changed_at = models.DateTimeField(null=True, blank=True)
 
     def calc_interval_seconds(self):
         '''Return the number of seconds in the alarm interval'''
@@ -157,6 +199,16 @@ class Monitor(MeasurementBase):
 
         return seconds
 
+    def get_window(self, endtime):
+        '''
+        Return the (starttime, endtime) window evaluated by this monitor, or
+        None if the monitor is not time-based (LASTN)
+        '''
+        if self.interval_type == self.IntervalType.LASTN:
+            return None
+        seconds = self.calc_interval_seconds()
+        return (endtime - timedelta(seconds=seconds), endtime)
+
     def agg_measurements(self, endtime=None):
         '''
         Gather all measurements for the alarm and calculate aggregate values
@@ -193,72 +245,57 @@ class Monitor(MeasurementBase):
 
             q_data = Measurement.objects.filter(id__in=measurement_ids)
         else:
-            seconds = self.calc_interval_seconds()
-            starttime = endtime - timedelta(seconds=seconds)
+            starttime, endtime = self.get_window(endtime)
             q_data = metric.measurements.filter(
                 starttime__range=(starttime, endtime),
                 channel__in=group.channels.all()
             )
 
         # Now calculate the aggregate values for each channel
-        q_data = q_data.values('channel').annotate(
-            count=Count('value'),
-            sum=Sum('value'),
-            avg=Avg('value'),
-            max=Max('value'),
-            min=Min('value'),
-            minabs=Min(Abs('value')),
-            maxabs=Max(Abs('value')),
-            median=Percentile('value', percentile=0.5),
-            p90=Percentile('value', percentile=0.90),
-            p95=Percentile('value', percentile=0.95)
-        )
-
-        # Get default values if there are no measurements
-        q_default = group.channels.values(channel=F('id')).annotate(
-            count=Value(0, output_field=IntegerField()),
-            sum=Value(None, output_field=FloatField()),
-            avg=Value(None, output_field=FloatField()),
-            max=Value(None, output_field=FloatField()),
-            min=Value(None, output_field=FloatField()),
-            maxabs=Value(None, output_field=FloatField()),
-            minabs=Value(None, output_field=FloatField()),
-            median=Value(None, output_field=FloatField()),
-            p90=Value(None, output_field=FloatField()),
-            p95=Value(None, output_field=FloatField())
-        )
-
-        # Combine querysets in case of zero measurements. Kludgy but
+        q_data = agg_channel_values(q_data)
+
+        # Combine with defaults in case of zero measurements. Kludgy but
         # shouldn't strain the db as much?
         q_dict = {obj['channel']: obj for obj in q_data}
-        for chan_default in q_default:
-            if chan_default['channel'] not in q_dict:
-                q_list.append(chan_default)
-            else:
-                q_list.append(q_dict[chan_default['channel']])
+        for channel_id in group.channels.values_list('id', flat=True):
+            q_list.append(
+                q_dict.get(channel_id, default_channel_value(channel_id)))
 
         return q_list
 
     def evaluate_alarm(self,
-                       endtime=None):
+                       endtime=None,
+                       channel_values=None,
+                       context=None,
+                       check_digest=True):
         '''
         Higher-level function that determines alarm state and calls other
         functions to create alerts if necessary. Default is to start on the
         hour regardless of when it is called (truncate down).
+
+        channel_values and context may be passed in if they were already
+        calculated, e.g. by measurement.evaluation.evaluate_monitors.
+        check_digest is False for evaluations between the hourly runs
         '''
         if not endtime:
             endtime = datetime.now(tz=pytz.UTC) - relativedelta(
                 minute=0, second=0, microsecond=0)
 
         # Get aggregate values for each channel. Returns a list(QuerySet)
-        channel_values = self.agg_measurements(endtime)
+        if channel_values is None:
+            channel_values = self.agg_measurements(endtime)
+
+        # Channel names and count are shared by all triggers
+        if context is None:
+            context = ChannelContext.for_group(self.channel_group)
 
         # Get Triggers for this alarm. Returns a QuerySet
         triggers = self.triggers.all()
 
-        for trigger in triggers:
-            breaching_channels = trigger.get_breaching_channels(channel_values)
-            in_alarm = trigger.in_alarm_state(breaching_channels)
+        # Evaluate all triggers at once, see measurement.engine
+        results = evaluate_triggers(
+            self.stat, triggers, channel_values, context)
+        for trigger, breaching_channels, in_alarm in results:
             trigger.evaluate_alert(in_alarm, breaching_channels, endtime)
 
         # Set the digest to be evaluated at this time. Should it be a field?
@@ -266,11 +303,18 @@ class Monitor(MeasurementBase):
             hour=0, minute=0, second=0, microsecond=0)
         endtimecheck = endtime - relativedelta(
             minute=0, second=0, microsecond=0)
-        if self.do_daily_digest and endtimecheck == digesttime:
+        if check_digest and self.do_daily_digest and \
+                endtimecheck == digesttime:
             self.check_daily_digest(digesttime)
 
     def check_daily_digest(self,
-                           digesttime=None):
+                           digesttime=None,
+                           trigger_digests=None):
+        '''
+        Send the daily digest if any trigger was in alarm the day before.
+        trigger_digests is a list of (trigger, digest context) and may be
+        passed in if already calculated, see measurement.digest
+        '''
         if not digesttime:
             digesttime = datetime.now(tz=pytz.UTC)
 
@@ -278,12 +322,12 @@ class Monitor(MeasurementBase):
         yesterday_str = (
             digesttime - relativedelta(days=1)).strftime("%Y-%m-%d")
 
-        triggers = self.triggers.all()
         # Get trigger contexts - information about the previous day
-        trigger_contexts = []
-        for trigger in triggers:
-            trigger_contexts.append(
-                trigger.get_daily_trigger_digest(digesttime))
+        if trigger_digests is None:
+            trigger_digests = [
+                (trigger, trigger.get_daily_trigger_digest(digesttime))
+                for trigger in self.triggers.all()]
+        trigger_contexts = [context for _, context in trigger_digests]
 
         n_in_alert = sum([1 for res in trigger_contexts if res['in_alarm']])
         if n_in_alert == 0:
@@ -292,8 +336,8 @@ class Monitor(MeasurementBase):
 
         # Get emails for triggers that were in alarm
         emails = []
-        for i, trigger in enumerate(triggers):
-            if trigger_contexts[i]['in_alarm']:
+        for trigger, trigger_context in trigger_digests:
+            if trigger_context['in_alarm']:
                 emails += [email for email in trigger.emails]
 
         if not emails:
@@ -313,13 +357,10 @@ class Monitor(MeasurementBase):
 
         subject = f"SQUAC daily digest for '{str(self)}'"
         subject += f", {yesterday_str}"
-        send_mail(subject,
-                  email_plaintext_message,
-                  settings.EMAIL_NO_REPLY,
-                  [email for email in emails],
-                  fail_silently=False,
-                  html_message=email_html_message
-                  )
+        OutboundEmail.enqueue(subject,
+                              email_plaintext_message,
+                              emails,
+                              html_message=email_html_message)
 
     def __str__(self):
         if not self.name:
@@ -337,8 +378,17 @@ class Monitor(MeasurementBase):
         """
         super().save(*args, **kwargs)  # Call the "real" save() method.
 
-        for trigger in self.triggers.all():
-            trigger.create_alert(False)
+        reset_alerts(self.triggers.all())
+
+
+class TriggerQuerySet(models.QuerySet):
+    def with_latest_alert(self):
+        '''Annotate latest_alert_id, the id of the most recent alert'''
+        latest = Alert.objects.filter(
+            trigger=OuterRef('pk'),
+            timestamp__lte=Now()
+        ).order_by('-timestamp').values('id')[:1]
+        return self.annotate(latest_alert_id=Subquery(latest))
 
 
 class Trigger(MeasurementBase):
@@ -404,6 +454,8 @@ class Trigger(MeasurementBase):
     )
     alert_on_out_of_alarm = models.BooleanField(default=False)
 
+    objects = TriggerQuerySet.as_manager()
+
     emails = EmailListArrayField(models.EmailField(
         null=True, blank=True), null=True, blank=True)
 
@@ -427,23 +479,34 @@ class Trigger(MeasurementBase):
             return self.OPERATOR[self.value_operator](val, self.val1)
 
     # channel_values is a list of dicts
-    def get_breaching_channels(self, channel_values):
-        '''Return all channels that are breaching this Trigger'''
+    def get_breaching_channels(self, channel_values, context=None):
+        '''
+        Return all channels that are breaching this Trigger. context is a
+        ChannelContext used to look up channel names, it is loaded for the
+        breaching channels if not given
+        '''
+        stat = self.monitor.stat
+        breaching_values = [channel_value for channel_value in channel_values
+                            if self.is_breaching(channel_value)]
+        if context is None:
+            context = ChannelContext.for_channels(
+                [channel_value['channel']
+                 for channel_value in breaching_values])
+
         breaching_channels = []
-        for channel_value in channel_values:
-            if self.is_breaching(channel_value):
-                channel = Channel.objects.filter(id=channel_value['channel'])
-                # Should just be one channel in the filter queryset
-                if len(channel) != 1:
-                    continue
-
-                value = channel_value[self.monitor.stat]
-                breaching_channels.append({
-                    'channel': str(channel[0]),
-                    'channel_id': channel_value['channel'],
-                    self.monitor.stat: value,
-                    "value": value
-                })
+        for channel_value in breaching_values:
+            name = context.names.get(channel_value['channel'])
+            # Skip channels that no longer exist
+            if name is None:
+                continue
+
+            value = channel_value[stat]
+            breaching_channels.append({
+                'channel': name,
+                'channel_id': channel_value['channel'],
+                stat: value,
+                "value": value
+            })
 
         # Sort the channels for simplicity later
         breaching_channels = sorted(
@@ -464,14 +527,16 @@ class Trigger(MeasurementBase):
         removed = []
         alert = self.get_latest_alert(reftime)
         if alert:
-            previous_ids = {x['channel_id'] for x in alert.breaching_channels}
+            previous_ids = set(alert.get_breaching_channel_ids())
             current_ids = {x['channel_id'] for x in breaching_channels}
             for chan in breaching_channels:
                 if chan['channel_id'] not in previous_ids:
                     added.append(chan)
-            for chan in alert.breaching_channels:
-                if chan['channel_id'] not in current_ids:
-                    removed.append(chan)
+            # Only look up names of the previous channels if needed
+            if previous_ids - current_ids:
+                for chan in alert.breaching_channels:
+                    if chan['channel_id'] not in current_ids:
+                        removed.append(chan)
         else:
             # Case where there was no previous alert
             added = breaching_channels
@@ -481,7 +546,8 @@ class Trigger(MeasurementBase):
     # breaching_channels is a list of dicts from
     # trigger.get_breaching_channels()
     def in_alarm_state(self,
-                       breaching_channels):
+                       breaching_channels,
+                       context=None):
         '''
         Determine if Trigger is in or out of alarm based on breaching_channels
         and num_channels_operator.
@@ -492,7 +558,10 @@ class Trigger(MeasurementBase):
             # zero breaching channels
             return len(breaching_channels) > 0
         elif self.num_channels_operator == self.NumChannelsOperator.ALL:
-            total_channels = self.monitor.channel_group.channels.count()
+            if context is not None:
+                total_channels = context.count
+            else:
+                total_channels = self.monitor.channel_group.channels.count()
             return len(breaching_channels) == total_channels
         else:
             # Otherwise just compare the breaching_channels to the
@@ -575,13 +644,15 @@ class Trigger(MeasurementBase):
 
         return alert
 
-    def get_text_description(self, verbose=True):
+    def get_text_description(self, verbose=True, cache=None):
         '''
         Try to return something like:
             Alert if avg of hourly_mean measurements is outside of (-5, 5)
             for less than 5 channels in channel group: UW SMAs
             over the last 5 hours
         see https://github.com/pnsn/squacapi/issues/373
+
+        cache is an optional dict of already rendered descriptions
         '''
         # Handle num_channels differently
         if self.num_channels_operator == self.NumChannelsOperator.ANY:
@@ -618,6 +689,11 @@ class Trigger(MeasurementBase):
                 else self.monitor.interval_type),
         }
 
+        if cache is not None:
+            key = (verbose, tuple(sorted(context.items())))
+            if key in cache:
+                return cache[key]
+
         if verbose:
             trigger_description = render_to_string(
                 'monitors/trigger_description_verbose.txt', context)
@@ -625,13 +701,20 @@ class Trigger(MeasurementBase):
             trigger_description = render_to_string(
                 'monitors/trigger_description_simple.txt', context)
 
+        if cache is not None:
+            cache[key] = trigger_description
         return trigger_description
 
-    def get_daily_trigger_digest(self, digesttime):
+    def get_daily_trigger_digest(self, digesttime, alerts=None,
+                                 descriptions=None):
         """
         digesttime is the time this is evaluated. So the code will actually
         check what happened the day before.
 
+        alerts (the day's alerts ordered by timestamp) and descriptions (a
+        cache for get_text_description) may be passed in when building
+        digests for many triggers, see measurement.digest
+
         Return boolean of whether this trigger was in alarm today
         Then text description:
         - At top should be brief trigger description
@@ -642,17 +725,15 @@ class Trigger(MeasurementBase):
         # digest email
         trigger_context = {
             'in_alarm': False,
-            'trigger_description': self.get_text_description(verbose=False),
+            'trigger_description': self.get_text_description(
+                verbose=False, cache=descriptions),
             'unsubscribe_url': self.create_unsubscribe_url()
         }
 
-        # Use check time to ensure digesttime is 00:00, and the trigger will be
-        # evaluated for the day before
-        checktime = digesttime - relativedelta(
-            hour=0, minute=0, second=0, microsecond=0)
-        alerts = self.alerts.filter(
-            timestamp__gte=checktime - relativedelta(days=1),
-            timestamp__lte=checktime).order_by('timestamp')
+        if alerts is None:
+            alerts = self.alerts.filter(
+                timestamp__range=get_digest_range(digesttime)
+            ).order_by('timestamp')
 
         # If there were no alerts today, return now.
         if len(alerts) == 0:
@@ -669,6 +750,7 @@ class Trigger(MeasurementBase):
         ]
 
         # Now add the list of breaching channels (first generate it)
+        load_breaching_channels(alerts)
         channels_dict = {}
         for alert in alerts:
             for channel in alert.breaching_channels:
@@ -762,6 +844,33 @@ class Trigger(MeasurementBase):
         self.create_alert(False)
 
 
+class ChannelWindow(models.Model):
+    '''
+    Sliding window state of one channel for an incrementally evaluated
+    monitor. buckets maps minute -> summary of the measurements that started
+    in that minute, see measurement.incremental
+    '''
+    monitor = models.ForeignKey(
+        Monitor,
+        on_delete=models.CASCADE,
+        related_name='channel_windows'
+    )
+    channel = models.ForeignKey(
+        Channel,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    buckets = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('monitor', 'channel'),)
+
+    def __str__(self):
+        return (f"Window of Monitor: {str(self.monitor)} "
+                f"Channel: {str(self.channel)}")
+
+
 class Alert(MeasurementBase):
     '''Describe an alert for a trigger'''
     trigger = models.ForeignKey(
@@ -771,7 +880,42 @@ class Alert(MeasurementBase):
     )
     timestamp = models.DateTimeField()
     in_alarm = models.BooleanField(default=True)
-    breaching_channels = models.JSONField(null=True)
+    # Breaching channels are stored as parallel arrays of channel ids and
+    # values, names are looked up when needed. See breaching_channels
+    breaching_channel_ids = ArrayField(models.IntegerField(), default=list)
+    breaching_values = ArrayField(models.FloatField(null=True), default=list)
+    # Full channel dicts of alerts created before the compact storage
+    legacy_breaching_channels = models.JSONField(
+        null=True, db_column='breaching_channels')
+
+    @property
+    def breaching_channels(self):
+        '''
+        List of {'channel', 'channel_id', stat, 'value'} dicts. Channel names
+        are looked up on first access, use load_breaching_channels() to do
+        it for many alerts at once
+        '''
+        if self.legacy_breaching_channels is not None:
+            return self.legacy_breaching_channels
+        if not hasattr(self, '_breaching_channels'):
+            load_breaching_channels([self])
+        return self._breaching_channels
+
+    @breaching_channels.setter
+    def breaching_channels(self, breaching_channels):
+        breaching_channels = breaching_channels or []
+        self.legacy_breaching_channels = None
+        self.breaching_channel_ids = [
+            channel['channel_id'] for channel in breaching_channels]
+        self.breaching_values = [
+            channel.get('value') for channel in breaching_channels]
+        self._breaching_channels = breaching_channels
+
+    def get_breaching_channel_ids(self):
+        if self.legacy_breaching_channels is not None:
+            return [channel['channel_id']
+                    for channel in self.legacy_breaching_channels]
+        return self.breaching_channel_ids
 
     def send_alert(self):
         if not self.trigger.emails:
@@ -809,13 +953,12 @@ class Alert(MeasurementBase):
         email_plaintext_message = render_to_string(
             'email/alert_email.txt', context)
 
-        send_mail(subject,
-                  email_plaintext_message,
-                  settings.EMAIL_NO_REPLY,
-                  [email for email in self.trigger.emails],
-                  fail_silently=False,
-                  html_message=email_html_message
-                  )
+        # Sent later by the dispatch_emails command so evaluation never
+        # waits on the mail server
+        OutboundEmail.enqueue(subject,
+                              email_plaintext_message,
+                              self.trigger.emails,
+                              html_message=email_html_message)
 
         return True
 
@@ -823,6 +966,8 @@ class Alert(MeasurementBase):
         indexes = [
             # index in desc order (newest first)
             models.Index(fields=['-timestamp']),
+            # latest alert lookups per trigger
+            models.Index(fields=['trigger', '-timestamp']),
         ]
 
     def __str__(self):
@@ -832,8 +977,52 @@ class Alert(MeasurementBase):
                 )
 
 
+class OutboundEmail(models.Model):
+    '''
+    Queued email to a single recipient, see measurement.mailer for the
+    dispatcher
+    '''
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_message = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not sent before this time, pushed back when sending fails
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'send_after']),
+        ]
+
+    @classmethod
+    def enqueue(cls, subject, message, recipients, html_message=''):
+        '''Queue a message for each recipient'''
+        return cls.objects.bulk_create([
+            cls(recipient=recipient,
+                subject=subject[:255],
+                message=message,
+                html_message=html_message or '')
+            for recipient in dict.fromkeys(recipients)
+        ])
+
+    def __str__(self):
+        return (f"To: {self.recipient}, "
+                f"Subject: {self.subject}, "
+                f"Sent: {self.sent_at}")
+
+
 class ArchiveBase(models.Model):
     """An archive-summary of measurements"""
+
+    # Fractions stored in quantiles, evenly spaced plus the fractions of the
+    # percentile fields so that those are exact
+    QUANTILES = tuple(sorted(
+        {i / 64 for i in range(65)} | {0.05, 0.10, 0.90, 0.95}))
+
     class Meta:
         abstract = True
         indexes = [
@@ -853,6 +1042,11 @@ class ArchiveBase(models.Model):
     p10 = models.FloatField()
     p90 = models.FloatField()
     p95 = models.FloatField()
+    # Values at each of QUANTILES, used to combine percentiles of several
+    # archives. Empty for archives created before it was added
+    quantiles = ArrayField(models.FloatField(), default=list, blank=True)
+    # Smallest absolute value. Null for archives created before it was added
+    min_abs = models.FloatField(null=True, blank=True)
     starttime = models.DateTimeField(auto_now=False)
     endtime = models.DateTimeField(auto_now=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -860,6 +1054,8 @@ class ArchiveBase(models.Model):
 
     @property
     def minabs(self):
+        if self.min_abs is not None:
+            return self.min_abs
         return min(abs(self.min), abs(self.max))
 
     @property
@@ -893,6 +1089,135 @@ class ArchiveMonth(ArchiveBase):
     pass
 
 
+def agg_channel_values(queryset, *fields):
+    '''
+    Calculate the aggregate values used by monitors for each channel in a
+    Measurement queryset. Stat names need to match Monitor.Stat. Any extra
+    fields (e.g. an annotated time bucket) are also grouped by
+    '''
+    return queryset.values('channel', *fields).annotate(
+        count=Count('value'),
+        sum=Sum('value'),
+        avg=Avg('value'),
+        max=Max('value'),
+        min=Min('value'),
+        minabs=Min(Abs('value')),
+        maxabs=Max(Abs('value')),
+        median=Percentile('value', percentile=0.5),
+        p90=Percentile('value', percentile=0.90),
+        p95=Percentile('value', percentile=0.95)
+    )
+
+
+def default_channel_value(channel_id):
+    '''Aggregate values for a channel with no measurements'''
+    channel_value = {stat: None for stat in Monitor.Stat.values}
+    channel_value['channel'] = channel_id
+    channel_value['count'] = 0
+    return channel_value
+
+
+def reset_alerts(triggers, timestamp=None):
+    '''
+    Create an alert with in_alarm = False for each trigger, like
+    Trigger.create_alert(False) but in a single query
+    '''
+    if not timestamp:
+        timestamp = datetime.now(tz=pytz.UTC)
+    return Alert.objects.bulk_create([
+        Alert(trigger=trigger,
+              timestamp=timestamp,
+              in_alarm=False,
+              user_id=trigger.user_id)
+        for trigger in triggers
+    ])
+
+
+def bulk_update_timestamped(model, instances, fields):
+    '''bulk_update fields of instances, setting updated_at like save'''
+    now = timezone.now()
+    for instance in instances:
+        instance.updated_at = now
+    model.objects.bulk_update(instances, list(fields) + ['updated_at'])
+
+
+def bulk_update_monitors(monitors, fields):
+    '''
+    Save fields of already validated monitors in one transaction and reset
+    the alerts of all of their triggers, like Monitor.save
+    '''
+    with transaction.atomic():
+        bulk_update_timestamped(Monitor, monitors, fields)
+        reset_alerts(Trigger.objects.filter(monitor__in=monitors))
+
+
+def bulk_update_triggers(triggers, fields):
+    '''
+    Save fields of already validated triggers in one transaction and reset
+    their alerts, like Trigger.save
+    '''
+    with transaction.atomic():
+        bulk_update_timestamped(Trigger, triggers, fields)
+        reset_alerts(triggers)
+
+
+def load_latest_alerts(triggers):
+    '''
+    Set _latest_alert on triggers annotated by with_latest_alert() using a
+    single query. Triggers that already have it are skipped
+    '''
+    triggers = [trigger for trigger in triggers
+                if hasattr(trigger, 'latest_alert_id')]
+    triggers = [trigger for trigger in triggers
+                if not hasattr(trigger, '_latest_alert')]
+    alert_ids = [trigger.latest_alert_id for trigger in triggers
+                 if trigger.latest_alert_id]
+    alerts = Alert.objects.in_bulk(alert_ids) if alert_ids else {}
+    for trigger in triggers:
+        trigger._latest_alert = alerts.get(trigger.latest_alert_id)
+        if trigger._latest_alert:
+            trigger._latest_alert.trigger = trigger
+    load_breaching_channels(alerts.values())
+
+
+def load_breaching_channels(alerts):
+    '''
+    Build breaching_channels of compactly stored alerts, looking up the
+    channel names of all of them in one query
+    '''
+    alerts = [alert for alert in alerts
+              if alert.legacy_breaching_channels is None]
+    alerts = [alert for alert in alerts
+              if not hasattr(alert, '_breaching_channels')]
+    if not alerts:
+        return
+    context = ChannelContext.for_channels(
+        {channel_id for alert in alerts
+         for channel_id in alert.breaching_channel_ids})
+    for alert in alerts:
+        stat = alert.trigger.monitor.stat
+        alert._breaching_channels = [
+            {
+                'channel': context.names.get(
+                    channel_id, f'deleted channel {channel_id}'),
+                'channel_id': channel_id,
+                stat: value,
+                'value': value
+            }
+            for channel_id, value in zip(alert.breaching_channel_ids,
+                                         alert.breaching_values)]
+
+
+def get_digest_range(digesttime):
+    '''
+    Use check time to ensure digesttime is 00:00, and triggers will be
+    evaluated for the day before
+    '''
+    checktime = digesttime - relativedelta(
+        hour=0, minute=0, second=0, microsecond=0)
+    return (checktime - relativedelta(days=1), checktime)
+
+
 def remote_host():
     # Determine the base url
     env = os.environ.get('SQUAC_ENVIRONMENT')
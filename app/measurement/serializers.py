@@ -1,9 +1,15 @@
 from rest_framework import serializers
 from .models import (Metric, Measurement,
                      Alert, ArchiveHour, ArchiveDay, ArchiveWeek, Monitor,
-                     Trigger, ArchiveMonth)
+                     Trigger, ArchiveMonth, load_breaching_channels,
+                     load_latest_alerts)
 from nslc.models import Channel, Group
+from .incremental import record_measurements
+from .backtest import MAX_EVALUATIONS, SOURCES, evaluation_times
+from .alert_summary import BUCKETS
 from drf_yasg.utils import swagger_serializer_method
+from django.conf import settings
+from django.db.models import Manager, Prefetch
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
@@ -17,6 +23,8 @@ class BulkMeasurementListSerializer(serializers.ListSerializer):
             result,
             ['value', 'endtime', 'user'],
             match_field=['metric', 'channel', 'starttime'])
+        if settings.INCREMENTAL_ALARMS_ENABLED:
+            record_measurements(result)
         return result
 
 
@@ -48,6 +56,8 @@ class MeasurementSerializer(serializers.ModelSerializer):
                 'endtime': validated_data.get('endtime', None),
                 'user': validated_data.get('user', None)
             })
+        if settings.INCREMENTAL_ALARMS_ENABLED:
+            record_measurements([measurement])
         return measurement
 
     # @staticmethod
@@ -67,6 +77,35 @@ class AggregatedParametersSerializer(serializers.Serializer):
     nslc = serializers.CharField(required=False)
 
 
+class BacktestParametersSerializer(serializers.Serializer):
+    '''query params for a monitor backtest, the monitor is in the context'''
+    starttime = serializers.DateTimeField()
+    endtime = serializers.DateTimeField()
+    source = serializers.ChoiceField(choices=SOURCES, required=False)
+
+    def validate(self, data):
+        monitor = self.context['monitor']
+        if monitor.interval_type == Monitor.IntervalType.LASTN:
+            raise serializers.ValidationError(
+                'Only time-based monitors can be backtested')
+        if data['endtime'] <= data['starttime']:
+            raise serializers.ValidationError(
+                'endtime must be after starttime')
+        n_evaluations = len(evaluation_times(data['starttime'],
+                                             data['endtime']))
+        if n_evaluations > MAX_EVALUATIONS:
+            raise serializers.ValidationError(
+                f'At most {MAX_EVALUATIONS} hourly evaluations allowed')
+        return data
+
+
+class AlertSummaryParametersSerializer(serializers.Serializer):
+    '''query params for the alert summary, besides the AlertFilter ones'''
+    bucket = serializers.ChoiceField(choices=BUCKETS, default='day')
+    top = serializers.IntegerField(min_value=0, max_value=100, default=5)
+    timestamp_lt = serializers.DateTimeField(required=False)
+
+
 class AggregatedSerializer(serializers.Serializer):
     '''simple serializer for aggregated response data'''
     metric = serializers.IntegerField()
@@ -125,10 +164,26 @@ class MonitorSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('id', 'user')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = queryset.select_related('channel_group', 'metric')
+        return queryset
+
+
+class AlertListSerializer(serializers.ListSerializer):
+    '''Looks up breaching channel names of all alerts in one query'''
+
+    def to_representation(self, data):
+        alerts = list(data.all() if isinstance(data, Manager) else data)
+        load_breaching_channels(alerts)
+        return super().to_representation(alerts)
+
 
 class AlertSerializer(serializers.ModelSerializer):
     trigger = serializers.PrimaryKeyRelatedField(
         queryset=Trigger.objects.all())
+    # May be left out, but null is rejected since alerts store a list
+    breaching_channels = serializers.JSONField(required=False)
 
     class Meta:
         model = Alert
@@ -137,6 +192,25 @@ class AlertSerializer(serializers.ModelSerializer):
             'breaching_channels', 'created_at', 'updated_at', 'user'
         )
         read_only_fields = ('id', 'user')
+        list_serializer_class = AlertListSerializer
+
+    def validate_breaching_channels(self, value):
+        """Alerts store the channel_id and value of breaching channels"""
+        error = serializers.ValidationError(
+            "Expected a list of objects with an integer channel_id")
+        if not isinstance(value, list):
+            raise error
+        for channel in value:
+            if not isinstance(channel, dict) or \
+                    not isinstance(channel.get('channel_id'), int):
+                raise error
+        return value
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # The monitor stat is used for the breaching channel values
+        queryset = queryset.select_related('trigger__monitor')
+        return queryset
 
 
 class EmailListFieldSerializer(serializers.CharField):
@@ -161,6 +235,15 @@ class EmailListFieldSerializer(serializers.CharField):
             )
 
 
+class TriggerListSerializer(serializers.ListSerializer):
+    '''Loads the latest alert of all triggers in one query'''
+
+    def to_representation(self, data):
+        triggers = list(data.all() if isinstance(data, Manager) else data)
+        load_latest_alerts(triggers)
+        return super().to_representation(triggers)
+
+
 class TriggerSerializer(serializers.ModelSerializer):
     monitor = serializers.PrimaryKeyRelatedField(
         queryset=Monitor.objects.all())
@@ -179,11 +262,22 @@ class TriggerSerializer(serializers.ModelSerializer):
 
         )
         read_only_fields = ('id', 'user')
+        list_serializer_class = TriggerListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # See TriggerQuerySet.with_latest_alert and load_latest_alerts
+        queryset = queryset.with_latest_alert().select_related('monitor')
+        return queryset
 
     @swagger_serializer_method(serializer_or_field=AlertSerializer)
     def get_latest_alert(self, obj):
         """returns most recent alert for trigger"""
-        alert = obj.get_latest_alert()
+        # Loaded in bulk when listing triggers, see load_latest_alerts
+        if hasattr(obj, '_latest_alert'):
+            alert = obj._latest_alert
+        else:
+            alert = obj.get_latest_alert()
 
         if alert:
             return AlertSerializer(alert).data
@@ -247,6 +341,17 @@ class ArchiveMonthSerializer(ArchiveBaseSerializer):
         exclude = ("url",)
 
 
+class MonitorDetailListSerializer(serializers.ListSerializer):
+    '''Loads the latest alert of the triggers of all monitors at once'''
+
+    def to_representation(self, data):
+        monitors = list(data.all() if isinstance(data, Manager) else data)
+        load_latest_alerts(
+            [trigger for monitor in monitors
+             for trigger in monitor.triggers.all()])
+        return super().to_representation(monitors)
+
+
 class MonitorDetailSerializer(MonitorSerializer):
     triggers = TriggerSerializer(many=True, read_only=True)
 
@@ -259,6 +364,14 @@ class MonitorDetailSerializer(MonitorSerializer):
             'user', 'triggers', 'do_daily_digest',
         )
         read_only_fields = ('id', 'user')
+        list_serializer_class = MonitorDetailListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = MonitorSerializer.setup_eager_loading(queryset)
+        queryset = queryset.prefetch_related(Prefetch(
+            'triggers', queryset=Trigger.objects.with_latest_alert()))
+        return queryset
 
 
 class AlertDetailSerializer(serializers.ModelSerializer):
@@ -275,6 +388,7 @@ class AlertDetailSerializer(serializers.ModelSerializer):
         source="trigger.num_channels", read_only=True)
     num_channels_operator = serializers.CharField(
         source="trigger.num_channels_operator", read_only=True)
+    breaching_channels = serializers.JSONField(read_only=True)
 
     class Meta:
         model = Alert
@@ -285,6 +399,12 @@ class AlertDetailSerializer(serializers.ModelSerializer):
             'monitor_name'
         )
         read_only_fields = ('id', 'user')
+        list_serializer_class = AlertListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = queryset.select_related('trigger__monitor')
+        return queryset
 
 
 class TriggerUnsubscribeSerializer(serializers.Serializer):
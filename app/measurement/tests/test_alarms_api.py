@@ -1,12 +1,19 @@
 from unittest.mock import patch
 from django.core import mail
 from django.core.management import call_command
+from django.db import connection, DatabaseError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
+from measurement.alert_summary import summarize_alerts
+from measurement.digest import build_daily_digests, send_daily_digests
+from measurement.evaluation import evaluate_monitors
+from measurement.mailer import (FAILED_KEEP_DAYS, MAX_ATTEMPTS,
+                                RETRY_SECONDS, dispatch_emails)
 from measurement.models import (Monitor, Trigger, Alert, Measurement,
-                                Metric)
+                                Metric, OutboundEmail, ChannelContext)
 from nslc.models import Channel, Group, Network
 from organization.models import Organization
 
@@ -15,7 +22,9 @@ from rest_framework import status
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from io import StringIO
 import pytz
+import time
 from squac.test_mixins import sample_user
 
 
@@ -434,10 +443,66 @@ class PrivateAlarmAPITests(TestCase):
     def test_send_alert(self):
         self.alert.send_alert()
 
-        self.assertEqual(len(mail.outbox), 1)
+        # Emails are queued and sent by the dispatcher
+        self.assertEqual(len(mail.outbox), 0)
+        dispatch_emails()
+        self.assertEqual(len(mail.outbox), len(self.alert.trigger.emails))
 
+        recipients = [r for email in mail.outbox for r in email.recipients()]
         for email in self.alert.trigger.emails:
-            self.assertTrue(email in mail.outbox[0].recipients())
+            self.assertTrue(email in recipients)
+
+    def test_dispatch_emails_combines_per_recipient(self):
+        OutboundEmail.enqueue('first', 'one', ['a@pnsn.org', 'b@pnsn.org'])
+        OutboundEmail.enqueue('second', 'two', ['a@pnsn.org'])
+
+        with patch('measurement.mailer.get_connection',
+                   wraps=mail.get_connection) as get_connection:
+            self.assertEqual((2, 0), dispatch_emails())
+            self.assertEqual(1, get_connection.call_count)
+
+        messages = {msg.recipients()[0]: msg for msg in mail.outbox}
+        self.assertEqual('first', messages['b@pnsn.org'].subject)
+        self.assertIn('one', messages['a@pnsn.org'].body)
+        self.assertIn('two', messages['a@pnsn.org'].body)
+        self.assertFalse(
+            OutboundEmail.objects.filter(sent_at__isnull=True).exists())
+
+        # Nothing left to send
+        self.assertEqual((0, 0), dispatch_emails())
+
+    def test_dispatch_emails_retries_with_backoff(self):
+        OutboundEmail.enqueue('subject', 'message', ['a@pnsn.org'])
+        now = datetime.now(tz=pytz.UTC)
+        with patch('django.core.mail.backends.locmem.EmailBackend.'
+                   'send_messages', side_effect=OSError('down')):
+            self.assertEqual((0, 1), dispatch_emails(now=now))
+        email = OutboundEmail.objects.get()
+        self.assertEqual(1, email.attempts)
+        self.assertEqual('down', email.last_error)
+
+        # Not retried until the backoff has passed
+        self.assertEqual((0, 0), dispatch_emails(now=now))
+        self.assertEqual((1, 0), dispatch_emails(
+            now=now + relativedelta(seconds=RETRY_SECONDS)))
+        self.assertEqual(1, len(mail.outbox))
+
+    def test_dispatch_emails_gives_up(self):
+        [email] = OutboundEmail.enqueue('subject', 'message', ['a@pnsn.org'])
+        OutboundEmail.objects.update(attempts=MAX_ATTEMPTS - 1)
+        now = datetime.now(tz=pytz.UTC)
+        with patch('django.core.mail.backends.locmem.EmailBackend.'
+                   'send_messages', side_effect=OSError('down')), \
+                self.assertLogs('measurement.mailer', 'ERROR') as logs:
+            self.assertEqual((0, 1), dispatch_emails(now=now))
+        self.assertIn('a@pnsn.org', logs.output[0])
+
+        # Not retried, and deleted after FAILED_KEEP_DAYS
+        self.assertEqual((0, 0), dispatch_emails(
+            now=now + relativedelta(days=1)))
+        self.assertTrue(OutboundEmail.objects.exists())
+        dispatch_emails(now=now + relativedelta(days=FAILED_KEEP_DAYS + 1))
+        self.assertFalse(OutboundEmail.objects.exists())
 
     def test_evaluate_alarms_filter_metric(self):
         '''Test evaluate_alarm command'''
@@ -554,8 +619,400 @@ class PrivateAlarmAPITests(TestCase):
 
         self.monitor.check_daily_digest(
             digesttime=reftime + relativedelta(days=1))
+        dispatch_emails()
 
         # was an email sent?
-        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(len(mail.outbox), len(self.trigger.emails))
+        recipients = [r for email in mail.outbox for r in email.recipients()]
         for email in self.trigger.emails:
-            self.assertTrue(email in mail.outbox[0].recipients())
+            self.assertTrue(email in recipients)
+
+    def test_daily_digest_with_deleted_channel(self):
+        reftime = datetime(2020, 1, 2, 3, 0, 0, 0, tzinfo=pytz.UTC)
+        deleted_id = Channel.objects.order_by('id').last().id + 1000
+        breaching_channels = [
+            {'sum': 5, 'channel_id': self.chan1.id},
+            {'sum': 10, 'channel_id': deleted_id}]
+        self.trigger.create_alert(
+            True, breaching_channels=breaching_channels,
+            timestamp=reftime + relativedelta(hours=1))
+
+        alert = Alert.objects.get(trigger=self.trigger,
+                                  timestamp=reftime + relativedelta(hours=1))
+        self.assertEqual(f'deleted channel {deleted_id}',
+                         alert.breaching_channels[1]['channel'])
+        context = self.trigger.get_daily_trigger_digest(
+            reftime + relativedelta(days=1))
+        self.assertTrue(context['in_alarm'])
+
+    def test_create_alert_without_channel_id(self):
+        url = reverse('measurement:alert-list')
+        payload = {
+            'trigger': self.trigger.id,
+            'timestamp': datetime(1999, 12, 31, tzinfo=pytz.UTC),
+            'in_alarm': True,
+            'breaching_channels': [{'channel': 'UW:STA1:--:HNN', 'sum': 5}]
+        }
+        res = self.client.post(url, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        payload['breaching_channels'] = None
+        res = self.client.post(url, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('breaching_channels', res.data)
+
+    def test_build_daily_digests(self):
+        '''Bulk digests should match per-trigger digests'''
+        reftime = datetime(2020, 1, 2, 3, 0, 0, 0, tzinfo=pytz.UTC)
+        ch1 = {"sum": 5, "channel": "UW:STA1:--:HNN", "channel_id": 1}
+        for trigger in Trigger.objects.all()[:3]:
+            trigger.create_alert(
+                True,
+                breaching_channels=[ch1],
+                timestamp=reftime + relativedelta(hours=trigger.id))
+        digesttime = reftime + relativedelta(days=1)
+
+        monitors = list(Monitor.objects.select_related(
+            'channel_group', 'metric'))
+        # Triggers, alerts and breaching channel names
+        with self.assertNumQueries(3):
+            digests = build_daily_digests(monitors, digesttime)
+
+        for monitor in monitors:
+            triggers = list(monitor.triggers.order_by('id'))
+            self.assertEqual(triggers,
+                             [trigger for trigger, _ in digests[monitor.id]])
+            for trigger, context in digests[monitor.id]:
+                self.assertEqual(
+                    trigger.get_daily_trigger_digest(digesttime), context)
+
+    def test_send_daily_digests(self):
+        reftime = datetime(2020, 1, 2, 3, 0, 0, 0, tzinfo=pytz.UTC)
+        self.trigger.create_alert(
+            True, breaching_channels=[], timestamp=reftime)
+        self.monitor.do_daily_digest = True
+        self.monitor.save()
+
+        send_daily_digests(
+            Monitor.objects.select_related('channel_group', 'metric'),
+            reftime + relativedelta(days=1))
+        dispatch_emails()
+        self.assertEqual(len(mail.outbox), len(self.trigger.emails))
+        self.assertIn('daily digest', mail.outbox[0].subject)
+
+    def test_breaching_channels_compact_storage(self):
+        context = ChannelContext.for_channels([self.chan1.id, self.chan2.id])
+        breaching_channels = [
+            {'channel': context.names[channel.id], 'channel_id': channel.id,
+             'sum': value, 'value': value}
+            for channel, value in ((self.chan1, 3.0), (self.chan2, None))]
+        alert = self.trigger.create_alert(
+            True, breaching_channels=breaching_channels)
+
+        alert = Alert.objects.get(id=alert.id)
+        self.assertIsNone(alert.legacy_breaching_channels)
+        self.assertEqual([self.chan1.id, self.chan2.id],
+                         alert.breaching_channel_ids)
+        self.assertEqual(breaching_channels, alert.breaching_channels)
+
+        # Alerts from before the compact storage are read as they were
+        legacy = Alert.objects.exclude(
+            legacy_breaching_channels=None).first()
+        self.assertEqual(legacy.legacy_breaching_channels,
+                         legacy.breaching_channels)
+
+        # Channel names are looked up once for the whole list
+        url = reverse('measurement:alert-list')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.trigger.create_alert(True, breaching_channels=breaching_channels)
+        with self.assertNumQueries(len(queries)):
+            res = self.client.get(url)
+        self.assertEqual(breaching_channels, res.data[0]['breaching_channels'])
+
+    def create_summary_alerts(self):
+        '''Alerts over two days of 2021 for a new trigger'''
+        trigger = Trigger.objects.create(
+            monitor=self.monitor,
+            val1=2,
+            value_operator=Trigger.ValueOperator.GREATER_THAN,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        context = ChannelContext.for_channels([self.chan1.id, self.chan2.id])
+        start = datetime(2021, 1, 1, tzinfo=pytz.UTC)
+        for hour, in_alarm, channels in ((0, True, [self.chan1, self.chan2]),
+                                         (1, True, [self.chan1]),
+                                         (3, False, []),
+                                         (29, True, [self.chan2])):
+            trigger.create_alert(in_alarm, breaching_channels=[
+                {'channel': context.names[channel.id],
+                 'channel_id': channel.id, 'sum': 3.0, 'value': 3.0}
+                for channel in channels],
+                timestamp=start + relativedelta(hours=hour))
+        # Alerts from before the compact storage
+        Alert.objects.create(
+            trigger=trigger,
+            timestamp=datetime(2021, 1, 1, 2, tzinfo=pytz.UTC),
+            in_alarm=True,
+            legacy_breaching_channels=[
+                {'channel': context.names[self.chan1.id],
+                 'channel_id': self.chan1.id, 'sum': 3.0, 'value': 3.0}],
+            user=self.user
+        )
+        return trigger
+
+    def test_alert_summary(self):
+        trigger = self.create_summary_alerts()
+        url = reverse('measurement:alert-summary')
+        res = self.client.get(url, {
+            'trigger': trigger.id,
+            'timestamp_gte': '2021-01-01T00:00:00Z',
+            'timestamp_lt': '2021-01-03T00:00:00Z',
+            'top': 1
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual('day', res.data['bucket'])
+
+        [summary] = res.data['triggers']
+        self.assertEqual(trigger.id, summary['trigger'])
+        self.assertEqual(self.monitor.id, summary['monitor'])
+        self.assertEqual(5, summary['alerts'])
+        self.assertEqual(
+            [(datetime(2021, 1, 1, tzinfo=pytz.UTC), 4, 3),
+             (datetime(2021, 1, 2, tzinfo=pytz.UTC), 1, 1)],
+            [(bucket['timestamp'], bucket['alerts'],
+              bucket['in_alarm_alerts']) for bucket in summary['buckets']])
+        # Three hours on the first day, and from 05:00 until timestamp_lt
+        self.assertEqual((3 + 19) * 3600, summary['in_alarm_seconds'])
+        self.assertEqual([(self.chan1.id, 3)], [
+            (channel['channel_id'], channel['alerts'])
+            for channel in summary['top_channels']])
+
+        [monitor_summary] = res.data['monitors']
+        self.assertEqual(self.monitor.id, monitor_summary['monitor'])
+        self.assertEqual(summary['buckets'], monitor_summary['buckets'])
+        self.assertEqual(summary['in_alarm_seconds'],
+                         monitor_summary['in_alarm_seconds'])
+        self.assertEqual(summary['top_channels'],
+                         monitor_summary['top_channels'])
+
+    def test_alert_summary_monitor_totals(self):
+        trigger = self.create_summary_alerts()
+        other = Trigger.objects.create(
+            monitor=self.monitor,
+            val1=2,
+            value_operator=Trigger.ValueOperator.GREATER_THAN,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        ch2 = {'channel': 'UW:CH2', 'channel_id': self.chan2.id, 'sum': 3.0}
+        start = datetime(2021, 1, 1, tzinfo=pytz.UTC)
+        for hour, in_alarm, channels in ((2, True, [ch2]), (4, True, [ch2]),
+                                         (6, False, [])):
+            other.create_alert(in_alarm, breaching_channels=channels,
+                               timestamp=start + relativedelta(hours=hour))
+
+        summary = summarize_alerts(
+            Alert.objects.filter(trigger__in=[trigger, other]),
+            endtime=datetime(2021, 1, 3, tzinfo=pytz.UTC))
+        [monitor_summary] = summary['monitors']
+        self.assertEqual([(3 + 19) * 3600, 4 * 3600], [
+            t['in_alarm_seconds'] for t in summary['triggers']])
+        # In alarm from 00:00 to 06:00 and from 05:00 on the second day
+        self.assertEqual((6 + 19) * 3600, monitor_summary['in_alarm_seconds'])
+        # chan2 in two alerts of trigger and two of other
+        self.assertEqual([(self.chan2.id, 4), (self.chan1.id, 3)], [
+            (channel['channel_id'], channel['alerts'])
+            for channel in monitor_summary['top_channels']])
+
+    def test_alert_summary_queries(self):
+        self.create_summary_alerts()
+        self.create_summary_alerts()
+        # Buckets, time in alarm, top channels and channel names
+        with self.assertNumQueries(4):
+            summary = summarize_alerts(
+                Alert.objects.filter(timestamp__year=2021), bucket='hour')
+        self.assertEqual(2, len(summary['triggers']))
+        self.assertEqual(1, len(summary['monitors']))
+
+    def test_alert_summary_invalid_bucket(self):
+        url = reverse('measurement:alert-summary')
+        res = self.client.get(url, {'bucket': 'fortnight'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compact_alerts(self):
+        '''Only state transitions are kept for old alerts'''
+        ch1 = {"sum": 5, "channel": "UW:STA1:--:HNN", "channel_id": 1}
+        ch2 = {"sum": 5, "channel": "UW:STA2:--:HNN", "channel_id": 2}
+        states = [(True, [ch1]), (True, [ch1]), (False, []), (True, [ch1]),
+                  (True, [ch1, ch2]), (True, [ch1, ch2])]
+        self.trigger.alerts.all().delete()
+        basetime = datetime.now(tz=pytz.UTC) - relativedelta(days=60)
+        for i, (in_alarm, channels) in enumerate(states):
+            self.trigger.create_alert(
+                in_alarm,
+                breaching_channels=channels,
+                timestamp=basetime + relativedelta(hours=i))
+        # Recent repeats are left alone
+        for i in range(2):
+            self.trigger.create_alert(
+                True, breaching_channels=[ch1],
+                timestamp=datetime.now(tz=pytz.UTC) - relativedelta(hours=i))
+
+        call_command('compact_alerts', compact_after_days=30,
+                     stdout=StringIO())
+        alerts = self.trigger.alerts.order_by('timestamp')
+        self.assertEqual(
+            [(True, 1), (False, 0), (True, 1), (True, 2), (True, 1),
+             (True, 1)],
+            [(alert.in_alarm, len(alert.breaching_channels))
+             for alert in alerts])
+
+        latest = self.trigger.get_latest_alert()
+        call_command('compact_alerts', delete_after_days=1,
+                     stdout=StringIO())
+        self.assertEqual(latest, self.trigger.get_latest_alert())
+        self.assertEqual(2, self.trigger.alerts.count())
+
+        # Every trigger keeps its latest alert however old it is
+        call_command('compact_alerts', delete_after_days=0,
+                     stdout=StringIO())
+        for trigger in Trigger.objects.all():
+            self.assertTrue(trigger.alerts.count() <= 1)
+        self.assertEqual(latest, self.trigger.get_latest_alert())
+
+    def test_create_alert_partition_requires_partitioned_table(self):
+        out = StringIO()
+        call_command('create_alert_partition', stdout=out)
+        self.assertIn('not partitioned', out.getvalue())
+
+    def test_evaluate_monitors_matches_agg_measurements(self):
+        '''Batched aggregates should match per-monitor aggregates'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+        # Same metric and window as monitor 1 but a different group
+        Monitor.objects.create(
+            channel_group=Group.objects.get(pk=2),
+            metric=Metric.objects.get(pk=1),
+            interval_type=Monitor.IntervalType.HOUR,
+            interval_count=2,
+            stat=Monitor.Stat.SUM,
+            user=self.user
+        )
+        monitors = Monitor.objects.all()
+        with patch.object(Monitor, 'evaluate_alarm', autospec=True) as ea:
+            evaluate_monitors(monitors, endtime)
+
+        self.assertEqual(len(monitors), ea.call_count)
+        for args, kwargs in ea.call_args_list:
+            monitor = args[0]
+            channel_values = kwargs['channel_values']
+            expected = monitor.agg_measurements(endtime)
+            self.assertEqual(
+                sorted(channel_values, key=lambda v: v['channel']),
+                sorted(expected, key=lambda v: v['channel']))
+
+    def test_evaluate_monitors_shares_aggregate_queries(self):
+        '''One aggregate query per distinct (metric, window)'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+        for i in range(5):
+            Monitor.objects.create(
+                channel_group=Group.objects.get(pk=1),
+                metric=Metric.objects.get(pk=1),
+                interval_type=Monitor.IntervalType.HOUR,
+                interval_count=2,
+                stat=Monitor.Stat.MAXIMUM,
+                user=self.user
+            )
+        n_windows = len({(m.metric_id, m.get_window(endtime))
+                         for m in Monitor.objects.all()})
+        with patch('measurement.models.Monitor.evaluate_alarm'):
+            with CaptureQueriesContext(connection) as queries:
+                evaluate_monitors(Monitor.objects.all(), endtime)
+
+        agg_queries = [q for q in queries.captured_queries
+                       if 'measurement_measurement' in q['sql']]
+        self.assertEqual(n_windows, len(agg_queries))
+
+    def test_evaluate_alarms_workers(self):
+        '''Test evaluate_alarms command with a thread pool'''
+        n_monitors = len(Monitor.objects.all())
+        out = StringIO()
+        with patch('measurement.models.Monitor.evaluate_alarm') as ea:
+            call_command('evaluate_alarms', '--workers=2', stdout=out)
+            self.assertEqual(n_monitors, ea.call_count)
+        self.assertIn(f'Evaluated {n_monitors} monitors', out.getvalue())
+
+    def test_evaluate_monitors_budget(self):
+        '''Monitors over budget are stopped and reported'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+
+        def slow_evaluate_alarm(*args, **kwargs):
+            time.sleep(0.2)
+            Alert.objects.count()
+
+        with patch('measurement.models.Monitor.evaluate_alarm') as ea:
+            ea.side_effect = slow_evaluate_alarm
+            runs = evaluate_monitors(
+                Monitor.objects.all(), endtime, budget_seconds=0.1)
+
+        self.assertEqual(len(runs), Monitor.objects.count())
+        for run in runs:
+            self.assertIsNotNone(run.error)
+            self.assertGreaterEqual(run.duration, 0.2)
+
+    def test_evaluate_monitors_batch_aggregate_budget(self):
+        '''The shared aggregate has the budget of the whole batch'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+        for i in range(3):
+            Monitor.objects.create(
+                channel_group=Group.objects.get(pk=1),
+                metric=Metric.objects.get(pk=1),
+                interval_type=Monitor.IntervalType.HOUR,
+                interval_count=2,
+                stat=Monitor.Stat.MAXIMUM,
+                user=self.user
+            )
+
+        def slow_agg_batch(*args):
+            time.sleep(0.15)
+            Alert.objects.count()
+            return {}
+
+        monitors = Monitor.objects.filter(
+            metric_id=1, interval_type=Monitor.IntervalType.HOUR,
+            interval_count=2)
+        with patch('measurement.evaluation.agg_batch',
+                   side_effect=slow_agg_batch), \
+                patch('measurement.models.Monitor.evaluate_alarm'):
+            runs = evaluate_monitors(monitors, endtime, budget_seconds=0.1)
+        self.assertEqual([None] * len(runs), [run.error for run in runs])
+
+    def test_evaluate_monitors_batch_aggregate_fails(self):
+        '''Monitors are evaluated one by one if the aggregate fails'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+        with patch('measurement.evaluation.agg_batch',
+                   side_effect=DatabaseError('canceling statement')), \
+                patch.object(Monitor, 'evaluate_alarm',
+                             autospec=True) as ea:
+            runs = evaluate_monitors(Monitor.objects.all(), endtime)
+
+        self.assertEqual(Monitor.objects.count(), ea.call_count)
+        self.assertEqual([None] * len(runs), [run.error for run in runs])
+        for args, kwargs in ea.call_args_list:
+            self.assertNotIn('channel_values', kwargs)
+
+    def test_evaluate_monitors_deadline(self):
+        '''Monitors that haven't started by the deadline are skipped'''
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+
+        with patch('measurement.models.Monitor.evaluate_alarm') as ea:
+            ea.side_effect = lambda *args, **kwargs: time.sleep(0.2)
+            runs = evaluate_monitors(
+                Monitor.objects.all(), endtime, deadline_seconds=0.1)
+
+        self.assertEqual(1, ea.call_count)
+        self.assertEqual(len(runs) - 1, len([r for r in runs if r.skipped]))
+        for run in runs:
+            if not run.skipped:
+                self.assertGreater(run.queries, 0)
@@ -0,0 +1,161 @@
+from django.core.management import call_command
+from django.db.models import Min
+from django.db.models.functions import Abs
+from django.test import TestCase, override_settings
+
+from measurement.archive_windows import agg_window, plan_window
+from measurement.evaluation import agg_batch
+from measurement.models import (ArchiveDay, ArchiveHour, Measurement, Metric,
+                                agg_channel_values)
+from nslc.models import Channel, Network
+
+from datetime import datetime, timedelta
+from io import StringIO
+import pytz
+from squac.test_mixins import sample_user
+
+'''Tests for aggregating monitor windows from archives:
+to run only this file
+    ./mg.sh "test measurement.tests.test_archive_windows && flake8"
+
+'''
+
+
+@override_settings(ARCHIVE_ALARMS_ENABLED=True)
+class ArchiveWindowTests(TestCase):
+
+    def getTestChannel(self, station_code):
+        return Channel.objects.create(
+            code='EHZ',
+            name="EHZ",
+            station_code=station_code,
+            station_name='Test Name',
+            loc="--",
+            network=self.net,
+            lat=45,
+            lon=-122,
+            elev=0,
+            user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC)
+        )
+
+    def setUp(self):
+        self.user = sample_user()
+        self.net = Network.objects.create(
+            code="UW", name="University of Washington", user=self.user)
+        self.chan1 = self.getTestChannel('CH1')
+        self.chan2 = self.getTestChannel('CH2')
+        self.channel_ids = [self.chan1.id, self.chan2.id]
+        self.metric = Metric.objects.create(
+            name='Sample metric',
+            unit='furlong',
+            code="someotherthing",
+            default_minval=1,
+            default_maxval=10.0,
+            user=self.user,
+            reference_url='pnsn.org'
+        )
+        self.day = datetime(2021, 3, 1, tzinfo=pytz.UTC)
+
+        measurements = []
+        for i in range(4 * 24 * 3):
+            starttime = self.day + timedelta(minutes=20 * i)
+            for channel, value in ((self.chan1, float(i % 13) - 4),
+                                   (self.chan2, float(i * 7 % 29))):
+                measurements.append(Measurement(
+                    metric=self.metric,
+                    channel=channel,
+                    value=value,
+                    starttime=starttime,
+                    endtime=starttime + timedelta(minutes=20),
+                    user=self.user))
+        Measurement.objects.bulk_create(measurements)
+        self.archive()
+        # Window of 2.5 days that ends 2 hours after the archives
+        self.window = (self.day + timedelta(hours=18),
+                       self.day + timedelta(days=3, hours=6))
+
+    def archive(self):
+        # Days 2-3 and the first four hours of day 4 are archived
+        out = StringIO()
+        call_command('backfill_archives', 'day', '--overwrite',
+                     start_time=self.day + timedelta(days=2),
+                     end_time=self.day + timedelta(days=3),
+                     stdout=out)
+        call_command('backfill_archives', 'hour', '--overwrite',
+                     start_time=self.day + timedelta(days=3, hours=1),
+                     end_time=self.day + timedelta(days=3, hours=4),
+                     stdout=out)
+
+    def test_plan_window(self):
+        archived, uncovered = plan_window(self.metric.id, *self.window)
+        self.assertEqual([
+            (ArchiveDay, [(self.day + timedelta(days=1),
+                           self.day + timedelta(days=3))]),
+            (ArchiveHour, [(self.day + timedelta(days=3),
+                            self.day + timedelta(days=3, hours=4))]),
+        ], archived)
+        self.assertEqual([
+            (self.day + timedelta(hours=18), self.day + timedelta(days=1)),
+            (self.day + timedelta(days=3, hours=4),
+             self.day + timedelta(days=3, hours=6)),
+        ], uncovered)
+
+    def test_matches_raw_aggregates(self):
+        expected = {row['channel']: row for row in agg_channel_values(
+            Measurement.objects.filter(metric=self.metric,
+                                       starttime__range=self.window))}
+        values = agg_window(self.metric.id, self.window, self.channel_ids)
+        self.assertEqual(set(self.channel_ids), set(values))
+        for channel_id in self.channel_ids:
+            for stat in ('count', 'sum', 'avg', 'min', 'max', 'minabs',
+                         'maxabs'):
+                self.assertAlmostEqual(expected[channel_id][stat],
+                                       values[channel_id][stat])
+            # Percentiles are combined from quantiles
+            value_range = expected[channel_id]['max'] - \
+                expected[channel_id]['min']
+            for stat in ('median', 'p90', 'p95'):
+                error = expected[channel_id][stat] - values[channel_id][stat]
+                self.assertLess(abs(error), value_range * 0.05)
+
+    def test_minabs_of_values_straddling_zero(self):
+        # Values change sign but are never 0, so minabs is 1
+        for measurement in Measurement.objects.filter(channel=self.chan1):
+            measurement.value = (measurement.value % 3 + 1) * \
+                (-1) ** (measurement.starttime.minute // 20)
+            measurement.save()
+        self.archive()
+        values = agg_window(self.metric.id, self.window, self.channel_ids)
+        self.assertEqual(1.0, values[self.chan1.id]['minabs'])
+
+        # Archives without min_abs read it from their raw measurements
+        for model in (ArchiveDay, ArchiveHour):
+            model.objects.update(min_abs=None)
+        values = agg_window(self.metric.id, self.window, self.channel_ids)
+        self.assertEqual(1.0, values[self.chan1.id]['minabs'])
+        self.assertEqual(Measurement.objects.filter(
+            channel=self.chan2, starttime__range=self.window).aggregate(
+                minabs=Min(Abs('value')))['minabs'],
+            values[self.chan2.id]['minabs'])
+
+    def test_queries_independent_of_window(self):
+        for days in (2, 3):
+            window = (self.window[1] - timedelta(days=days), self.window[1])
+            # Archived ranges, two archive levels and the raw tail
+            with self.assertNumQueries(5):
+                agg_window(self.metric.id, window, self.channel_ids)
+
+    def test_agg_batch_reads_archives(self):
+        # Raw measurements of archived periods are no longer read
+        Measurement.objects.filter(
+            starttime__gte=self.day + timedelta(days=1),
+            starttime__lt=self.day + timedelta(days=3)).delete()
+        values = agg_batch(self.metric.id, self.window, self.channel_ids)
+        # 3 measurements per hour plus the one at the end of the window
+        self.assertEqual(60 * 3 + 1, values[self.chan1.id]['count'])
+
+        with override_settings(ARCHIVE_ALARMS_ENABLED=False):
+            values = agg_batch(self.metric.id, self.window, self.channel_ids)
+        self.assertEqual(12 * 3 + 1, values[self.chan1.id]['count'])
@@ -0,0 +1,241 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from measurement.backtest import (backtest_monitor, evaluation_times,
+                                  window_values)
+from measurement.models import (Alert, ArchiveHour, Measurement, Metric,
+                                Monitor, Trigger, agg_channel_values)
+from nslc.models import Channel, Group, Network
+from organization.models import Organization
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from datetime import datetime, timedelta
+from io import StringIO
+import pytz
+from squac.test_mixins import sample_user
+
+'''Tests for monitor backtesting:
+to run only this file
+    ./mg.sh "test measurement.tests.test_backtest && flake8"
+
+'''
+
+
+class BacktestTests(TestCase):
+
+    def getTestChannel(self, station_code):
+        return Channel.objects.create(
+            code='EHZ',
+            name="EHZ",
+            station_code=station_code,
+            station_name='Test Name',
+            loc="--",
+            network=self.net,
+            lat=45,
+            lon=-122,
+            elev=0,
+            user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC)
+        )
+
+    def getTestMonitor(self, interval_type, interval_count,
+                       stat=Monitor.Stat.SUM):
+        return Monitor.objects.create(
+            channel_group=self.grp,
+            metric=self.metric,
+            interval_type=interval_type,
+            interval_count=interval_count,
+            stat=stat,
+            user=self.user
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.user.is_staff = True
+        self.client.force_authenticate(self.user)
+        self.organization = Organization.objects.create(name='PNSN')
+        self.net = Network.objects.create(
+            code="UW", name="University of Washington", user=self.user)
+        self.chan1 = self.getTestChannel('CH1')
+        self.chan2 = self.getTestChannel('CH2')
+        self.grp = Group.objects.create(
+            name='Test group',
+            user=self.user,
+            organization=self.organization,
+        )
+        self.grp.channels.set([self.chan1.id, self.chan2.id])
+        self.metric = Metric.objects.create(
+            name='Sample metric',
+            unit='furlong',
+            code="someotherthing",
+            default_minval=1,
+            default_maxval=10.0,
+            user=self.user,
+            reference_url='pnsn.org'
+        )
+        self.starttime = datetime(2021, 3, 1, tzinfo=pytz.UTC)
+        self.endtime = self.starttime + timedelta(hours=12)
+
+        # Every 7 minutes and never on a window boundary
+        measurements = []
+        for i in range(12 * 60 // 7):
+            starttime = self.starttime + timedelta(minutes=7 * i + 3,
+                                                   seconds=30)
+            for channel, value in ((self.chan1, float(i % 5) - 1),
+                                   (self.chan2, float(i % 11) * 2 - 7)):
+                measurements.append(Measurement(
+                    metric=self.metric,
+                    channel=channel,
+                    value=value,
+                    starttime=starttime,
+                    endtime=starttime + timedelta(minutes=1),
+                    user=self.user))
+        Measurement.objects.bulk_create(measurements)
+
+    def assert_matches_aggregates(self, monitor, source):
+        channel_ids = [self.chan1.id, self.chan2.id]
+        times = evaluation_times(self.starttime + timedelta(hours=4),
+                                 self.endtime)
+        values = window_values(monitor, channel_ids, times, source)
+        for e, endtime in enumerate(times):
+            starttime, endtime = monitor.get_window(endtime)
+            expected = {row['channel']: row for row in agg_channel_values(
+                Measurement.objects.filter(
+                    metric=self.metric,
+                    starttime__gte=starttime,
+                    starttime__lt=endtime))}
+            for i, channel_id in enumerate(channel_ids):
+                for stat in ('count', 'sum', 'avg', 'min', 'max', 'minabs',
+                             'maxabs'):
+                    self.assertAlmostEqual(
+                        expected[channel_id][stat], values[stat][i, e])
+
+    def test_minute_windows_match_aggregates(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.MINUTE, 20)
+        self.assert_matches_aggregates(monitor, 'raw')
+
+    def test_hour_windows_match_aggregates(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.HOUR, 3)
+        self.assert_matches_aggregates(monitor, 'raw')
+
+    def test_archive_source_reads_raw_outside_archives(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.HOUR, 3)
+        # No hour archives at all
+        self.assert_matches_aggregates(monitor, 'archive')
+        # Only some hours in the middle are archived
+        call_command('backfill_archives', 'hour', '--overwrite',
+                     start_time=self.starttime + timedelta(hours=4),
+                     end_time=self.starttime + timedelta(hours=7),
+                     stdout=StringIO())
+        self.assertTrue(ArchiveHour.objects.exists())
+        self.assert_matches_aggregates(monitor, 'archive')
+
+    def test_archive_windows(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.HOUR, 2)
+        for hour, (min_, max_) in enumerate(((-1, 3), (2, 4), (-6, -2))):
+            ArchiveHour.objects.create(
+                channel=self.chan1,
+                metric=self.metric,
+                min=min_, max=max_, mean=1, median=hour, stdev=0,
+                num_samps=hour + 1, p05=0, p10=0, p90=0, p95=0,
+                starttime=self.starttime + timedelta(hours=hour),
+                endtime=self.starttime + timedelta(hours=hour + 1))
+        times = evaluation_times(self.starttime + timedelta(hours=2),
+                                 self.starttime + timedelta(hours=3))
+        values = window_values(monitor, [self.chan1.id, self.chan2.id],
+                               times, 'archive')
+        self.assertEqual([3, 5], list(values['count'][0]))
+        self.assertEqual([3, 5], list(values['sum'][0]))
+        self.assertEqual([-1, -6], list(values['min'][0]))
+        self.assertEqual([0, 2], list(values['minabs'][0]))
+        self.assertEqual([4, 6], list(values['maxabs'][0]))
+        # Count weighted mean of the hourly medians
+        self.assertAlmostEqual(2 / 3, values['median'][0, 0])
+        self.assertAlmostEqual(8 / 5, values['median'][0, 1])
+        self.assertEqual([0, 0], list(values['count'][1]))
+
+    def test_timeline_matches_evaluation(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.MINUTE, 30)
+        Trigger.objects.create(
+            monitor=monitor,
+            val1=0,
+            value_operator=Trigger.ValueOperator.GREATER_THAN,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        Trigger.objects.create(
+            monitor=monitor,
+            val1=5,
+            value_operator=Trigger.ValueOperator.LESS_THAN,
+            num_channels=1,
+            num_channels_operator=Trigger.NumChannelsOperator.GREATER_THAN,
+            alert_on_out_of_alarm=True,
+            user=self.user
+        )
+        n_alerts = Alert.objects.count()
+        result = backtest_monitor(monitor, self.starttime, self.endtime)
+        self.assertEqual(n_alerts, Alert.objects.count())
+        self.assertEqual(13, result['evaluations'])
+        self.assertEqual('raw', result['source'])
+
+        for endtime in evaluation_times(self.starttime, self.endtime):
+            monitor.evaluate_alarm(endtime, check_digest=False)
+        for trigger_result in result['triggers']:
+            alerts = Alert.objects.filter(
+                trigger=trigger_result['trigger'],
+                timestamp__lte=self.endtime).order_by('timestamp')
+            self.assertTrue(alerts)
+            self.assertEqual(
+                [(alert.timestamp, alert.in_alarm,
+                  alert.get_breaching_channel_ids()) for alert in alerts],
+                [(alert['timestamp'], alert['in_alarm'],
+                  [channel['channel_id']
+                   for channel in alert['breaching_channels']])
+                 for alert in trigger_result['alerts']])
+
+    def test_backtest_endpoint(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.HOUR, 1)
+        trigger = Trigger.objects.create(
+            monitor=monitor,
+            val1=20,
+            value_operator=Trigger.ValueOperator.GREATER_THAN,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        n_alerts = Alert.objects.count()
+        url = reverse('measurement:monitor-backtest', args=[monitor.id])
+        res = self.client.get(url, {
+            'starttime': self.starttime.isoformat(),
+            'endtime': self.endtime.isoformat()
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(13, res.data['evaluations'])
+        [trigger_result] = res.data['triggers']
+        self.assertEqual(trigger.id, trigger_result['trigger'])
+        self.assertEqual(trigger_result['alert_count'],
+                         len(trigger_result['alerts']))
+        self.assertEqual(n_alerts, Alert.objects.count())
+
+    def test_backtest_endpoint_validation(self):
+        monitor = self.getTestMonitor(Monitor.IntervalType.HOUR, 1)
+        url = reverse('measurement:monitor-backtest', args=[monitor.id])
+        for params in ({'starttime': self.starttime.isoformat()},
+                       {'starttime': self.endtime.isoformat(),
+                        'endtime': self.starttime.isoformat()},
+                       {'starttime': '2000-01-01T00:00:00Z',
+                        'endtime': '2021-01-01T00:00:00Z'}):
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        monitor = self.getTestMonitor(Monitor.IntervalType.LASTN, 5)
+        url = reverse('measurement:monitor-backtest', args=[monitor.id])
+        res = self.client.get(url, {
+            'starttime': self.starttime.isoformat(),
+            'endtime': self.endtime.isoformat()
+        })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
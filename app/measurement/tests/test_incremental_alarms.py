@@ -0,0 +1,212 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from measurement import incremental
+from measurement.incremental import (SKETCH_SIZE, build_bucket,
+                                     evaluate_pending, window_value)
+from measurement.models import (Alert, ChannelWindow, Measurement, Metric,
+                                Monitor, Trigger, agg_channel_values)
+from nslc.models import Channel, Group, Network
+from organization.models import Organization
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest.mock import patch
+import pytz
+from squac.test_mixins import sample_user
+
+'''Tests for incremental evaluation of minute monitors:
+to run only this file
+    ./mg.sh "test measurement.tests.test_incremental_alarms && flake8"
+
+'''
+
+
+@override_settings(INCREMENTAL_ALARMS_ENABLED=True)
+class IncrementalAlarmTests(TestCase):
+
+    def getTestChannel(self, station_code):
+        return Channel.objects.create(
+            code='EHZ',
+            name="EHZ",
+            station_code=station_code,
+            station_name='Test Name',
+            loc="--",
+            network=self.net,
+            lat=45,
+            lon=-122,
+            elev=0,
+            user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.user.is_staff = True
+        self.client.force_authenticate(self.user)
+        self.organization = Organization.objects.create(name='PNSN')
+        self.net = Network.objects.create(
+            code="UW", name="University of Washington", user=self.user)
+        self.chan1 = self.getTestChannel('CH1')
+        self.chan2 = self.getTestChannel('CH2')
+        self.grp = Group.objects.create(
+            name='Test group',
+            user=self.user,
+            organization=self.organization,
+        )
+        self.grp.channels.set([self.chan1.id, self.chan2.id])
+        self.metric = Metric.objects.create(
+            name='Sample metric',
+            unit='furlong',
+            code="someotherthing",
+            default_minval=1,
+            default_maxval=10.0,
+            user=self.user,
+            reference_url='pnsn.org'
+        )
+        self.monitor = Monitor.objects.create(
+            channel_group=self.grp,
+            metric=self.metric,
+            interval_type=Monitor.IntervalType.MINUTE,
+            interval_count=10,
+            stat=Monitor.Stat.SUM,
+            user=self.user
+        )
+        self.trigger = Trigger.objects.create(
+            monitor=self.monitor,
+            val1=100,
+            value_operator=Trigger.ValueOperator.GREATER_THAN,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        self.now = datetime.now(tz=pytz.UTC).replace(second=0,
+                                                     microsecond=0)
+
+    def post_measurements(self, values):
+        '''values is a list of (channel, value, minutes before now)'''
+        payload = [{
+            'metric': self.metric.id,
+            'channel': channel.id,
+            'value': value,
+            'starttime': self.now - timedelta(minutes=minutes),
+            'endtime': self.now - timedelta(minutes=minutes - 1),
+        } for channel, value, minutes in values]
+        res = self.client.post(reverse('measurement:measurement-list'),
+                               payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def get_window_value(self, channel):
+        window = ChannelWindow.objects.get(monitor=self.monitor,
+                                           channel=channel)
+        starttime, endtime = self.monitor.get_window(self.now)
+        return window_value(channel.id, window.buckets, starttime, endtime)
+
+    def test_window_matches_aggregate(self):
+        self.post_measurements(
+            [(self.chan1, float(i % 7) - 2, i % 12 + 1) for i in range(30)])
+        starttime, endtime = self.monitor.get_window(self.now)
+        [expected] = agg_channel_values(Measurement.objects.filter(
+            metric=self.metric,
+            channel=self.chan1,
+            starttime__gte=starttime,
+            starttime__lt=endtime))
+
+        value = self.get_window_value(self.chan1)
+        for key, expected_value in expected.items():
+            self.assertAlmostEqual(expected_value, value[key])
+
+    def test_ignores_old_measurements(self):
+        self.post_measurements([(self.chan1, 1.0, 60)])
+        self.assertFalse(ChannelWindow.objects.exists())
+        self.assertIsNone(
+            Monitor.objects.get(id=self.monitor.id).window_changed_at)
+
+    def test_updated_measurement_rebuilds_bucket(self):
+        self.post_measurements([(self.chan1, 1.0, 2), (self.chan1, 2.0, 3)])
+        self.post_measurements([(self.chan1, 5.0, 2)])
+        value = self.get_window_value(self.chan1)
+        self.assertEqual(2, value['count'])
+        self.assertEqual(7.0, value['sum'])
+
+    def test_window_created_concurrently(self):
+        self.post_measurements([(self.chan1, 1.0, 2)])
+        buckets = ChannelWindow.objects.get(channel=self.chan1).buckets
+        ChannelWindow.objects.all().delete()
+        select_windows = incremental.lock_windows
+
+        def lock_windows(keys):
+            # Another request creates the window after it was looked for
+            if not ChannelWindow.objects.exists():
+                ChannelWindow.objects.create(
+                    monitor=self.monitor, channel=self.chan1, buckets=buckets)
+                return {}
+            return select_windows(keys)
+
+        with patch('measurement.incremental.lock_windows',
+                   side_effect=lock_windows):
+            self.post_measurements([(self.chan1, 2.0, 3)])
+        value = self.get_window_value(self.chan1)
+        self.assertEqual(2, value['count'])
+        self.assertEqual(3.0, value['sum'])
+
+    def test_evaluate_pending(self):
+        self.post_measurements([(self.chan1, 150.0, 2), (self.chan2, 1.0, 2)])
+        monitor = Monitor.objects.get(id=self.monitor.id)
+        self.assertIsNotNone(monitor.window_changed_at)
+
+        # Nothing is evaluated until the debounce period has passed
+        self.assertEqual([], evaluate_pending(
+            debounce_seconds=30, now=monitor.window_changed_at))
+        evaluated = evaluate_pending(
+            debounce_seconds=30,
+            now=monitor.window_changed_at + timedelta(seconds=30))
+        self.assertEqual([self.monitor.id], [m.id for m in evaluated])
+
+        alert = Alert.objects.get(trigger=self.trigger, in_alarm=True)
+        self.assertEqual([self.chan1.id], [
+            channel['channel_id'] for channel in alert.breaching_channels])
+        self.assertIsNone(
+            Monitor.objects.get(id=self.monitor.id).window_changed_at)
+
+    def test_evaluate_incremental_alarms_command(self):
+        self.post_measurements([(self.chan1, 150.0, 2)])
+        out = StringIO()
+        call_command('evaluate_incremental_alarms', '--debounce-seconds=0',
+                     stdout=out)
+        self.assertIn('Evaluated 1 monitors', out.getvalue())
+        out = StringIO()
+        call_command('evaluate_incremental_alarms', '--debounce-seconds=0',
+                     stdout=out)
+        self.assertIn('Evaluated 0 monitors', out.getvalue())
+
+    @override_settings(INCREMENTAL_ALARMS_ENABLED=False)
+    def test_disabled(self):
+        self.post_measurements([(self.chan1, 150.0, 2)])
+        self.assertFalse(ChannelWindow.objects.exists())
+
+    def test_sketch_percentiles(self):
+        starttime = self.now
+        measurements = [
+            Measurement(starttime=starttime + timedelta(seconds=i / 10),
+                        value=float(i))
+            for i in range(SKETCH_SIZE * 4)]
+        bucket = build_bucket(measurements)
+        self.assertEqual(SKETCH_SIZE, len(bucket['q']))
+
+        value = window_value(self.chan1.id, {'0': bucket}, starttime,
+                             starttime)
+        self.assertEqual(0, value['count'])
+        value = window_value(self.chan1.id, {'1': bucket},
+                             datetime(1970, 1, 1, tzinfo=pytz.UTC),
+                             starttime)
+        self.assertEqual(SKETCH_SIZE * 4, value['count'])
+        # Within a couple of ranks of the exact values
+        for stat, percentile in (('median', 50), ('p90', 90), ('p95', 95)):
+            exact = percentile / 100 * (SKETCH_SIZE * 4 - 1)
+            self.assertLess(abs(value[stat] - exact), SKETCH_SIZE * 4 / 50)
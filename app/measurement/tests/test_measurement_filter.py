@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -93,6 +95,45 @@ class AuthenticatedMeasurementFilterTests(TestCase):
         self.assertEqual(res2.status_code, status.HTTP_200_OK)
         self.assertEqual(res2.data, res1.data)
 
+    def test_group_filter_resolves_channels(self):
+        url = reverse('measurement:measurement-list')
+        url += f'?metric=3&group={self.grp.id}'\
+               '&starttime=2016-02-01T03:00:00Z&endtime=2020-02-02T05:00:00Z'
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        [query] = [query['sql'] for query in queries
+                   if 'FROM "measurement_measurement"' in query['sql']]
+        self.assertIn('"channel_id" = ANY(', query)
+        self.assertNotIn('nslc_group_channels', query)
+
+    def test_nslc_filter_resolves_channels(self):
+        url = reverse('measurement:measurement-list')
+        nslc = Channel.objects.get(pk=5).nslc.upper()
+        url += f'?metric=3&nslc={nslc}'\
+               '&starttime=2016-02-01T03:00:00Z&endtime=2020-02-02T05:00:00Z'
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(1, len(res.data))
+        [query] = [query['sql'] for query in queries
+                   if 'FROM "measurement_measurement"' in query['sql']]
+        self.assertNotIn('nslc_channel', query)
+
+    def test_measurement_omit_fields(self):
+        url = reverse('measurement:measurement-list')
+        url += '?metric=3&channel=5&omit=created_at,user'\
+               '&starttime=2016-02-01T03:00:00Z&endtime=2020-02-02T05:00:00Z'
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            ['channel', 'endtime', 'id', 'metric', 'starttime', 'value'],
+            sorted(res.data[0]))
+        [query] = [query['sql'] for query in queries
+                   if 'FROM "measurement_measurement"' in query['sql']]
+        self.assertNotIn('"user_id"', query)
+
     def test_measurement_out_of_range_filter(self):
         # Test that filter does not return measurements outside date range
         url = reverse('measurement:measurement-list')
@@ -1,12 +1,15 @@
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 # from django.db.models import Avg, Count, Max, Min, Sum
 
 from measurement.models import (Monitor, Trigger, Alert, Measurement,
-                                Metric)
+                                Metric, ChannelContext)
+from measurement.views import MonitorViewSet
 from nslc.models import Channel, Group, Network
 from organization.models import Organization
 
@@ -15,7 +18,9 @@ from rest_framework import status
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from unittest.mock import Mock, patch
 import pytz
+from squac.mixins import BulkUpdateMixin
 from squac.test_mixins import sample_user
 
 '''Tests for monitor and trigger models:
@@ -234,6 +239,203 @@ class PrivateMonitorApiTests(TestCase):
         self.assertEqual(
             alert.in_alarm, res2.data['latest_alert']['in_alarm'])
 
+    def count_list_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse(url_name))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(queries), res.data
+
+    def test_list_queries_independent_of_triggers(self):
+        n_monitor_queries, _ = self.count_list_queries(
+            'measurement:monitor-list')
+        n_trigger_queries, _ = self.count_list_queries(
+            'measurement:trigger-list')
+
+        for i in range(3):
+            monitor = self.getTestMonitor()
+            for val1 in range(3):
+                trigger = Trigger.objects.create(
+                    monitor=monitor,
+                    val1=val1,
+                    num_channels_operator=Trigger.NumChannelsOperator.ANY,
+                    user=self.user
+                )
+                trigger.create_alert(
+                    True, timestamp=datetime(2020, 1, 1, tzinfo=pytz.UTC))
+
+        n_queries, monitors = self.count_list_queries(
+            'measurement:monitor-list')
+        self.assertEqual(n_monitor_queries, n_queries)
+        n_queries, triggers = self.count_list_queries(
+            'measurement:trigger-list')
+        self.assertEqual(n_trigger_queries, n_queries)
+
+        # Latest alerts match the per-trigger lookup
+        triggers += [trigger for monitor in monitors
+                     for trigger in monitor['triggers']]
+        for data in triggers:
+            alert = Trigger.objects.get(id=data['id']).get_latest_alert()
+            latest_alert = data['latest_alert'] or {}
+            self.assertEqual(alert and alert.id, latest_alert.get('id'))
+
+    def test_alert_list_queries_independent_of_alerts(self):
+        n_alert_queries, _ = self.count_list_queries('measurement:alert-list')
+
+        for i in range(3):
+            monitor = self.getTestMonitor()
+            trigger = Trigger.objects.create(
+                monitor=monitor,
+                val1=i,
+                num_channels_operator=Trigger.NumChannelsOperator.ANY,
+                user=self.user
+            )
+            for day in range(1, 4):
+                trigger.create_alert(
+                    True, timestamp=datetime(2020, 1, day, tzinfo=pytz.UTC))
+
+        n_queries, alerts = self.count_list_queries('measurement:alert-list')
+        self.assertEqual(n_alert_queries, n_queries)
+        self.assertTrue(all(alert['monitor'] for alert in alerts))
+
+    def test_detail_queries(self):
+        # Related objects read by the detail serializers are loaded with
+        # the object itself
+        monitor_url = reverse('measurement:monitor-detail',
+                              kwargs={'pk': self.monitor.id})
+        trigger_url = reverse('measurement:trigger-detail',
+                              kwargs={'pk': self.trigger.id})
+        alert_url = reverse('measurement:alert-detail',
+                            kwargs={'pk': self.alert.id})
+        counts = []
+        for url in (monitor_url, trigger_url, alert_url):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+
+        Trigger.objects.create(
+            monitor=self.monitor,
+            val1=1,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        with self.assertNumQueries(counts[0]):
+            self.client.get(monitor_url)
+        with self.assertNumQueries(counts[1]):
+            self.client.get(trigger_url)
+        with self.assertNumQueries(counts[2]):
+            self.client.get(alert_url)
+
+    def count_alert_inserts(self, queries):
+        return len([query for query in queries if query['sql'].startswith(
+            'INSERT INTO "measurement_alert"')])
+
+    def test_monitor_save_resets_alerts_in_one_insert(self):
+        for val1 in range(3):
+            Trigger.objects.create(
+                monitor=self.monitor,
+                val1=val1,
+                num_channels_operator=Trigger.NumChannelsOperator.ANY,
+                user=self.user
+            )
+        n_alerts = Alert.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.monitor.save()
+        self.assertEqual(1, self.count_alert_inserts(queries))
+        self.assertEqual(n_alerts + 4, Alert.objects.count())
+        for trigger in self.monitor.triggers.all():
+            self.assertFalse(trigger.get_latest_alert().in_alarm)
+
+    def test_bulk_update_monitors(self):
+        monitor = self.getTestMonitor()
+        for m in (self.monitor, monitor):
+            Trigger.objects.create(
+                monitor=m,
+                val1=1,
+                num_channels_operator=Trigger.NumChannelsOperator.ANY,
+                user=self.user
+            )
+        n_alerts = Alert.objects.count()
+        url = reverse('measurement:monitor-bulk-update')
+        res = self.client.patch(url, [
+            {'id': self.monitor.id, 'interval_count': 6},
+            {'id': monitor.id, 'interval_count': 7, 'name': 'Renamed'}
+        ], format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([6, 7], [m['interval_count'] for m in res.data])
+        monitor.refresh_from_db()
+        self.assertEqual('Renamed', monitor.name)
+        self.assertEqual(7, monitor.interval_count)
+        # One reset alert for each of the three triggers
+        self.assertEqual(n_alerts + 3, Alert.objects.count())
+
+    def test_bulk_update_triggers(self):
+        trigger = Trigger.objects.create(
+            monitor=self.monitor,
+            val1=1,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        n_alerts = Alert.objects.count()
+        url = reverse('measurement:trigger-bulk-update')
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(url, [
+                {'id': trigger.id, 'val1': 2},
+                {'id': self.trigger.id, 'val1': 3}
+            ], format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(1, self.count_alert_inserts(queries))
+        self.assertEqual(n_alerts + 2, Alert.objects.count())
+        # Returned in the order of the request
+        self.assertEqual([trigger.id, self.trigger.id],
+                         [t['id'] for t in res.data])
+        self.assertEqual([2, 3], [Trigger.objects.get(id=t['id']).val1
+                                  for t in res.data])
+
+        # Each trigger is validated once, by the bulk update view
+        with patch.object(Trigger, 'clean', autospec=True) as clean:
+            res = self.client.patch(url, [
+                {'id': trigger.id, 'val1': 1},
+                {'id': self.trigger.id, 'val1': 2}
+            ], format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(2, clean.call_count)
+
+    def test_default_perform_bulk_update(self):
+        view = MonitorViewSet(request=Mock(user=self.user))
+        updated_at = self.monitor.updated_at
+        self.monitor.name = 'Renamed'
+        BulkUpdateMixin.perform_bulk_update(view, [self.monitor], ['name'])
+        self.monitor.refresh_from_db()
+        self.assertEqual('Renamed', self.monitor.name)
+        self.assertGreater(self.monitor.updated_at, updated_at)
+
+    def test_bulk_update_rolls_back_invalid(self):
+        url = reverse('measurement:trigger-bulk-update')
+        trigger = Trigger.objects.create(
+            monitor=self.monitor,
+            val1=1,
+            num_channels_operator=Trigger.NumChannelsOperator.ANY,
+            user=self.user
+        )
+        n_alerts = Alert.objects.count()
+        # val2 less than val1
+        res = self.client.patch(url, [
+            {'id': trigger.id, 'val1': 4},
+            {'id': self.trigger.id, 'val1': 7}
+        ], format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual({}, res.data[0])
+        self.assertTrue(res.data[1])
+        trigger.refresh_from_db()
+        self.assertEqual(1, trigger.val1)
+        self.assertEqual(n_alerts, Alert.objects.count())
+
+        for data in ([{'val1': 4}], {'id': trigger.id},
+                     [{'id': 0, 'val1': 4}]):
+            res = self.client.patch(url, data, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_calc_interval_seconds_2_minutes(self):
         monitor = self.getTestMonitor(
             interval_type=Monitor.IntervalType.MINUTE,
@@ -546,6 +748,71 @@ class PrivateMonitorApiTests(TestCase):
         in_alarm = trigger.in_alarm_state(breaching_channels)
         self.assertFalse(in_alarm)
 
+    def test_get_breaching_channels_with_context(self):
+        monitor = Monitor.objects.get(pk=1)
+        endtime = datetime(2018, 2, 1, 4, 30, 0, 0, tzinfo=pytz.UTC)
+
+        q_list = monitor.agg_measurements(endtime=endtime)
+        context = ChannelContext.for_group(monitor.channel_group)
+        trigger = monitor.triggers.get(pk=2)
+
+        with self.assertNumQueries(0):
+            res = trigger.get_breaching_channels(q_list, context)
+            trigger.in_alarm_state(res, context)
+        self.assertEqual(res, trigger.get_breaching_channels(q_list))
+        self.assertEqual([str(Channel.objects.get(pk=chan['channel_id']))
+                          for chan in res],
+                         [chan['channel'] for chan in res])
+
+    def count_evaluate_alarm_queries(self, n_channels):
+        '''Number of queries to evaluate a monitor with n breaching channels'''
+        endtime = datetime(2020, 1, 2, 3, 0, 0, 0, tzinfo=pytz.UTC)
+        grp = Group.objects.create(
+            name=f'Group of {n_channels}',
+            user=self.user,
+            organization=self.organization,
+        )
+        for i in range(n_channels):
+            channel = self.getTestChannel(f'{n_channels}C{i}')
+            grp.channels.add(channel)
+            Measurement.objects.create(
+                metric=self.metric,
+                channel=channel,
+                value=1,
+                starttime=endtime - relativedelta(hours=1),
+                endtime=endtime - relativedelta(hours=1),
+                user=self.user
+            )
+        monitor = Monitor.objects.create(
+            channel_group=grp,
+            metric=self.metric,
+            interval_type=Monitor.IntervalType.DAY,
+            interval_count=1,
+            stat=Monitor.Stat.SUM,
+            user=self.user
+        )
+        for operator in (Trigger.NumChannelsOperator.ALL,
+                         Trigger.NumChannelsOperator.ANY):
+            Trigger.objects.create(
+                monitor=monitor,
+                val1=0,
+                value_operator=Trigger.ValueOperator.GREATER_THAN,
+                num_channels_operator=operator,
+                user=self.user
+            )
+
+        monitor = Monitor.objects.get(pk=monitor.pk)
+        with patch.object(Alert, 'send_alert'):
+            with CaptureQueriesContext(connection) as queries:
+                monitor.evaluate_alarm(endtime=endtime)
+        self.assertTrue(all(alert.in_alarm for alert in Alert.objects.filter(
+            trigger__monitor=monitor, timestamp=endtime)))
+        return len(queries)
+
+    def test_evaluate_alarm_queries_independent_of_channels(self):
+        self.assertEqual(self.count_evaluate_alarm_queries(2),
+                         self.count_evaluate_alarm_queries(20))
+
     def test_get_latest_alert(self):
         trigger = Trigger.objects.get(pk=3)
 
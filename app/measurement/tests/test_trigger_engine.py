@@ -0,0 +1,102 @@
+from django.test import SimpleTestCase
+from hypothesis import given
+from hypothesis.strategies import (composite, floats, integers, lists, none,
+                                   one_of, sampled_from)
+
+from measurement.engine import evaluate_triggers
+from measurement.models import ChannelContext, Monitor, Trigger
+
+'''Tests for vectorized trigger evaluation:
+to run only this file
+    ./mg.sh "test measurement.tests.test_trigger_engine && flake8"
+
+'''
+
+# Small set of values so that equality and boundary cases come up often
+values = one_of(
+    none(),
+    sampled_from([-2.0, -1.0, 0.0, 1.0, 2.0, 3.0]),
+    floats(min_value=-10, max_value=10))
+
+
+@composite
+def channel_values(draw, stat):
+    vals = draw(lists(values, max_size=20))
+    return [{'channel': i, stat: val} for i, val in enumerate(vals)]
+
+
+@composite
+def triggers(draw, monitor):
+    val1 = draw(sampled_from([-1.0, 0.0, 1.0, 2.0]))
+    val2 = val1 + draw(sampled_from([0.0, 1.0, 2.5]))
+    return Trigger(
+        monitor=monitor,
+        val1=val1,
+        val2=val2,
+        value_operator=draw(sampled_from(Trigger.ValueOperator.values)),
+        num_channels=draw(integers(min_value=0, max_value=20)),
+        num_channels_operator=draw(
+            sampled_from(Trigger.NumChannelsOperator.values)))
+
+
+@composite
+def evaluations(draw):
+    stat = draw(sampled_from(Monitor.Stat.values))
+    monitor = Monitor(stat=stat)
+    return (stat,
+            draw(lists(triggers(monitor), max_size=5)),
+            draw(channel_values(stat)))
+
+
+class TriggerEngineTests(SimpleTestCase):
+    '''Vectorized evaluation should give the same results as Trigger'''
+
+    @given(evaluations())
+    def test_matches_trigger_evaluation(self, evaluation):
+        stat, trigs, vals = evaluation
+        # Channel 0, if there is one, was deleted from the group
+        context = ChannelContext(
+            {val['channel']: f'UW.STA{val["channel"]:02d}.--.HNZ'
+             for val in vals if val['channel'] != 0})
+
+        results = evaluate_triggers(stat, trigs, vals, context)
+
+        self.assertEqual(len(trigs), len(results))
+        for trigger, (res_trigger, breaching, in_alarm) in zip(trigs,
+                                                               results):
+            expected = trigger.get_breaching_channels(vals, context)
+            self.assertIs(trigger, res_trigger)
+            self.assertEqual(expected, breaching)
+            self.assertEqual(trigger.in_alarm_state(expected, context),
+                             in_alarm)
+
+    def test_none_is_never_breaching(self):
+        monitor = Monitor(stat=Monitor.Stat.SUM)
+        context = ChannelContext({1: 'UW.STA.--.HNZ'})
+        for value_operator in Trigger.ValueOperator.values:
+            trigger = Trigger(monitor=monitor, val1=-1, val2=1,
+                              value_operator=value_operator,
+                              num_channels_operator='any')
+            [(_, breaching, in_alarm)] = evaluate_triggers(
+                'sum', [trigger], [{'channel': 1, 'sum': None}], context)
+            self.assertEqual([], breaching)
+            self.assertFalse(in_alarm)
+
+    def test_matches_trigger_evaluation_without_num_channels(self):
+        monitor = Monitor(stat=Monitor.Stat.SUM)
+        context = ChannelContext({1: 'UW.STA1.--.HNZ', 2: 'UW.STA2.--.HNZ'})
+        vals = [{'channel': 1, 'sum': 2.0}, {'channel': 2, 'sum': 0.0}]
+        for num_channels_operator in Trigger.NumChannelsOperator.values:
+            trigger = Trigger(monitor=monitor, val1=1.0, value_operator='>',
+                              num_channels=None,
+                              num_channels_operator=num_channels_operator)
+            breaching = trigger.get_breaching_channels(vals, context)
+            try:
+                expected = trigger.in_alarm_state(breaching, context)
+            except TypeError:
+                with self.assertRaises(TypeError):
+                    evaluate_triggers('sum', [trigger], vals, context)
+                continue
+            [(_, _, in_alarm)] = evaluate_triggers(
+                'sum', [trigger], vals, context)
+            self.assertEqual(expected, in_alarm)
@@ -3,25 +3,31 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.views.decorators.cache import cache_control
 from rest_framework.response import Response
 from django_filters import rest_framework as filters
 from squac.filters import CharInFilter, NumberInFilter
 from measurement.aggregates.percentile import Percentile
-from django.db.models import Avg, StdDev, Min, Max, Sum, Count, FloatField
+from django.db.models import (Avg, StdDev, Min, Max, Sum, Count, FloatField)
 from django.db.models.functions import Coalesce, Abs
 from squac.mixins import (SetUserMixin, DefaultPermissionsMixin,
                           OverrideParamsMixin, OverrideReadParamsMixin,
-                          AdminOrOwnerPermissionMixin,)
+                          AdminOrOwnerPermissionMixin, BulkUpdateMixin,
+                          ConditionalListMixin, SparseFieldsMixin)
 from .exceptions import MissingParameterException
 from .models import (Metric, Measurement,
                      Alert, ArchiveDay, ArchiveWeek, ArchiveMonth,
-                     ArchiveHour, Monitor, Trigger)
+                     ArchiveHour, Monitor, Trigger, bulk_update_monitors,
+                     bulk_update_triggers)
 from measurement import serializers
+from measurement.alert_summary import summarize_alerts
+from measurement.backtest import backtest_monitor
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from measurement.params import measurement_params
-from squac.mixins import EnablePartialUpdateMixin
+from nslc.membership import get_group_channel_ids
+from nslc.resolution import get_nslc_channel_ids
+from squac.mixins import EagerLoadingMixin, EnablePartialUpdateMixin
 from rest_framework.renderers import TemplateHTMLRenderer
 from rest_framework.decorators import action
 
@@ -58,7 +64,7 @@ class MeasurementFilter(filters.FilterSet):
     """filters measurment by metric, channel, starttime,
         and endtime (starttime)"""
     starttime = filters.CharFilter(field_name='starttime', lookup_expr='gte')
-    nslc = CharInFilter(field_name='channel__nslc', lookup_expr='in')
+    nslc = CharInFilter(method='filter_nslc')
 
     ''' Note although param is called endtime, it uses starttime, which is
         the the only field with an index
@@ -66,7 +72,7 @@ class MeasurementFilter(filters.FilterSet):
     endtime = filters.CharFilter(field_name='starttime', lookup_expr='lt')
     metric = NumberInFilter(field_name='metric')
     channel = NumberInFilter(field_name='channel')
-    group = NumberInFilter(field_name='channel__group')
+    group = NumberInFilter(method='filter_group')
     order = filters.OrderingFilter(
         fields=(('starttime', 'starttime'),
                 ('endtime', 'endtime'),
@@ -74,6 +80,16 @@ class MeasurementFilter(filters.FilterSet):
                 ('channel__nslc', 'channel')),
     )
 
+    def filter_nslc(self, queryset, name, value):
+        # Cached nslc -> channel id lookup instead of joining nslc_channel,
+        # see nslc.resolution
+        return queryset.filter(channel__in=get_nslc_channel_ids(value))
+
+    def filter_group(self, queryset, name, value):
+        # Resolve groups to channels up front instead of joining
+        # nslc_group_channels, see nslc.membership
+        return queryset.filter(channel__any=get_group_channel_ids(value))
+
 
 class MonitorFilter(filters.FilterSet):
     class Meta:
@@ -110,18 +126,20 @@ class AlertFilter(filters.FilterSet):
 '''Base Viewsets'''
 
 
-class MeasurementBaseViewSet(SetUserMixin, DefaultPermissionsMixin,
+class MeasurementBaseViewSet(SparseFieldsMixin, SetUserMixin,
+                             DefaultPermissionsMixin, EagerLoadingMixin,
                              OverrideParamsMixin, viewsets.ModelViewSet):
     pass
 
 
-class MonitorBaseViewSet(SetUserMixin, AdminOrOwnerPermissionMixin,
+class MonitorBaseViewSet(SparseFieldsMixin, SetUserMixin,
+                         AdminOrOwnerPermissionMixin, EagerLoadingMixin,
                          OverrideParamsMixin, viewsets.ModelViewSet):
     '''only owner can see monitors and alert'''
     pass
 
 
-class ArchiveBaseViewSet(DefaultPermissionsMixin,
+class ArchiveBaseViewSet(SparseFieldsMixin, DefaultPermissionsMixin,
                          OverrideReadParamsMixin,
                          viewsets.ReadOnlyModelViewSet):
     """Viewset that provides access to Archive data
@@ -140,14 +158,14 @@ class ArchiveBaseViewSet(DefaultPermissionsMixin,
 '''Viewsets'''
 
 
-class MetricViewSet(MeasurementBaseViewSet):
+class MetricViewSet(ConditionalListMixin, MeasurementBaseViewSet):
     serializer_class = serializers.MetricSerializer
     filter_class = MetricFilter
 
     def get_queryset(self):
         return Metric.objects.all()
 
-    @method_decorator(cache_page(60 * 10, key_prefix="MetricView"))
+    @method_decorator(cache_control(must_revalidate=True, max_age=60 * 10))
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
@@ -182,7 +200,8 @@ class MeasurementViewSet(MeasurementBaseViewSet):
         return super().list(self, request, *args, **kwargs)
 
 
-class MonitorViewSet(MonitorBaseViewSet, EnablePartialUpdateMixin):
+class MonitorViewSet(MonitorBaseViewSet, EnablePartialUpdateMixin,
+                     BulkUpdateMixin):
     serializer_class = serializers.MonitorSerializer
     filter_class = MonitorFilter
 
@@ -197,9 +216,27 @@ class MonitorViewSet(MonitorBaseViewSet, EnablePartialUpdateMixin):
             return serializers.MonitorDetailSerializer
         return self.serializer_class
 
+    def perform_bulk_update(self, instances, fields):
+        bulk_update_monitors(instances, fields)
+
+    @swagger_auto_schema(
+        query_serializer=serializers.BacktestParametersSerializer)
+    @action(detail=True, methods=['get'])
+    def backtest(self, request, pk=None):
+        '''
+        Return the alerts the monitor's triggers would have created if it
+        had been evaluated every hour from starttime to endtime. Nothing is
+        saved
+        '''
+        monitor = self.get_object()
+        params = serializers.BacktestParametersSerializer(
+            data=request.query_params, context={'monitor': monitor})
+        params.is_valid(raise_exception=True)
+        return Response(backtest_monitor(monitor, **params.validated_data))
+
 
 class TriggerViewSet(MonitorBaseViewSet,
-                     EnablePartialUpdateMixin):
+                     EnablePartialUpdateMixin, BulkUpdateMixin):
     serializer_class = serializers.TriggerSerializer
     filter_class = TriggerFilter
 
@@ -209,6 +246,9 @@ class TriggerViewSet(MonitorBaseViewSet,
             return queryset
         return queryset.filter(user=self.request.user)
 
+    def perform_bulk_update(self, instances, fields):
+        bulk_update_triggers(instances, fields)
+
     @action(detail=True, methods=['get', 'post', ],
             url_path='unsubscribe/(?P<token>[^/.]+)',
             renderer_classes=[TemplateHTMLRenderer, ],
@@ -259,7 +299,7 @@ class AlertViewSet(MonitorBaseViewSet):
     filter_class = AlertFilter
 
     def get_queryset(self):
-        queryset = Alert.objects.all().order_by('-timestamp')
+        queryset = Alert.objects.order_by('-timestamp')
         if self.request.user.is_staff:
             return queryset
         return queryset.filter(user=self.request.user)
@@ -269,6 +309,25 @@ class AlertViewSet(MonitorBaseViewSet):
             return serializers.AlertDetailSerializer
         return self.serializer_class
 
+    @swagger_auto_schema(
+        query_serializer=serializers.AlertSummaryParametersSerializer)
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        '''
+        Alert counts per time bucket, time in alarm and the most often
+        breaching channels for each trigger and monitor of the filtered
+        alerts
+        '''
+        params = serializers.AlertSummaryParametersSerializer(
+            data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(summarize_alerts(
+            queryset,
+            bucket=params.validated_data['bucket'],
+            top=params.validated_data['top'],
+            endtime=params.validated_data.get('timestamp_lt')))
+
 
 class ArchiveHourViewSet(ArchiveBaseViewSet):
     serializer_class = serializers.ArchiveHourSerializer
@@ -322,14 +381,15 @@ class AggregatedViewSet(IsAuthenticated, viewsets.ViewSet):
                 groups = [int(x)
                           for x in params['group'].strip(',').split(',')]
                 measurements = measurements.filter(
-                    channel__group__in=groups)
+                    channel__any=get_group_channel_ids(groups))
             except KeyError:
                 '''list of nslcs'''
                 channels = [
                     str(x).lower() for x in params['nslc']
                     .strip(',').split(',')
                 ]
-                measurements = measurements.filter(channel__nslc__in=channels)
+                measurements = measurements.filter(
+                    channel__in=get_nslc_channel_ids(channels))
 
         metrics = [int(x) for x in params['metric'].split(',')]
         measurements = measurements.filter(metric__in=metrics)
@@ -0,0 +1,2 @@
+# to connect signal receivers in App.ready()
+default_app_config = 'nslc.apps.NslcConfig'
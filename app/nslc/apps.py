@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class NslcConfig(AppConfig):
     name = 'nslc'
+
+    # connects the channel receivers that invalidate cached nslc ids
+    def ready(self):
+        from nslc import resolution  # noqa
@@ -0,0 +1,161 @@
+'''
+Fetch FDSN station metadata in the text format
+
+Every datacenter is requested separately from the IRIS fedcatalog and the
+responses are read concurrently by a pool of threads, so the total time is
+that of the slowest datacenter. Responses are streamed line by line into a
+csv reader and handed over in small chunks through a bounded queue, so the
+raw text of the catalog is never held in memory.
+
+Instead of the web services, a directory with one or more <level>*.txt files
+per level (network.txt, channel-IRISDMC.txt, ...) can be used as the source,
+for example to load metadata offline.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import glob
+import os
+import queue
+import threading
+
+import requests
+
+FEDCATALOG_URL = "http://service.iris.edu/irisws/fedcatalog/1/query"
+LEVELS = ('network', 'station', 'channel')
+# Seconds to wait for a datacenter to connect or send more data
+TIMEOUT = 300
+# Rows per chunk and chunks buffered per source
+CHUNK_SIZE = 500
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+def build_url(params, level, datacenter=None):
+    ''' create url based on params
+        documentation at https://service.iris.edu/irisws/fedcatalog/1/
+    '''
+    url = (
+        f"{FEDCATALOG_URL}?"
+        f"datacenter={datacenter or params['datacenter']}"
+        f"&targetservice=station"
+        f"&level={level}"
+        f"&net={params['net']}"
+        f"&starttime={params['starttime']}"
+        "&format=text"
+    )
+    if (level != "network"):
+        url += (
+            f"&sta={params['sta']}"
+            f"&cha={params['cha']}"
+            f"&loc={params['loc']}"
+            f"&minlat={params['minlat']}"
+            f"&maxlat={params['maxlat']}"
+            f"&minlon={params['minlon']}"
+            f"&maxlon={params['maxlon']}"
+        )
+    return url
+
+
+def stream_lines(url):
+    '''Yield the lines of a response without reading all of it'''
+    with requests.get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        for line in response.iter_lines(decode_unicode=True):
+            yield line
+
+
+def read_lines(path):
+    '''Yield the lines of a local file'''
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+def parse_rows(lines):
+    '''
+    Split lines into rows of fields, skipping headers, comments and the
+    DATACENTER= lines of fedcatalog
+    '''
+    for row in csv.reader(lines, delimiter='|'):
+        if len(row) > 1 and not row[0].startswith('#'):
+            yield row
+
+
+def level_sources(level, params, source=None):
+    '''
+    Return a list of callables, one per datacenter or file, that each
+    return an iterator over the lines of the level
+    '''
+    if source:
+        paths = sorted(glob.glob(os.path.join(source, f'{level}*.txt')))
+        return [lambda path=path: read_lines(path) for path in paths]
+    datacenters = [datacenter for datacenter in
+                   params['datacenter'].split(',') if datacenter]
+    return [lambda url=build_url(params, level, datacenter):
+            stream_lines(url) for datacenter in datacenters]
+
+
+def read_concurrently(sources, workers=None):
+    '''
+    Yield the parsed rows of all sources, which are read by a thread pool.
+    Rows of different sources are interleaved. The first error raised by a
+    source is raised here
+    '''
+    if not sources:
+        return
+    chunks = queue.Queue(maxsize=QUEUE_SIZE * len(sources))
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer has gone away
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(source):
+        try:
+            chunk = []
+            for row in parse_rows(source()):
+                chunk.append(row)
+                if len(chunk) >= CHUNK_SIZE:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk:
+                put(chunk)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=workers or len(sources))
+    try:
+        for source in sources:
+            executor.submit(produce, source)
+        remaining = len(sources)
+        while remaining:
+            item = chunks.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def fetch_rows(level, params, source=None, workers=None):
+    '''
+    Yield the rows of a level ('network', 'station' or 'channel') from every
+    datacenter in params['datacenter'], or from the files of a local source
+    directory
+    '''
+    return read_concurrently(level_sources(level, params, source), workers)
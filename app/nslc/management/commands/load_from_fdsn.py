@@ -31,24 +31,25 @@ $:docker-compose run --rm app sh -c "LOADER_EMAIL=email@pnsn.org \
                     --maxlat=72.
                     --minlon=-183.
                     --maxlon=-62.
-                    --starttime='YYYY-mm-dd'"
+                    --starttime='YYYY-mm-dd'
+                    --source='path/to/metadata'
+                    --workers=4"
+
+Each datacenter is fetched separately and concurrently, see nslc/fdsn.py
 
  text response from fdsn has following schema:
  Network | Station | Location | Channel | Latitude | Longitude |
  Elevation | Depth | Azimuth | Dip | SensorDescription | Scale |
  ScaleFreq | ScaleUnits | SampleRate | StartTime | EndTime
 """
-import csv
-import requests
 import sys
 import os
-from datetime import datetime
-import pytz
 import django
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import get_user_model
-from nslc.models import Network, Channel
+from nslc.fdsn import fetch_rows
+from nslc.sync import parse_channels, sync_channels, sync_networks
 
 
 class Command(BaseCommand):
@@ -105,31 +106,18 @@ class Command(BaseCommand):
             help="filter for channels with metadata listed on or after the \
                 specified time"
         )
-
-    def build_url(self, params, level):
-        ''' create url based on params
-            documentation at https://service.iris.edu/irisws/fedcatalog/1/
-        '''
-        url = (
-            f"http://service.iris.edu/irisws/fedcatalog/1/query?"
-            f"datacenter={params['datacenter']}"
-            f"&targetservice=station"
-            f"&level={level}"
-            f"&net={params['net']}"
-            f"&starttime={params['starttime']}"
-            "&format=text"
+        parser.add_argument(
+            '--source',
+            default=None,
+            help="directory with network*.txt, station*.txt and \
+                channel*.txt files to load instead of the web services"
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help="number of datacenters or files read at once, all by default"
         )
-        if (level != "network"):
-            url += (
-                f"&sta={params['sta']}"
-                f"&cha={params['cha']}"
-                f"&loc={params['loc']}"
-                f"&minlat={params['minlat']}"
-                f"&maxlat={params['maxlat']}"
-                f"&minlon={params['minlon']}"
-                f"&maxlon={params['maxlon']}"
-            )
-        return url
 
     '''Django command to check network and channel tables with FDSN service'''
     def handle(self, *args, **options):
@@ -165,104 +153,28 @@ class Command(BaseCommand):
             )
             sys.exit(1)
 
-        network_url = self.build_url(options, "network")
-        with requests.Session() as s:
-            download = s.get(network_url)
-            decoded_content = download.content.decode('utf-8')
-            content = csv.reader(decoded_content.splitlines(), delimiter='|')
-            row_list = list(content)
-            # skip header rows in metadata
-            for row in row_list[1:]:
-                # extract data from row
-                if len(row) > 1:
-                    net_code = row[0]
-                    net_name = row[1]
+        source = options['source']
+        workers = options['workers']
+        networks = {
+            row[0].lower(): row[1]
+            for row in fetch_rows('network', options, source, workers)}
+        added_networks = sync_networks(networks, user)
 
-                    # Get or create the channel using data
-                    Network.objects.get_or_create(
-                        code=net_code.lower(),
-                        defaults={
-                            'name': net_name,
-                            'user': user
-                        }
-                    )
+        stations = {
+            row[1].lower(): row[5]
+            for row in fetch_rows('station', options, source, workers)}
 
-        station_url = self.build_url(options, 'station')
-        stations = {}
-        with requests.Session() as s:
-            download = s.get(station_url)
-            decoded_content = download.content.decode('utf-8')
-            content = csv.reader(decoded_content.splitlines(), delimiter='|')
-            row_list = list(content)
-            # skip header rows of metadata
-            for row in row_list[1:]:
-                if len(row) > 1:
-                    sta_code = row[1].lower()
-                    sta_name = row[5]
-                    stations[sta_code] = sta_name
+        channels, unknown = parse_channels(
+            fetch_rows('channel', options, source, workers), stations)
+        for row in unknown:
+            self.stdout.write(f'Unknown station: {"|".join(row[:4])}')
 
-        channel_url = self.build_url(options, 'channel')
-        channels = {}
-        with requests.Session() as s:
-            download = s.get(channel_url)
-            decoded_content = download.content.decode('utf-8')
-            content = csv.reader(
-                decoded_content.splitlines(), delimiter='|')
-            row_list = list(content)
-            # skip header rows in metadata
-            for row in row_list[1:]:
-                # extract data from row
-                if len(row) > 1:
-                    net, sta, loc, cha, lat, lon, elev, *rem = row
-                    depth, azimuth, dip, sensor_descr, scale, *rem = rem
-                    freq, units, rate, start, end = rem
-                    nslc_code = f'{net}.{sta}.{loc}.{cha}'.lower()
-                    start_datetime = pytz.utc.localize(
-                        datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
-                    )
-                    if end:
-                        end_datetime = pytz.utc.localize(
-                            datetime.strptime(end, '%Y-%m-%dT%H:%M:%S')
-                        )
-                    else:
-                        # If end time is null set to 2599 dummy date
-                        end_datetime = datetime(
-                            year=2599, month=12, day=31, tzinfo=pytz.UTC)
-
-                    if nslc_code in channels:
-                        if start_datetime < channels[nslc_code]['start']:
-                            channels[nslc_code]['start'] = start_datetime
-                        if end_datetime > channels[nslc_code]['end']:
-                            channels[nslc_code]['end'] = end_datetime
-                    else:
-                        channels[nslc_code] = {'start': start_datetime,
-                                               'end': end_datetime}
-                    try:
-                        # Update or create the channel using data
-                        Channel.objects.update_or_create(
-                            network=Network.objects.get(code=net.lower()),
-                            station_code=sta.lower(),
-                            loc='--' if not loc else loc.lower(),
-                            code=cha.lower(),
-                            defaults={
-                                'lat': float(lat),
-                                'lon': float(lon),
-                                'elev': float(elev),
-                                'depth': float(depth),
-                                'name': stations[sta.lower()],
-                                'azimuth': 0.0 if not azimuth else float(
-                                    azimuth),
-                                'dip': 0.0 if not dip else float(dip),
-                                'sensor_description': sensor_descr,
-                                'scale': 0.0 if not scale else float(scale),
-                                'scale_freq': 0.0 if not freq else float(freq),
-                                'scale_units': units,
-                                'sample_rate': 0.0 if not rate else float(
-                                    rate),
-                                'starttime': channels[nslc_code]['start'],
-                                'endtime': channels[nslc_code]['end'],
-                                'user': user,
-                            }
-                        )
-                    except KeyError as e:
-                        print(f'Key error occured: {e}')
+        summary = sync_channels(channels, user)
+        self.stdout.write(
+            f"Networks: {added_networks} added\n"
+            f"Channels: {summary['added']} added, "
+            f"{summary['changed']} changed, "
+            f"{summary['unchanged']} unchanged, "
+            f"{summary['skipped'] + len(unknown)} skipped, "
+            f"{summary['grouped']} added to groups"
+        )
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from nslc.models import Group
+from nslc.models import Group, get_channel_index
 
 
 class Command(BaseCommand):
@@ -13,6 +13,10 @@ class Command(BaseCommand):
         parser.add_argument('--channel_groups', action='append',
                             help='List of groups to update',
                             default=[])
+        parser.add_argument('--stale', action='store_true',
+                            help='Only update groups marked with '
+                                 'channels_stale_at, see '
+                                 'GROUP_BACKGROUND_UPDATE_SIZE')
 
     def handle(self, *args, **options):
         '''method called by manager'''
@@ -25,7 +29,16 @@ class Command(BaseCommand):
         # Filter for specific channel groups if they were selected
         if len(channel_groups) > 0:
             groups = groups.filter(id__in=channel_groups)
+        if options['stale']:
+            groups = groups.filter(channels_stale_at__isnull=False)
 
-        # Update channels for each group, if applicable
+        # Don't load the channel index when there is nothing to update, as
+        # with --stale every minute
+        if not groups.exists():
+            return
+
+        # Update channels for each group, if applicable. Groups share the
+        # channel index and its cache of rule matches
+        index = get_channel_index()
         for group in groups:
-            group.update_channels()
+            group.update_channels(index)
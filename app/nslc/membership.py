@@ -0,0 +1,71 @@
+'''
+Resolve channel groups to channel ids
+
+Filtering measurements with channel__group__in joins the measurement table
+to nslc_group_channels inside the time range scan, on every partition.
+Instead the channel ids of the groups are resolved up front, so the
+measurement query can filter on channel_id = ANY(array) and use the index
+of each partition.
+
+Channel ids are cached per group and keyed by the group's updated_at, which
+is bumped whenever the group's channels change. A process-local LRU is
+checked first, then the Django cache (shared Redis in production), and only
+groups found in neither are read from nslc_group_channels.
+'''
+import threading
+
+from cachetools import LRUCache
+from django.core.cache import cache
+
+from nslc.models import Group
+
+LOCAL_CACHE_SIZE = 512
+# Seconds to keep snapshots in the Django cache, new versions get new keys
+CACHE_TIMEOUT = 60 * 60 * 24
+
+_local_cache = LRUCache(maxsize=LOCAL_CACHE_SIZE)
+_lock = threading.Lock()
+
+
+def cache_key(group_id, updated_at):
+    return f'group_channels:{group_id}:{updated_at.isoformat()}'
+
+
+def get_group_channel_ids(group_ids):
+    '''Return a sorted list of ids of the channels in any of the groups'''
+    keys = {group_id: cache_key(group_id, updated_at)
+            for group_id, updated_at in Group.objects.filter(
+                id__in=group_ids).values_list('id', 'updated_at')}
+    channel_ids = set()
+
+    missing = {}
+    with _lock:
+        for group_id, key in keys.items():
+            snapshot = _local_cache.get(key)
+            if snapshot is None:
+                missing[key] = group_id
+            else:
+                channel_ids.update(snapshot)
+    if not missing:
+        return sorted(channel_ids)
+
+    shared = cache.get_many(list(missing))
+    snapshots = {key: snapshot for key, snapshot in shared.items()
+                 if snapshot is not None}
+
+    unloaded = {group_id: key for key, group_id in missing.items()
+                if key not in snapshots}
+    if unloaded:
+        loaded = {key: [] for key in unloaded.values()}
+        for group_id, channel_id in Group.channels.through.objects.filter(
+                group_id__in=unloaded).values_list('group_id', 'channel_id'):
+            loaded[unloaded[group_id]].append(channel_id)
+        loaded = {key: tuple(ids) for key, ids in loaded.items()}
+        cache.set_many(loaded, CACHE_TIMEOUT)
+        snapshots.update(loaded)
+
+    with _lock:
+        for key, snapshot in snapshots.items():
+            _local_cache[key] = snapshot
+            channel_ids.update(snapshot)
+    return sorted(channel_ids)
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.13 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nslc', '0020_auto_20220919_2123'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='channels_stale_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.13 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nslc', '0021_group_channels_stale_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='channel',
+            name='nslc_channe_lat_533aec_idx',
+        ),
+        migrations.AddIndex(
+            model_name='channel',
+            index=models.Index(fields=['lat', 'lon'], name='nslc_channe_lat_8e8772_idx'),
+        ),
+    ]
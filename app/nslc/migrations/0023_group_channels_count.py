@@ -0,0 +1,31 @@
+# Generated by Django 3.1.13 on 2026-10-19 10:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nslc', '0022_channel_lat_lon_index'),
+    ]
+
+    def count_channels(apps, schema_editor):
+        GroupModel = apps.get_model('nslc', 'Group')
+        counts = GroupModel.channels.through.objects.filter(
+            group_id=OuterRef('pk')
+        ).order_by().values('group_id').annotate(
+            count=Count('id')).values('count')
+        GroupModel.objects.update(
+            channels_count=Coalesce(Subquery(counts), 0))
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='channels_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            count_channels, reverse_code=migrations.RunPython.noop)
+    ]
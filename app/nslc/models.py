@@ -5,9 +5,16 @@ from datetime import datetime
 import pytz
 from organization.models import Organization
 from regex_field.fields import RegexField
-from django.db.models import Q
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.utils import timezone
+from collections import defaultdict
+from contextlib import contextmanager
 import re
-from django.db.models.signals import m2m_changed
+import threading
+from nslc.rules import (ChannelIndex, RULE_FIELDS, group_members,
+                        rule_patterns)
 
 
 class Nslc(models.Model):
@@ -77,7 +84,7 @@ class Channel(Nslc):
             models.Index(fields=['station_code']),
             models.Index(fields=['station_name']),
             models.Index(fields=['loc']),
-            models.Index(fields=['lat']),
+            models.Index(fields=['lat', 'lon']),
             models.Index(fields=['lon']),
             models.Index(fields=['-starttime']),
             models.Index(fields=['-endtime']),
@@ -122,6 +129,10 @@ class Group(models.Model):
     share_org = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set when updating channels was left to update_auto_channels --stale
+    channels_stale_at = models.DateTimeField(null=True, blank=True)
+    # Kept up to date by count_group_channels
+    channels_count = models.PositiveIntegerField(default=0, editable=False)
 
     def can_auto_update(self):
         """
@@ -132,71 +143,216 @@ class Group(models.Model):
                     self.auto_include_channels.count() > 0,
                     self.auto_exclude_channels.count() > 0])
 
-    def update_channels(self):
+    def update_channels(self, index=None):
+        """
+        Set channels from the matching rules and the auto include and exclude
+        lists, see nslc.rules. index defaults to the cached index of all
+        channels
+        """
         if not self.can_auto_update():
+            if self.channels_stale_at:
+                self.channels_stale_at = None
+                self.save(update_fields=['channels_stale_at'])
             return
-
-        # 1. Construct query to add channels
-        include_query = Q()
-
-        # First add channels based on matching rules
-        for matching_rule in self.matching_rules.all():
-            if not matching_rule.is_include:
-                continue
-            include_query = include_query | Q(
-                network__code__iregex=matching_rule.network_regex.pattern,
-                station_code__iregex=matching_rule.station_regex.pattern,
-                loc__iregex=matching_rule.location_regex.pattern,
-                code__iregex=matching_rule.channel_regex.pattern
-            )
-
-        # Now add channels in auto_include_channels
-        if self.auto_include_channels.count() > 0:
-            include_query = include_query | Q(
-                id__in=self.auto_include_channels.all()
-            )
-        channels = Channel.objects.filter(include_query)
-
-        # 2. Construct query to exclude channels
-        exclude_query = Q()
-
-        # First add channels based on matching rules
-        for matching_rule in self.matching_rules.all():
-            if matching_rule.is_include:
-                continue
-            exclude_query = exclude_query | Q(
-                network__code__iregex=matching_rule.network_regex.pattern,
-                station_code__iregex=matching_rule.station_regex.pattern,
-                loc__iregex=matching_rule.location_regex.pattern,
-                code__iregex=matching_rule.channel_regex.pattern
-            )
-
-        # Now add channels in auto_exclude_channels
-        if self.auto_exclude_channels.count() > 0:
-            exclude_query = exclude_query | Q(
-                id__in=self.auto_exclude_channels.all()
-            )
-
-        channels = channels.exclude(exclude_query)
-
-        # 3. Finish
-        # Now actually add channels
-        self.channels.set(channels)
-        self.save()
+        if index is None:
+            index = get_channel_index()
+
+        rules = list(self.matching_rules.all())
+        channel_ids = group_members(
+            index,
+            include_rules=[rule_patterns(rule) for rule in rules
+                           if rule.is_include],
+            exclude_rules=[rule_patterns(rule) for rule in rules
+                           if not rule.is_include],
+            include_ids=self.auto_include_channels.values_list(
+                'id', flat=True),
+            exclude_ids=self.auto_exclude_channels.values_list(
+                'id', flat=True)
+        )
+
+        # set() only deletes and inserts the rows that changed
+        self.channels.set(channel_ids)
+        self.channels_stale_at = None
+        # channels_count was updated in the database by set()
+        self.save(update_fields=['channels_stale_at', 'updated_at'])
 
     def __str__(self):
         return self.name
 
 
+_channel_index = None
+
+
+def get_channel_index():
+    """
+    Return a ChannelIndex of all channels. It is kept between calls and
+    reloaded when a channel has been added, removed or saved since
+    """
+    global _channel_index
+    version = Channel.objects.aggregate(
+        count=Count('id'), last_id=Max('id'), updated_at=Max('updated_at'))
+    version = (version['count'], version['last_id'], version['updated_at'])
+    if _channel_index is None or _channel_index.version != version:
+        _channel_index = ChannelIndex(
+            Channel.objects.values_list('id', *RULE_FIELDS), version)
+    return _channel_index
+
+
+def add_channels_to_groups(channels):
+    """
+    Add new channels to the groups that update_channels would add them to,
+    testing only these channels instead of updating every group. Returns the
+    number of channels added to groups
+    """
+    index = ChannelIndex(
+        (channel.id,) + tuple(getattr(channel, field)
+                              for field in RULE_FIELDS)
+        for channel in channels)
+    rules = defaultdict(list)
+    for rule in MatchingRule.objects.all():
+        rules[rule.group_id].append(rule)
+    # New channels can't be in the auto include or exclude lists yet, but
+    # whether a group has them decides if it starts from all channels
+    include_ids = defaultdict(set)
+    for group_id, channel_id in Group.auto_include_channels.through.objects \
+            .values_list('group_id', 'channel_id'):
+        include_ids[group_id].add(channel_id)
+    exclude_ids = defaultdict(set)
+    for group_id, channel_id in Group.auto_exclude_channels.through.objects \
+            .values_list('group_id', 'channel_id'):
+        exclude_ids[group_id].add(channel_id)
+
+    new_ids = {channel.id for channel in channels}
+    through = Group.channels.through
+    rows = []
+    for group_id in set(rules) | set(include_ids) | set(exclude_ids):
+        channel_ids = group_members(
+            index,
+            include_rules=[rule_patterns(rule) for rule in rules[group_id]
+                           if rule.is_include],
+            exclude_rules=[rule_patterns(rule) for rule in rules[group_id]
+                           if not rule.is_include],
+            include_ids=include_ids[group_id],
+            exclude_ids=exclude_ids[group_id])
+        rows += [through(group_id=group_id, channel_id=channel_id)
+                 for channel_id in channel_ids & new_ids]
+    if rows:
+        through.objects.bulk_create(rows, ignore_conflicts=True)
+        count_group_channels(Group.objects.filter(
+            id__in={row.group_id for row in rows}))
+    return len(rows)
+
+
+def count_group_channels(groups):
+    """
+    Set channels_count of a queryset of groups and bump their updated_at,
+    which versions the cached channel ids of nslc.membership
+    """
+    counts = Group.channels.through.objects.filter(
+        group_id=OuterRef('pk')
+    ).order_by().values('group_id').annotate(
+        count=Count('id')).values('count')
+    groups.update(channels_count=Coalesce(Subquery(counts), 0),
+                  updated_at=timezone.now())
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_channel_updates():
+    """
+    Collect the groups whose channels need updating inside this block and
+    update each of them once when the outermost block exits, instead of
+    after every matching rule or auto include/exclude change. Nothing is
+    updated if the block raises
+    """
+    if getattr(_deferred, 'group_ids', None) is not None:
+        yield
+        return
+    _deferred.group_ids = set()
+    try:
+        yield
+        group_ids = _deferred.group_ids
+    finally:
+        _deferred.group_ids = None
+    update_groups_channels(group_ids)
+
+
+def request_channels_update(group_id):
+    """
+    Update the channels of a group, once the enclosing
+    deferred_channel_updates block exits if there is one
+    """
+    group_ids = getattr(_deferred, 'group_ids', None)
+    if group_ids is None:
+        update_groups_channels([group_id])
+    else:
+        group_ids.add(group_id)
+
+
+def update_groups_channels(group_ids):
+    """
+    Update the channels of groups. Groups with more channels than
+    settings.GROUP_BACKGROUND_UPDATE_SIZE are only marked with
+    channels_stale_at and left to update_auto_channels --stale
+    """
+    if not group_ids:
+        return
+    groups = Group.objects.filter(id__in=group_ids).order_by('id')
+    limit = settings.GROUP_BACKGROUND_UPDATE_SIZE
+    if limit:
+        large = [group.id for group in groups
+                 if group.channels_count > limit]
+        Group.objects.filter(
+            id__in=large, channels_stale_at__isnull=True
+        ).update(channels_stale_at=timezone.now())
+        groups = [group for group in groups if group.id not in large]
+    for group in groups:
+        group.update_channels()
+
+
 def channels_changed(instance, action, **kwargs):
 
     # after m2m change is saved
     if action in ['post_add', 'post_clear', 'post_remove']:
-        p = Group.objects.get(id=instance.id)
         # update the channels
-        p.update_channels()
+        request_channels_update(instance.id)
+
 
+def group_channels_changed(instance, action, reverse, pk_set, **kwargs):
+    """Count the channels of groups whose channels changed"""
+    if action not in ['post_add', 'post_clear', 'post_remove']:
+        return
+    if not reverse:
+        group_ids = [instance.id]
+    elif action == 'post_clear':
+        # pk_set isn't available after clearing
+        group_ids = None
+    else:
+        group_ids = pk_set
+    groups = Group.objects.all()
+    if group_ids is not None:
+        groups = groups.filter(id__in=group_ids)
+    count_group_channels(groups)
 
+
+def channel_deleting(instance, **kwargs):
+    # Deleting the channel deletes its group rows without m2m_changed
+    instance._group_ids = list(
+        instance.group_set.values_list('id', flat=True))
+
+
+def channel_deleted(instance, **kwargs):
+    group_ids = getattr(instance, '_group_ids', None)
+    if group_ids:
+        count_group_channels(Group.objects.filter(id__in=group_ids))
+
+
+m2m_changed.connect(
+    group_channels_changed, sender=Group.channels.through)
+pre_delete.connect(channel_deleting, sender=Channel)
+post_delete.connect(channel_deleted, sender=Channel)
 # update channels after auto_include or auto_exclude are changed
 m2m_changed.connect(
     channels_changed, sender=Group.auto_include_channels.through)
@@ -236,8 +392,8 @@ class MatchingRule(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        self.group.update_channels()
+        request_channels_update(self.group_id)
 
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
-        self.group.update_channels()
+        request_channels_update(self.group_id)
@@ -0,0 +1,94 @@
+'''
+Resolve NSLC strings to channel ids
+
+Filters by nslc used to join or filter on nslc_channel.nslc in every
+request. Instead the ids of the requested channels are looked up here and
+measurement queries filter on channel_id directly.
+
+Ids are cached in a process-local LRU and in the Django cache (shared Redis
+in production), under a version number kept in the Django cache. Saving or
+deleting a channel (once committed) and load_from_fdsn adding channels bump
+the version, which invalidates every process. Without a shared cache,
+local entries expire after LOCAL_CACHE_SECONDS instead. Unknown nslcs are
+not cached.
+'''
+import threading
+
+from cachetools import TTLCache
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from nslc.models import Channel
+
+LOCAL_CACHE_SIZE = 50000
+LOCAL_CACHE_SECONDS = 5 * 60
+# Seconds to keep ids in the Django cache, new versions get new keys
+CACHE_TIMEOUT = 60 * 60 * 24
+VERSION_KEY = 'nslc_channel_ids:version'
+
+_local_cache = TTLCache(maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_SECONDS)
+_lock = threading.Lock()
+
+
+def cache_key(version, nslc):
+    return f'nslc_channel_ids:{version}:{nslc}'
+
+
+def resolve_nslcs(nslcs):
+    '''Return a dict of nslc -> channel id for the nslcs that exist'''
+    nslcs = {nslc.lower() for nslc in nslcs}
+    version = cache.get(VERSION_KEY, 0)
+    channel_ids = {}
+
+    with _lock:
+        for nslc in nslcs:
+            channel_id = _local_cache.get((version, nslc))
+            if channel_id is not None:
+                channel_ids[nslc] = channel_id
+    missing = {cache_key(version, nslc): nslc for nslc in nslcs
+               if nslc not in channel_ids}
+    if not missing:
+        return channel_ids
+
+    found = {missing[key]: channel_id
+             for key, channel_id in cache.get_many(list(missing)).items()}
+    unloaded = [nslc for nslc in missing.values() if nslc not in found]
+    if unloaded:
+        loaded = dict(Channel.objects.filter(
+            nslc__in=unloaded).values_list('nslc', 'id'))
+        cache.set_many({cache_key(version, nslc): channel_id
+                        for nslc, channel_id in loaded.items()},
+                       CACHE_TIMEOUT)
+        found.update(loaded)
+
+    with _lock:
+        for nslc, channel_id in found.items():
+            _local_cache[(version, nslc)] = channel_id
+    channel_ids.update(found)
+    return channel_ids
+
+
+def get_nslc_channel_ids(nslcs):
+    '''Return a sorted list of ids of the channels with the nslcs'''
+    return sorted(resolve_nslcs(nslcs).values())
+
+
+def invalidate_nslcs():
+    '''Forget cached ids after channels were added, changed or deleted'''
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Not set yet
+        cache.set(VERSION_KEY, 1, None)
+    with _lock:
+        _local_cache.clear()
+
+
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def channel_changed(sender, **kwargs):
+    # Until the change is committed other requests would cache the old ids
+    # again under the new version
+    transaction.on_commit(invalidate_nslcs)
@@ -0,0 +1,69 @@
+'''
+Evaluate group matching rules in Python
+
+Instead of building an OR of __iregex filters for every rule and scanning
+the channel table for each group, the network, station, location and
+channel codes of all channels are loaded once into a ChannelIndex and the
+rules are matched against it with compiled regexes. The channels matched by
+each distinct rule are cached in the index, so groups sharing rules, and
+repeated updates while the channels don't change, don't evaluate them again.
+
+Patterns are matched like Postgres ~* (unanchored and case insensitive),
+using Python's re syntax that RegexField already validates them with.
+'''
+import re
+
+# Channel fields the four patterns of a rule are matched against
+RULE_FIELDS = ('network_id', 'station_code', 'loc', 'code')
+
+
+def rule_patterns(rule):
+    '''The (network, station, location, channel) patterns of a rule'''
+    return (rule.network_regex.pattern, rule.station_regex.pattern,
+            rule.location_regex.pattern, rule.channel_regex.pattern)
+
+
+class ChannelIndex:
+    '''
+    Codes of a set of channels as (id, network, station, loc, code) rows,
+    with the ids of the channels matched by each rule cached by its patterns.
+
+    version identifies the state of the channels the index was loaded from
+    '''
+
+    def __init__(self, rows, version=None):
+        self.rows = list(rows)
+        self.version = version
+        self._matches = {}
+
+    def match(self, patterns):
+        '''Return a frozenset of ids of channels matching all patterns'''
+        if patterns not in self._matches:
+            regexes = [re.compile(pattern, re.IGNORECASE)
+                       for pattern in patterns]
+            self._matches[patterns] = frozenset(
+                row[0] for row in self.rows
+                if all(regex.search(value)
+                       for regex, value in zip(regexes, row[1:])))
+        return self._matches[patterns]
+
+
+def group_members(index, include_rules=(), exclude_rules=(),
+                  include_ids=(), exclude_ids=()):
+    '''
+    Return the set of channel ids a group should have: channels matching an
+    include rule or in include_ids, except those matching an exclude rule or
+    in exclude_ids. Without include rules or include_ids every channel of
+    the index is included. Rules are given as patterns
+    '''
+    include_ids = set(include_ids)
+    if include_rules or include_ids:
+        members = include_ids
+        for patterns in include_rules:
+            members |= index.match(patterns)
+    else:
+        members = {row[0] for row in index.rows}
+    members -= set(exclude_ids)
+    for patterns in exclude_rules:
+        members -= index.match(patterns)
+    return members
@@ -76,6 +76,29 @@ class GroupDetailSerializer(GroupSerializer):
         read_only_fields = ('id', 'user')
 
 
+class ChannelIdsField(serializers.Field):
+    '''Read only list of the ids of a relation's channels'''
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return sorted(value.values_list('id', flat=True))
+
+
+class GroupCompactSerializer(GroupSerializer):
+    # Serializer for ?compact=true details of a group, with channel ids
+    channels = ChannelIdsField()
+    auto_include_channels = ChannelIdsField()
+    auto_exclude_channels = ChannelIdsField()
+
+    class Meta:
+        model = Group
+        fields = GroupDetailSerializer.Meta.fields
+        read_only_fields = ('id', 'user')
+
+
 class NetworkSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -105,10 +128,10 @@ class MatchingRuleSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """Convert regex fields to string."""
         ret = super().to_representation(instance)
-        ret['network_regex'] = self.stripRegex(ret['network_regex'])
-        ret['station_regex'] = self.stripRegex(ret['station_regex'])
-        ret['location_regex'] = self.stripRegex(ret['location_regex'])
-        ret['channel_regex'] = self.stripRegex(ret['channel_regex'])
+        for field in ('network_regex', 'station_regex', 'location_regex',
+                      'channel_regex'):
+            if field in ret:
+                ret[field] = self.stripRegex(ret[field])
         return ret
 
     def stripRegex(self, instance):
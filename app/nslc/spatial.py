@@ -0,0 +1,127 @@
+'''
+Spatial channel search without PostGIS
+
+Every search is a bounding box prefilter on lat and lon, which is a range
+scan of the (lat, lon) index of nslc_channel, refined by an exact test in
+SQL: the haversine distance for a radius, or Postgres' built in point <@
+polygon operator for a polygon.
+
+Longitudes may run past +/-180 (the default FDSN box starts at -183), and
+boxes with lon_min > lon_max cross the antimeridian. These are split into
+ranges within [-180, 180].
+'''
+import math
+
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.db.models.functions import (ASin, Cos, Floor, Least, Power,
+                                        Radians, Sin, Sqrt)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def normalize_lon(lon):
+    '''Return lon in [-180, 180)'''
+    return (lon + 180.0) % 360.0 - 180.0
+
+
+def lon_ranges(lon_min, lon_max):
+    '''
+    Return a list of (min, max) ranges within [-180, 180] covering lon_min
+    to lon_max eastwards, which may cross the antimeridian
+    '''
+    if lon_max - lon_min >= 360.0:
+        return [(-180.0, 180.0)]
+    lon_min, lon_max = normalize_lon(lon_min), normalize_lon(lon_max)
+    if lon_min <= lon_max:
+        return [(lon_min, lon_max)]
+    return [(lon_min, 180.0), (-180.0, lon_max)]
+
+
+def box_q(lat_min=-90.0, lat_max=90.0, lon_min=-180.0, lon_max=180.0):
+    '''Q for channels inside a box, which may cross the antimeridian'''
+    q = Q()
+    if lat_min > -90.0:
+        q &= Q(lat__gte=lat_min)
+    if lat_max < 90.0:
+        q &= Q(lat__lte=lat_max)
+    ranges = lon_ranges(lon_min, lon_max)
+    if ranges != [(-180.0, 180.0)]:
+        lon_q = Q()
+        for low, high in ranges:
+            lon_q |= Q(lon__gte=low, lon__lte=high)
+        q &= lon_q
+    return q
+
+
+def radius_box(lat, lon, radius_km):
+    '''Return (lat_min, lat_max, lon_min, lon_max) enclosing a circle'''
+    angle = radius_km / EARTH_RADIUS_KM
+    lat_min = lat - math.degrees(angle)
+    lat_max = lat + math.degrees(angle)
+    if lat_min <= -90.0 or lat_max >= 90.0 or angle >= math.pi / 2:
+        # Covers a pole, every longitude
+        return max(lat_min, -90.0), min(lat_max, 90.0), -180.0, 180.0
+    ratio = math.sin(angle) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return lat_min, lat_max, -180.0, 180.0
+    delta = math.degrees(math.asin(ratio))
+    return lat_min, lat_max, lon - delta, lon + delta
+
+
+def haversine_km(lat, lon):
+    '''Expression for the great circle distance of channels to a point'''
+    lat1, lon1 = Radians(F('lat')), Radians(F('lon'))
+    lat2, lon2 = math.radians(lat), math.radians(lon)
+    half_dlat = Sin((lat1 - Value(lat2)) / 2)
+    half_dlon = Sin((lon1 - Value(lon2)) / 2)
+    a = Power(half_dlat, 2) + \
+        Cos(lat1) * Value(math.cos(lat2)) * Power(half_dlon, 2)
+    # Rounding can take a just past 1 near the antipode, out of asin's range
+    return Value(2 * EARTH_RADIUS_KM) * ASin(
+        Sqrt(Least(Value(1.0), a)), output_field=FloatField())
+
+
+def filter_radius(queryset, lat, lon, radius_km):
+    '''Channels within radius_km of lat, lon, annotated with distance_km'''
+    return queryset.filter(box_q(*radius_box(lat, lon, radius_km))).annotate(
+        distance_km=haversine_km(lat, lon)).filter(distance_km__lte=radius_km)
+
+
+def parse_polygon(values):
+    '''
+    Return a list of (lat, lon) vertices from a flat list of lat, lon values.
+    Raises ValueError unless there are at least 3 vertices
+    '''
+    values = [float(value) for value in values]
+    if len(values) % 2 or len(values) < 6:
+        raise ValueError(
+            'polygon must be a list of at least 3 lat,lon vertices')
+    points = list(zip(values[::2], values[1::2]))
+    if any(abs(lat) > 90.0 for lat, lon in points):
+        raise ValueError('polygon latitudes must be within -90 and 90')
+    return points
+
+
+def in_polygon(points):
+    '''
+    Condition for channels inside a polygon of (lat, lon) vertices, whose
+    longitudes are taken as given so it may cross the antimeridian
+    '''
+    lons = [lon for lat, lon in points]
+    west = min(lons)
+    # Shift channel longitudes into [west, west + 360) to match the polygon
+    shifted = F('lon') - \
+        Value(360.0) * Floor((F('lon') - Value(west)) / 360.0)
+    point = Func(shifted, F('lat'), function='point')
+    vertices = ','.join(f'({lon!r},{lat!r})' for lat, lon in points)
+    polygon = Func(Value(f'({vertices})'), template='%(expressions)s::polygon')
+    return Func(point, polygon, template='(%(expressions)s)',
+                arg_joiner=' <@ ', output_field=BooleanField())
+
+
+def filter_polygon(queryset, points):
+    '''Channels inside a polygon of (lat, lon) vertices'''
+    lats = [lat for lat, lon in points]
+    lons = [lon for lat, lon in points]
+    box = box_q(min(lats), max(lats), min(lons), max(lons))
+    return queryset.filter(box).filter(in_polygon(points))
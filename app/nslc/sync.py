@@ -0,0 +1,189 @@
+'''
+Sync networks and channels with FDSN metadata
+
+Rows of the FDSN text format are parsed into a dict keyed by
+(network, station, location, channel), all lowercase, with the epochs of a
+channel merged into the earliest starttime and latest endtime. The existing
+channels of the same networks and stations are loaded in one query and
+compared field by field in memory. Only new channels are inserted and only
+channels with changed metadata are updated, both in batches, so unchanged
+channels keep their updated_at.
+'''
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+from django.db import transaction
+from django.utils import timezone
+
+from nslc.models import Channel, Network, add_channels_to_groups
+from nslc.resolution import invalidate_nslcs
+
+# Channel fields that come from FDSN metadata
+CHANNEL_FIELDS = (
+    'lat', 'lon', 'elev', 'depth', 'name', 'azimuth', 'dip',
+    'sensor_description', 'scale', 'scale_freq', 'scale_units',
+    'sample_rate', 'starttime', 'endtime'
+)
+BATCH_SIZE = 1000
+# Endtime of channels that are still open
+OPEN_ENDTIME = datetime(2599, 12, 31, tzinfo=pytz.UTC)
+
+
+def parse_time(value):
+    '''Parse a FDSN time, a blank endtime means the channel is open'''
+    if not value:
+        return OPEN_ENDTIME
+    return pytz.utc.localize(datetime.strptime(value, '%Y-%m-%dT%H:%M:%S'))
+
+
+def to_float(value):
+    return 0.0 if not value else float(value)
+
+
+def parse_channels(rows, stations):
+    '''
+    Parse channel level rows into an OrderedDict of
+    (network, station, loc, code) -> CHANNEL_FIELDS values.
+
+    stations: dict of lowercase station code -> station name
+    Returns the channels and a list of rows skipped because their station
+    is unknown
+    '''
+    channels = OrderedDict()
+    skipped = []
+    for row in rows:
+        if len(row) <= 1:
+            continue
+        net, sta, loc, cha, lat, lon, elev, *rem = row
+        depth, azimuth, dip, sensor_descr, scale, *rem = rem
+        freq, units, rate, start, end = rem
+        key = (net.lower(), sta.lower(),
+               '--' if not loc else loc.lower(), cha.lower())
+        if key[1] not in stations:
+            skipped.append(row)
+            continue
+        starttime, endtime = parse_time(start), parse_time(end)
+        if key in channels:
+            starttime = min(starttime, channels[key]['starttime'])
+            endtime = max(endtime, channels[key]['endtime'])
+        # Metadata of the last epoch is kept
+        channels[key] = {
+            'lat': float(lat),
+            'lon': float(lon),
+            'elev': float(elev),
+            'depth': float(depth),
+            'name': stations[key[1]],
+            'azimuth': to_float(azimuth),
+            'dip': to_float(dip),
+            'sensor_description': sensor_descr,
+            'scale': to_float(scale),
+            'scale_freq': to_float(freq),
+            'scale_units': units,
+            'sample_rate': to_float(rate),
+            'starttime': starttime,
+            'endtime': endtime,
+        }
+    return channels, skipped
+
+
+def sync_networks(networks, user):
+    '''
+    Create the networks in a dict of lowercase code -> name that don't exist
+    yet. Existing networks are left alone. Returns the number created
+    '''
+    existing = set(Network.objects.filter(
+        code__in=networks).values_list('code', flat=True))
+    created = Network.objects.bulk_create([
+        Network(code=code, name=name, user=user)
+        for code, name in networks.items() if code not in existing
+    ], batch_size=BATCH_SIZE)
+    return len(created)
+
+
+def existing_channels(keys):
+    '''Return a dict of key -> (id, CHANNEL_FIELDS values) of channels'''
+    networks = {key[0] for key in keys}
+    stations = {key[1] for key in keys}
+    rows = Channel.objects.filter(
+        network__in=networks,
+        station_code__in=stations
+    ).values_list('id', 'network', 'station_code', 'loc', 'code',
+                  *CHANNEL_FIELDS)
+    return {tuple(row[1:5]): (row[0], dict(zip(CHANNEL_FIELDS, row[5:])))
+            for row in rows}
+
+
+def diff_channels(channels, existing):
+    '''
+    Compare parsed channels with existing ones. Returns lists of keys to
+    add, of (key, channel id, changed field names) to update, and the
+    number of unchanged channels
+    '''
+    adds, changes, unchanged = [], [], 0
+    for key, fields in channels.items():
+        if key not in existing:
+            adds.append(key)
+            continue
+        channel_id, current = existing[key]
+        changed = [field for field in CHANNEL_FIELDS
+                   if fields[field] != current[field]]
+        if changed:
+            changes.append((key, channel_id, changed))
+        else:
+            unchanged += 1
+    return adds, changes, unchanged
+
+
+def sync_channels(channels, user, batch_size=BATCH_SIZE):
+    '''
+    Insert new and update changed channels from parse_channels output, and
+    add the new channels to groups whose matching rules include them.
+    Channels of unknown networks are skipped. Returns a dict of the number
+    of channels added, changed, unchanged and skipped, and the number of
+    channels added to groups
+    '''
+    networks = set(Network.objects.filter(
+        code__in={key[0] for key in channels}).values_list('code', flat=True))
+    skipped = len(channels)
+    channels = OrderedDict((key, fields) for key, fields in channels.items()
+                           if key[0] in networks)
+    skipped -= len(channels)
+
+    adds, changes, unchanged = diff_channels(
+        channels, existing_channels(channels))
+
+    now = timezone.now()
+    new_channels = []
+    for key in adds:
+        network, station, loc, code = key
+        new_channels.append(Channel(
+            network_id=network,
+            station_code=station,
+            loc=loc,
+            code=code,
+            nslc=f'{network}.{station}.{loc}.{code}',
+            user=user,
+            **channels[key]))
+    changed_channels = [
+        Channel(id=channel_id, user=user, updated_at=now, **channels[key])
+        for key, channel_id, changed in changes]
+
+    grouped = 0
+    if new_channels or changed_channels:
+        with transaction.atomic():
+            Channel.objects.bulk_create(new_channels, batch_size=batch_size)
+            Channel.objects.bulk_update(
+                changed_channels, CHANNEL_FIELDS + ('user', 'updated_at'),
+                batch_size=batch_size)
+            if new_channels:
+                grouped = add_channels_to_groups(new_channels)
+        if new_channels:
+            invalidate_nslcs()
+    return {
+        'added': len(adds),
+        'changed': len(changes),
+        'unchanged': unchanged,
+        'skipped': skipped,
+        'grouped': grouped
+    }
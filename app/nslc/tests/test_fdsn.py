@@ -0,0 +1,124 @@
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from nslc.fdsn import (build_url, fetch_rows, level_sources,
+                       read_concurrently, stream_lines)
+from nslc.models import Channel, Network
+from squac.test_mixins import sample_user
+
+
+'''Tests for fetching FDSN metadata:
+to run only this file
+    ./mg.sh "test nslc.tests.test_fdsn && flake8"
+
+'''
+
+NETWORKS = '''#Network|Description|StartTime|EndTime|TotalStations
+UW|Pacific Northwest Seismic Network|1963-01-01T00:00:00||300
+'''
+STATIONS = '''#Network|Station|Latitude|Longitude|Elevation|SiteName|StartTime
+DATACENTER=IRISDMC,http://ds.iris.edu
+UW|RCM|46.8|-121.7|3085|Camp Muir|2000-01-01T00:00:00
+UW|BST23|47.5|-122.3|50|Test Station|2019-01-01T00:00:00
+'''
+CHANNEL_HEADER = ('#Network|Station|Location|Channel|Latitude|Longitude|'
+                  'Elevation|Depth|Azimuth|Dip|SensorDescription|Scale|'
+                  'ScaleFreq|ScaleUnits|SampleRate|StartTime|EndTime\n')
+
+
+def channel_line(sta, cha, loc=''):
+    return (f'UW|{sta}|{loc}|{cha}|46.8|-121.7|3085|0|0|-90|Sensor|1000|1|'
+            f'M/S|100|2019-01-01T00:00:00|\n')
+
+
+class FdsnTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.files = {
+            'network.txt': NETWORKS,
+            'station.txt': STATIONS,
+            'channel-IRISDMC.txt': CHANNEL_HEADER + ''.join(
+                channel_line('RCM', cha) for cha in ('EHZ', 'EHN', 'EHE')),
+            'channel-SCEDC.txt': CHANNEL_HEADER + ''.join(
+                channel_line('BST23', cha, '01') for cha in ('HNZ', 'HNN')),
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(self.directory.name, name), 'w') as f:
+                f.write(content)
+        self.params = {'datacenter': 'IRISDMC,SCEDC', 'net': 'UW',
+                       'starttime': '2019-01-01', 'sta': '*', 'cha': '*',
+                       'loc': '*', 'minlat': 12, 'maxlat': 72,
+                       'minlon': -183, 'maxlon': -62}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build_url(self):
+        url = build_url(self.params, 'channel', 'SCEDC')
+        self.assertIn('datacenter=SCEDC&', url)
+        self.assertIn('&level=channel', url)
+        self.assertIn('&minlon=-183', url)
+        self.assertNotIn('&sta=',
+                         build_url(self.params, 'network', 'SCEDC'))
+
+    def test_one_source_per_datacenter(self):
+        self.assertEqual(2, len(level_sources('station', self.params)))
+        self.assertEqual(2, len(level_sources(
+            'channel', self.params, self.directory.name)))
+
+    def test_fetch_rows_from_files(self):
+        rows = list(fetch_rows('station', self.params, self.directory.name))
+        self.assertEqual(['RCM', 'BST23'], [row[1] for row in rows])
+        rows = list(fetch_rows('channel', self.params, self.directory.name,
+                               workers=1))
+        self.assertEqual(5, len(rows))
+        self.assertEqual({'EHZ', 'EHN', 'EHE', 'HNZ', 'HNN'},
+                         {row[3] for row in rows})
+
+    def test_read_concurrently_in_chunks(self):
+        lines = [f'UW|STA{i}' for i in range(1234)]
+        sources = [lambda: iter(lines), lambda: iter(['UW|X'])]
+        with patch('nslc.fdsn.CHUNK_SIZE', 100):
+            rows = list(read_concurrently(sources))
+        self.assertEqual(1235, len(rows))
+
+    def test_read_concurrently_raises_source_errors(self):
+        def failing():
+            yield 'UW|STA'
+            raise IOError('Connection reset')
+        with self.assertRaises(IOError):
+            list(read_concurrently([failing, lambda: iter(['UW|X'])]))
+
+    def test_stream_lines(self):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = iter(STATIONS.splitlines())
+        with patch('nslc.fdsn.requests.get',
+                   return_value=response) as get:
+            lines = list(stream_lines('http://example.org'))
+        self.assertEqual(STATIONS.splitlines(), lines)
+        self.assertTrue(get.call_args[1]['stream'])
+        response.raise_for_status.assert_called_once()
+
+    def test_load_from_fdsn_source(self):
+        sample_user('loader@pnsn.org')
+        out = StringIO()
+        with patch.dict(os.environ, {'LOADER_EMAIL': 'loader@pnsn.org'}):
+            call_command('load_from_fdsn', source=self.directory.name,
+                         stdout=out)
+        self.assertTrue(Network.objects.filter(code='uw').exists())
+        self.assertEqual(5, Channel.objects.count())
+        self.assertEqual(
+            'Test Station', Channel.objects.get(code='hnz').name)
+        self.assertIn('5 added, 0 changed', out.getvalue())
+
+        with patch.dict(os.environ, {'LOADER_EMAIL': 'loader@pnsn.org'}):
+            call_command('load_from_fdsn', source=self.directory.name,
+                         stdout=out)
+        self.assertIn('0 added, 0 changed, 5 unchanged', out.getvalue())
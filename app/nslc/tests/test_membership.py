@@ -0,0 +1,67 @@
+from datetime import datetime
+import pytz
+
+from django.test import TestCase
+
+from nslc.membership import get_group_channel_ids
+from nslc.models import Channel, Group, Network
+from organization.models import Organization
+from squac.test_mixins import sample_user
+
+
+'''Tests for resolving groups to channel ids:
+to run only this file
+    ./mg.sh "test nslc.tests.test_membership && flake8"
+
+'''
+
+
+class GroupMembershipTests(TestCase):
+
+    def create_channel(self, sta):
+        return Channel.objects.create(
+            code='ehz', name='ehz', loc='--', lat=45.0, lon=-122.0,
+            station_code=sta, station_name=sta,
+            elev=100.0, network=self.net, user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC))
+
+    def setUp(self):
+        self.user = sample_user()
+        self.net = Network.objects.create(
+            code="uw", name="University of Washington", user=self.user)
+        self.channels = [self.create_channel(f'sta{i}') for i in range(5)]
+        organization = Organization.objects.create(name='PNSN')
+        self.grp1 = Group.objects.create(
+            name='group 1', user=self.user, organization=organization)
+        self.grp2 = Group.objects.create(
+            name='group 2', user=self.user, organization=organization)
+        self.grp1.channels.set(self.channels[:3])
+        self.grp2.channels.set(self.channels[2:4])
+
+    def ids(self, channels):
+        return sorted(channel.id for channel in channels)
+
+    def test_resolves_groups(self):
+        self.assertEqual(self.ids(self.channels[:4]),
+                         get_group_channel_ids([self.grp1.id, self.grp2.id]))
+        self.assertEqual(self.ids(self.channels[2:4]),
+                         get_group_channel_ids([self.grp2.id]))
+        self.assertEqual([], get_group_channel_ids([0]))
+
+    def test_cached_until_channels_change(self):
+        get_group_channel_ids([self.grp1.id, self.grp2.id])
+        # Only the group versions are read
+        with self.assertNumQueries(1):
+            get_group_channel_ids([self.grp1.id, self.grp2.id])
+
+        self.grp1.channels.remove(self.channels[0])
+        self.assertEqual(self.ids(self.channels[1:3]),
+                         get_group_channel_ids([self.grp1.id]))
+        # Changes from the channel side bump the group too
+        self.channels[4].group_set.add(self.grp2)
+        self.assertEqual(self.ids(self.channels[2:5]),
+                         get_group_channel_ids([self.grp2.id]))
+        self.channels[3].group_set.clear()
+        self.assertEqual(self.ids([self.channels[2], self.channels[4]]),
+                         get_group_channel_ids([self.grp2.id]))
@@ -166,6 +166,36 @@ class PrivateNslcAPITests(TestCase):
             else:
                 self.assertEqual(payload[key], channel.network.code)
 
+    def test_conditional_channel_list(self):
+        '''Unchanged lists are answered with 304 before serializing'''
+        url = reverse('nslc:channel-list') + '?sta_search=^rcm$'
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+        self.assertIn('Last-Modified', res)
+
+        with patch('nslc.views.ChannelSerializer.to_representation') as rep:
+            with self.assertNumQueries(1):
+                res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(0, rep.call_count)
+        self.assertEqual(etag, res['ETag'])
+
+        # Other filters and changed channels get new etags
+        res = self.client.get(reverse('nslc:channel-list'),
+                              HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.chan.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(etag, res['ETag'])
+
+        etag = res['ETag']
+        self.chan.delete()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([], res.data)
+
     def test_get_group(self):
         '''Test if correct group object is returned'''
         url = reverse('nslc:group-detail', kwargs={'pk': self.grp.id})
@@ -175,6 +205,41 @@ class PrivateNslcAPITests(TestCase):
         self.assertEqual(str(self.grp), 'Test group')
         self.assertEqual(4, self.grp.channels.count())
 
+    def test_get_compact_group(self):
+        url = reverse('nslc:group-detail', kwargs={'pk': self.grp.id})
+        res = self.client.get(url + '?compact=true')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(self.grp.channels.values_list('id', flat=True)),
+            res.data['channels'])
+        self.assertEqual([], res.data['auto_include_channels'])
+        self.assertEqual(4, res.data['channels_count'])
+
+    def test_get_group_channels(self):
+        url = reverse('nslc:group-channels', kwargs={'pk': self.grp.id})
+        ids = sorted(self.grp.channels.values_list('id', flat=True))
+        res = self.client.get(url + '?page_size=3')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(ids[:3], [c['id'] for c in res.data['results']])
+        res = self.client.get(res.data['next'])
+        self.assertEqual(ids[3:], [c['id'] for c in res.data['results']])
+        self.assertIsNone(res.data['next'])
+
+        # Channel filters and sparse fields apply to the channels
+        res = self.client.get(url + '?channel=hnz&fields=id,nslc')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        [channel] = res.data['results']
+        self.assertEqual({'id', 'nslc'}, set(channel))
+        self.assertTrue(channel['nslc'].endswith('.hnz'))
+
+    def test_group_channels_count(self):
+        self.assertEqual(4, Group.objects.get(id=self.grp.id).channels_count)
+        self.grp.channels.remove(self.chan)
+        self.assertEqual(3, Group.objects.get(id=self.grp.id).channels_count)
+        self.grp.channels.add(self.chan)
+        Channel.objects.filter(station_code='reed').delete()
+        self.assertEqual(1, Group.objects.get(id=self.grp.id).channels_count)
+
     def test_create_group(self):
         '''Test a group can be created'''
         url = reverse('nslc:group-list')
@@ -186,6 +251,7 @@ class PrivateNslcAPITests(TestCase):
         }
         res = self.client.post(url, payload)
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(1, res.data['channels_count'])
 
     def test_partial_update_group(self):
         group = Group.objects.get(name='UW-All')
@@ -197,6 +263,7 @@ class PrivateNslcAPITests(TestCase):
         url = reverse('nslc:group-detail', args=[group.id])
         res = self.client.patch(url, payload)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(1, res.data['channels_count'])
         group.refresh_from_db()
 
         self.assertEqual(group.name, payload['name'])
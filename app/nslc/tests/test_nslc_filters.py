@@ -1,5 +1,7 @@
+from django.db import connection
 from django.test import TestCase
-from nslc.models import Group
+from django.test.utils import CaptureQueriesContext
+from nslc.models import Channel, Group
 
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -64,6 +66,80 @@ class NslcFilterTests(TestCase):
         res = self.client.get(url)
         self.assertEqual(len(res.data), 6)
 
+    def get_ids(self, query):
+        res = self.client.get(reverse('nslc:channel-list') + query)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return sorted(d['id'] for d in res.data)
+
+    def create_channel(self, code, lat, lon):
+        return Channel.objects.create(
+            code=code, station_code='xx', loc='--', lat=lat, lon=lon,
+            elev=0.0, network_id='uw', user=self.user).id
+
+    def test_channel_radius_filter(self):
+        self.assertEqual([6, 7], self.get_ids('?near=41,-121&radius_km=100'))
+        self.assertEqual(list(range(4, 10)),
+                         self.get_ids('?near=41,-121&radius_km=150'))
+        res = self.client.get(reverse('nslc:channel-list') + '?near=41,-121')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_radius_filter_antipode(self):
+        # The haversine term is 1 at the antipode, the limit of asin
+        ids = [self.create_channel('hhz', -12.05, 165.74),
+               self.create_channel('hhn', -90.0, 0.0)]
+        self.assertEqual([ids[0]], self.get_ids(
+            '?near=12.05,-14.26&radius_km=20015.1&lat_max=0&lat_min=-80'))
+        self.assertEqual([ids[1]], self.get_ids(
+            '?near=90,0&radius_km=20016&lat_max=-89'))
+
+    def test_channel_polygon_filter(self):
+        # In the bounding box but outside of the triangle
+        self.create_channel('hhz', 39.7, -121.3)
+        self.assertEqual([6, 7], self.get_ids(
+            '?polygon=39.5,-120.5,41.5,-120.5,41.5,-121.5'))
+        res = self.client.get(
+            reverse('nslc:channel-list') + '?polygon=39.5,-120.5,41.5')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_antimeridian_filters(self):
+        ids = [self.create_channel('hhe', 0.5, 179.5),
+               self.create_channel('hhn', -0.5, -179.5)]
+        for query in ('?lon_min=179&lon_max=-179',
+                      '?lat_min=-1&lat_max=1&lon_min=-183&lon_max=-178',
+                      '?near=0,180&radius_km=100',
+                      '?near=0,-179.9&radius_km=100',
+                      '?polygon=1,179,1,181,-1,181,-1,179'):
+            self.assertEqual(ids, self.get_ids(query), query)
+        self.assertEqual([ids[1]], self.get_ids('?lon_min=-180&lon_max=-179'))
+
+    def test_channel_sparse_fields(self):
+        url = reverse('nslc:channel-list') + '?fields=id,nslc,lat,lon'
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(10, len(res.data))
+        self.assertEqual(['id', 'lat', 'lon', 'nslc'], sorted(res.data[0]))
+        [query] = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT "nslc_channel"."id"')]
+        self.assertNotIn('"nslc_channel"."station_name"', query)
+
+        res = self.client.get(
+            reverse('nslc:channel-detail', args=[4]) + '?omit=class_name,user')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('user', res.data)
+        self.assertEqual('uw.reed.--.hnn', res.data['nslc'])
+
+    def test_group_sparse_fields(self):
+        group = Group.objects.first()
+        url = reverse('nslc:group-detail', args=[group.id])
+        res = self.client.get(
+            url + '?omit=auto_include_channels,auto_exclude_channels')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('channels', res.data)
+        self.assertNotIn('auto_include_channels', res.data)
+        res = self.client.get(url + '?fields=id,name,channels_count')
+        self.assertEqual({'id', 'name', 'channels_count'}, set(res.data))
+
     def test_channel_date_filter(self):
         baseurl = reverse('nslc:channel-list')
         endtime = '2018-02-01T03:00:00Z'
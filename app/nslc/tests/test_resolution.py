@@ -0,0 +1,76 @@
+from datetime import datetime
+import pytz
+
+from django.db import connection
+from django.test import TestCase
+
+from nslc.models import Channel, Network
+from nslc.resolution import (get_nslc_channel_ids, invalidate_nslcs,
+                             resolve_nslcs)
+from nslc.sync import parse_channels, sync_channels
+from squac.test_mixins import sample_user
+
+
+'''Tests for resolving nslcs to channel ids:
+to run only this file
+    ./mg.sh "test nslc.tests.test_resolution && flake8"
+
+'''
+
+
+class NslcResolutionTests(TestCase):
+
+    def create_channel(self, sta):
+        return Channel.objects.create(
+            code='ehz', name='ehz', loc='--', lat=45.0, lon=-122.0,
+            station_code=sta, station_name=sta,
+            elev=100.0, network=self.net, user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC))
+
+    def setUp(self):
+        self.user = sample_user()
+        self.net = Network.objects.create(
+            code="uw", name="University of Washington", user=self.user)
+        self.channels = [self.create_channel(sta) for sta in ('rcm', 'reed')]
+        # Channels of other tests were rolled back without committing
+        invalidate_nslcs()
+
+    def run_on_commit(self):
+        '''TestCase never commits, run the on_commit callbacks instead'''
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for savepoint_ids, callback in callbacks:
+            callback()
+
+    def test_resolve_nslcs(self):
+        self.assertEqual(
+            {'uw.rcm.--.ehz': self.channels[0].id},
+            resolve_nslcs(['UW.RCM.--.EHZ', 'uw.nope.--.ehz']))
+        self.assertEqual(
+            sorted(channel.id for channel in self.channels),
+            get_nslc_channel_ids(['uw.reed.--.ehz', 'uw.rcm.--.ehz']))
+
+    def test_cached_until_channels_change(self):
+        nslcs = ['uw.rcm.--.ehz', 'uw.reed.--.ehz']
+        resolve_nslcs(nslcs)
+        with self.assertNumQueries(0):
+            resolve_nslcs(nslcs)
+
+        deleted_id = self.channels[1].id
+        self.channels[1].delete()
+        channel = self.create_channel('reed')
+        # Invalidated once the changes are committed
+        self.assertEqual(deleted_id, resolve_nslcs(nslcs)['uw.reed.--.ehz'])
+        self.run_on_commit()
+        self.assertEqual(channel.id, resolve_nslcs(nslcs)['uw.reed.--.ehz'])
+
+    def test_sync_invalidates(self):
+        self.assertEqual({}, resolve_nslcs(['uw.bst23.--.hnz']))
+        row = ['UW', 'BST23', '', 'HNZ', '46.5', '-121.5', '100', '0', '0',
+               '-90', 'Sensor', '1000', '1', 'M/S', '100',
+               '2019-01-01T00:00:00', '']
+        channels, skipped = parse_channels([row], {'bst23': 'Test'})
+        sync_channels(channels, self.user)
+        self.assertEqual(
+            Channel.objects.get(station_code='bst23').id,
+            resolve_nslcs(['uw.bst23.--.hnz'])['uw.bst23.--.hnz'])
@@ -0,0 +1,218 @@
+from datetime import datetime
+from io import StringIO
+import pytz
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from nslc.models import (Channel, Group, MatchingRule, Network,
+                         add_channels_to_groups, deferred_channel_updates,
+                         get_channel_index)
+from nslc.rules import ChannelIndex, group_members
+from organization.models import Organization
+from squac.test_mixins import sample_user
+
+
+'''Tests for evaluating group matching rules:
+to run only this file
+    ./mg.sh "test nslc.tests.test_rules && flake8"
+
+'''
+
+
+class RuleTestCase(TestCase):
+
+    def create_channel(self, net, sta, cha, loc='--'):
+        return Channel.objects.create(
+            code=cha, name=cha, loc=loc, lat=45.0, lon=-122.0,
+            station_code=sta, station_name=sta,
+            elev=100.0, network=net, user=self.user,
+            starttime=datetime(1970, 1, 1, tzinfo=pytz.UTC),
+            endtime=datetime(2599, 12, 31, tzinfo=pytz.UTC))
+
+    def setUp(self):
+        self.user = sample_user()
+        self.uw = Network.objects.create(
+            code="uw", name="University of Washington", user=self.user)
+        self.uo = Network.objects.create(
+            code="uo", name="University of Oregon", user=self.user)
+        self.channels = [
+            self.create_channel(net, sta, cha, loc)
+            for net in (self.uw, self.uo)
+            for sta in ('rcm', 'reed', 'bst23')
+            for cha, loc in (('ehz', '--'), ('hne', '01'), ('hnz', '01'))
+        ]
+        self.organization = Organization.objects.create(name='PNSN')
+        self.grp = Group.objects.create(
+            name='auto group', user=self.user,
+            organization=self.organization)
+
+    def add_rule(self, group, is_include=True, **patterns):
+        return MatchingRule.objects.create(
+            group=group, user=self.user, is_include=is_include, **patterns)
+
+
+class MatchingRuleTests(RuleTestCase):
+
+    def test_matches_like_iregex(self):
+        index = get_channel_index()
+        for patterns in (('', '', '', ''), ('UW', '^r', '', 'z$'),
+                         ('u[wo]', 'e+d', '01', '.n.'), ('xx', '', '', '')):
+            expected = set(Channel.objects.filter(
+                network__code__iregex=patterns[0],
+                station_code__iregex=patterns[1],
+                loc__iregex=patterns[2],
+                code__iregex=patterns[3]).values_list('id', flat=True))
+            self.assertEqual(expected, index.match(patterns))
+
+    def test_group_members(self):
+        rows = [(1, 'uw', 'rcm', '--', 'ehz'), (2, 'uw', 'rcm', '--', 'ehn'),
+                (3, 'uo', 'reed', '--', 'ehz')]
+        index = ChannelIndex(rows)
+        self.assertEqual({1, 3, 4}, group_members(
+            index, include_rules=[('', '', '', 'z')], include_ids=[4]))
+        self.assertEqual({3}, group_members(
+            index, include_rules=[('', '', '', 'z')],
+            exclude_rules=[('uw', '', '', '')], exclude_ids=[4]))
+        # Without include rules or ids all channels are included
+        self.assertEqual({3}, group_members(
+            index, exclude_rules=[('uw', '', '', '')]))
+        self.assertEqual({1, 3}, group_members(index, exclude_ids=[2]))
+
+    def test_index_is_reused_until_channels_change(self):
+        index = get_channel_index()
+        self.assertIs(index, get_channel_index())
+        self.channels[0].save()
+        self.assertIsNot(index, get_channel_index())
+        index = get_channel_index()
+        self.create_channel(self.uw, 'new', 'ehz')
+        self.assertIsNot(index, get_channel_index())
+
+    def test_update_channels(self):
+        self.add_rule(self.grp, network_regex='uw')
+        self.add_rule(self.grp, is_include=False, station_regex='rcm')
+        self.grp.auto_include_channels.add(self.channels[-1])
+        expected = set(Channel.objects.filter(
+            Q(network='uw') | Q(id=self.channels[-1].id)
+        ).exclude(station_code='rcm').values_list('id', flat=True))
+        self.assertEqual(expected, set(
+            self.grp.channels.values_list('id', flat=True)))
+
+    def test_update_channels_exclude_only(self):
+        self.add_rule(self.grp, is_include=False, station_regex='rcm')
+        expected = set(Channel.objects.exclude(
+            station_code='rcm').values_list('id', flat=True))
+        self.assertEqual(expected, set(
+            self.grp.channels.values_list('id', flat=True)))
+
+    def test_add_channels_to_groups(self):
+        self.add_rule(self.grp, channel_regex='z')
+        self.add_rule(self.grp, is_include=False, network_regex='uo')
+        other = Group.objects.create(
+            name='other group', user=self.user,
+            organization=self.organization)
+        self.add_rule(other, station_regex='^new$')
+        n_channels = self.grp.channels.count()
+
+        new_channels = [self.create_channel(self.uw, 'new', 'hnz'),
+                        self.create_channel(self.uw, 'new', 'hne'),
+                        self.create_channel(self.uo, 'new', 'hnz')]
+        self.assertEqual(3 + 1, add_channels_to_groups(new_channels))
+        self.assertEqual(n_channels + 1, self.grp.channels.count())
+        self.assertIn(new_channels[0], self.grp.channels.all())
+        self.assertEqual(set(new_channels), set(other.channels.all()))
+
+    def test_add_channels_to_groups_like_update_channels(self):
+        # Only exclude rules, but auto include channels: no new channels
+        self.grp.auto_include_channels.add(self.channels[0])
+        self.add_rule(self.grp, is_include=False, network_regex='uo')
+        # No rules, only auto exclude channels: all new channels
+        other = Group.objects.create(
+            name='other group', user=self.user,
+            organization=self.organization)
+        other.auto_exclude_channels.add(self.channels[0])
+        other.update_channels()
+
+        new_channels = [self.create_channel(self.uw, 'new', 'hnz'),
+                        self.create_channel(self.uo, 'new', 'hnz')]
+        add_channels_to_groups(new_channels)
+        for group in (self.grp, other):
+            added = set(group.channels.filter(station_code='new'))
+            group.update_channels()
+            self.assertEqual(
+                set(group.channels.filter(station_code='new')), added)
+        self.assertEqual(set(), set(
+            self.grp.channels.filter(station_code='new')))
+        self.assertEqual(set(new_channels), set(
+            other.channels.filter(station_code='new')))
+
+
+class DeferredChannelUpdateTests(RuleTestCase):
+
+    def test_updates_each_group_once(self):
+        other = Group.objects.create(
+            name='other group', user=self.user,
+            organization=self.organization)
+        with patch('nslc.models.Group.update_channels') as update:
+            with deferred_channel_updates():
+                for sta in ('rcm', 'reed', 'bst23'):
+                    self.add_rule(self.grp, station_regex=sta)
+                with deferred_channel_updates():
+                    self.grp.auto_include_channels.set(self.channels[:5])
+                    self.add_rule(other, network_regex='uo')
+                self.assertEqual(0, update.call_count)
+            self.assertEqual(2, update.call_count)
+
+            # Updated right away outside of a block
+            self.add_rule(self.grp, network_regex='uw')
+            self.assertEqual(3, update.call_count)
+
+    def test_no_updates_after_errors(self):
+        with patch('nslc.models.Group.update_channels') as update:
+            with self.assertRaises(ValueError):
+                with deferred_channel_updates():
+                    self.add_rule(self.grp, station_regex='rcm')
+                    raise ValueError()
+            self.assertEqual(0, update.call_count)
+
+    def test_group_update_request(self):
+        client = APIClient()
+        self.user.is_staff = True
+        client.force_authenticate(self.user)
+        url = reverse('nslc:group-detail', args=[self.grp.id])
+        with patch('nslc.models.Group.update_channels', autospec=True,
+                   side_effect=Group.update_channels) as update:
+            res = client.patch(url, {
+                'auto_include_channels': [c.id for c in self.channels[:4]],
+                'auto_exclude_channels': [self.channels[0].id]
+            })
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(1, update.call_count)
+        self.assertEqual(set(self.channels[1:4]),
+                         set(self.grp.channels.all()))
+
+    @override_settings(GROUP_BACKGROUND_UPDATE_SIZE=3)
+    def test_large_groups_update_in_background(self):
+        self.add_rule(self.grp, network_regex='uw')
+        self.assertEqual(9, self.grp.channels.count())
+
+        self.add_rule(self.grp, is_include=False, station_regex='rcm')
+        self.grp.refresh_from_db()
+        self.assertIsNotNone(self.grp.channels_stale_at)
+        self.assertEqual(9, self.grp.channels.count())
+
+        call_command('update_auto_channels', '--stale', stdout=StringIO())
+        self.grp.refresh_from_db()
+        self.assertIsNone(self.grp.channels_stale_at)
+        self.assertEqual(6, self.grp.channels.count())
+
+        # Nothing stale, so the channel index isn't loaded
+        with patch('nslc.management.commands.update_auto_channels.'
+                   'get_channel_index') as get_index:
+            call_command('update_auto_channels', '--stale', stdout=StringIO())
+        get_index.assert_not_called()
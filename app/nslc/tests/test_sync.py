@@ -0,0 +1,95 @@
+from datetime import datetime
+import pytz
+
+from django.test import TestCase
+
+from nslc.models import Channel, Network
+from nslc.sync import (OPEN_ENDTIME, parse_channels, sync_channels,
+                       sync_networks)
+from squac.test_mixins import sample_user
+
+
+'''Tests for syncing channels with FDSN metadata:
+to run only this file
+    ./mg.sh "test nslc.tests.test_sync && flake8"
+
+'''
+
+
+def channel_row(sta, cha, depth='0', start='2019-01-01T00:00:00', end='',
+                net='UW', loc=''):
+    return [net, sta, loc, cha, '46.5', '-121.5', '100', depth, '0', '-90',
+            'Sensor', '1000', '1', 'M/S', '100', start, end]
+
+
+class SyncChannelsTests(TestCase):
+
+    def setUp(self):
+        self.user = sample_user()
+        Network.objects.create(
+            code="uw", name="University of Washington", user=self.user)
+        self.stations = {'rcm': 'Camp Muir', 'bst23': 'Test Station'}
+        rows = [channel_row('RCM', 'EHZ'), channel_row('RCM', 'EHN'),
+                channel_row('BST23', 'HNZ', loc='01')]
+        channels, skipped = parse_channels(rows, self.stations)
+        self.assertEqual([], skipped)
+        self.summary = sync_channels(channels, self.user)
+
+    def test_parse_channels(self):
+        rows = [
+            channel_row('RCM', 'EHZ', end='2020-01-01T00:00:00'),
+            channel_row('RCM', 'EHZ', depth='5',
+                        start='2020-01-01T00:00:00'),
+            channel_row('XXX', 'EHZ'),
+            ['#Network']
+        ]
+        channels, skipped = parse_channels(rows, self.stations)
+        self.assertEqual([rows[2]], skipped)
+        [(key, fields)] = channels.items()
+        self.assertEqual(('uw', 'rcm', '--', 'ehz'), key)
+        # Epochs are merged, other metadata is from the last one
+        self.assertEqual(datetime(2019, 1, 1, tzinfo=pytz.UTC),
+                         fields['starttime'])
+        self.assertEqual(OPEN_ENDTIME, fields['endtime'])
+        self.assertEqual(5.0, fields['depth'])
+        self.assertEqual('Camp Muir', fields['name'])
+
+    def test_sync_adds_channels(self):
+        self.assertEqual({'added': 3, 'changed': 0, 'unchanged': 0,
+                          'skipped': 0, 'grouped': 0}, self.summary)
+        channel = Channel.objects.get(station_code='bst23')
+        self.assertEqual('uw.bst23.01.hnz', channel.nslc)
+        self.assertEqual('01', channel.loc)
+        self.assertEqual(self.user, channel.user)
+
+    def test_sync_only_writes_changes(self):
+        unchanged = Channel.objects.get(code='ehn')
+        rows = [channel_row('RCM', 'EHZ', depth='7'),
+                channel_row('RCM', 'EHN'),
+                channel_row('BST23', 'HNZ', loc='01'),
+                channel_row('BST23', 'HNE', loc='01'),
+                channel_row('RCM', 'EHZ', net='XX')]
+        channels, skipped = parse_channels(rows, self.stations)
+        # Select existing, insert, update, and match group rules and auto
+        # include/exclude lists
+        with self.assertNumQueries(7 + 2):
+            summary = sync_channels(channels, self.user)
+        self.assertEqual({'added': 1, 'changed': 1, 'unchanged': 2,
+                          'skipped': 1, 'grouped': 0}, summary)
+        self.assertEqual(7.0, Channel.objects.get(code='ehz').depth)
+        self.assertEqual(unchanged.updated_at,
+                         Channel.objects.get(code='ehn').updated_at)
+        self.assertEqual(4, Channel.objects.count())
+
+        # Nothing to write the second time
+        with self.assertNumQueries(2):
+            summary = sync_channels(channels, self.user)
+        self.assertEqual(4, summary['unchanged'])
+
+    def test_sync_networks(self):
+        added = sync_networks({'uw': 'University of Washington',
+                               'cc': 'Cascades Volcano Observatory'},
+                              self.user)
+        self.assertEqual(1, added)
+        self.assertEqual(
+            'University of Washington', Network.objects.get(code='uw').name)
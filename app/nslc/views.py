@@ -1,20 +1,27 @@
 
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from django.views.decorators.cache import cache_control
 from django.conf import settings
 from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from django_filters import rest_framework as filters
-from squac.filters import CharInFilter
+from django_filters.utils import translate_validation
+from rest_framework.exceptions import ValidationError
+from squac.filters import CharInFilter, NumberInFilter
+from squac.pagination import KeysetPagination
 from squac.mixins import SetUserMixin, DefaultPermissionsMixin, \
-    SharedPermissionsMixin, OverrideParamsMixin
-from .models import Network, Channel, Group, MatchingRule
+    SharedPermissionsMixin, OverrideParamsMixin, ConditionalListMixin, \
+    SparseFieldsMixin
+from .models import Network, Channel, Group, MatchingRule, \
+    deferred_channel_updates
+from nslc import spatial
+from nslc.resolution import get_nslc_channel_ids
 from nslc.serializers import NetworkSerializer, ChannelSerializer, \
-    GroupSerializer, GroupDetailSerializer, MatchingRuleSerializer
-from django.db.models import Count
+    GroupSerializer, GroupCompactSerializer, GroupDetailSerializer, \
+    MatchingRuleSerializer
 
 
 """Filter classes used for view filtering"""
@@ -39,7 +46,7 @@ class NetworkFilter(filters.FilterSet):
 
 
 class ChannelFilter(filters.FilterSet):
-    nslc = CharInFilter(field_name='nslc', lookup_expr='in')
+    nslc = CharInFilter(method='filter_nslc')
     network = CharInFilter(field_name='network__code')
     net_search = filters.CharFilter(field_name='network__code',
                                     lookup_expr='iregex')
@@ -56,8 +63,11 @@ class ChannelFilter(filters.FilterSet):
     endbefore = filters.CharFilter(field_name='endtime', lookup_expr='lte')
     lat_min = filters.NumberFilter(field_name='lat', lookup_expr='gte')
     lat_max = filters.NumberFilter(field_name='lat', lookup_expr='lte')
-    lon_min = filters.NumberFilter(field_name='lon', lookup_expr='gte')
-    lon_max = filters.NumberFilter(field_name='lon', lookup_expr='lte')
+    lon_min = filters.NumberFilter(method='filter_lon')
+    lon_max = filters.NumberFilter(method='filter_lon')
+    near = NumberInFilter(method='filter_near')
+    radius_km = filters.NumberFilter(method='filter_near')
+    polygon = NumberInFilter(method='filter_polygon')
     order = filters.OrderingFilter(
         fields=(('nslc', 'nslc'),
                 ('network__code', 'network'),
@@ -69,6 +79,41 @@ class ChannelFilter(filters.FilterSet):
 
     )
 
+    def filter_nslc(self, queryset, name, value):
+        return queryset.filter(id__in=get_nslc_channel_ids(value))
+
+    def filter_lon(self, queryset, name, value):
+        '''lon_min and lon_max, lon_min > lon_max crosses the antimeridian'''
+        data = self.form.cleaned_data
+        lon_min, lon_max = data.get('lon_min'), data.get('lon_max')
+        if name == 'lon_max' and lon_min is not None:
+            # Filtered together with lon_min
+            return queryset
+        return queryset.filter(spatial.box_q(
+            lon_min=-180.0 if lon_min is None else float(lon_min),
+            lon_max=180.0 if lon_max is None else float(lon_max)))
+
+    def filter_near(self, queryset, name, value):
+        '''near=lat,lon&radius_km=, channels within radius_km of a point'''
+        data = self.form.cleaned_data
+        near, radius_km = data.get('near'), data.get('radius_km')
+        if name == 'radius_km' and near:
+            # Filtered together with near
+            return queryset
+        if not near or len(near) != 2 or radius_km is None:
+            raise ValidationError(
+                {'near': 'near=lat,lon and radius_km are required together'})
+        lat, lon = (float(value) for value in near)
+        return spatial.filter_radius(queryset, lat, lon, float(radius_km))
+
+    def filter_polygon(self, queryset, name, value):
+        '''polygon=lat,lon,lat,lon,..., channels inside the polygon'''
+        try:
+            points = spatial.parse_polygon(value)
+        except ValueError as e:
+            raise ValidationError({'polygon': str(e)})
+        return spatial.filter_polygon(queryset, points)
+
 
 class GroupFilter(filters.FilterSet):
     order = filters.OrderingFilter(
@@ -105,13 +150,32 @@ def api_root(request, format=None):
 """
 
 
-class BaseNslcViewSet(SetUserMixin, DefaultPermissionsMixin,
+class DeferredChannelUpdatesMixin:
+    '''
+    Update the channels of affected groups once per request, after all of
+    its matching rule and auto include/exclude changes
+    '''
+
+    def perform_create(self, serializer):
+        with deferred_channel_updates():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with deferred_channel_updates():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with deferred_channel_updates():
+            super().perform_destroy(instance)
+
+
+class BaseNslcViewSet(SparseFieldsMixin, SetUserMixin, DefaultPermissionsMixin,
                       OverrideParamsMixin, viewsets.ModelViewSet):
 
     pass
 
 
-class NetworkViewSet(BaseNslcViewSet):
+class NetworkViewSet(ConditionalListMixin, BaseNslcViewSet):
     serializer_class = NetworkSerializer
     filter_class = NetworkFilter
 
@@ -119,13 +183,13 @@ class NetworkViewSet(BaseNslcViewSet):
         q = Network.objects.all()
         return self.serializer_class.setup_eager_loading(q)
 
-    @method_decorator(cache_page(settings.NSLC_DEFAULT_CACHE,
-                                 key_prefix="NetworkView"))
+    @method_decorator(cache_control(must_revalidate=True,
+                                    max_age=settings.NSLC_DEFAULT_CACHE))
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
 
-class ChannelViewSet(BaseNslcViewSet):
+class ChannelViewSet(ConditionalListMixin, BaseNslcViewSet):
     filter_class = ChannelFilter
     serializer_class = ChannelSerializer
 
@@ -138,20 +202,24 @@ class ChannelViewSet(BaseNslcViewSet):
         return super().dispatch(request, *args, **kwargs)
 
 
-class GroupViewSet(SharedPermissionsMixin, BaseNslcViewSet):
+class GroupViewSet(DeferredChannelUpdatesMixin, SharedPermissionsMixin,
+                   BaseNslcViewSet):
     filter_class = GroupFilter
     serializer_class = GroupSerializer
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
+            if self.request.query_params.get('compact') == 'true':
+                return GroupCompactSerializer
             return GroupDetailSerializer
+        if self.action == 'channels':
+            return ChannelSerializer
         return self.serializer_class
 
     def get_queryset(self):
 
         queryset = Group.objects \
-            .select_related('user') \
-            .annotate(channels_count=Count('channels'))
+            .select_related('user')
 
         if self.request.user.is_staff:
             return queryset
@@ -164,11 +232,41 @@ class GroupViewSet(SharedPermissionsMixin, BaseNslcViewSet):
 
         return queryset
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        # The deferred channel update only set channels_count in the database
+        serializer.instance.refresh_from_db(fields=['channels_count'])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        serializer.instance.refresh_from_db(fields=['channels_count'])
+
+    @action(detail=True, methods=['get'],
+            pagination_class=KeysetPagination)
+    def channels(self, request, pk=None):
+        '''
+        Channels of a group, paginated by id and filtered like the
+        channel list
+        '''
+        # Query parameters are channel filters, not group filters
+        group = get_object_or_404(self.get_queryset(), pk=pk)
+        self.check_object_permissions(request, group)
+        filterset = ChannelFilter(
+            request.query_params, request=request,
+            queryset=ChannelSerializer.setup_eager_loading(
+                Channel.objects.filter(group=group)))
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        queryset = self.sparse_queryset(filterset.qs)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
 
-class MatchingRuleViewSet(BaseNslcViewSet):
+class MatchingRuleViewSet(DeferredChannelUpdatesMixin, BaseNslcViewSet):
     queryset = MatchingRule.objects.all()
     serializer_class = MatchingRuleSerializer
     filter_class = RuleFilter
@@ -1,7 +1,7 @@
 
 from rest_framework import viewsets
 from squac.mixins import SetUserMixin, OrganizationPermissionsMixin, \
-    EnablePartialUpdateMixin, OverrideParamsMixin
+    EnablePartialUpdateMixin, OverrideParamsMixin, SparseFieldsMixin
 from django_filters import rest_framework as filters
 from organization.models import Organization
 from organization.serializers import OrganizationSerializer
@@ -41,7 +41,8 @@ class OrganizationFilter(filters.FilterSet):
         fields = ('name',)
 
 
-class OrganizationBase(SetUserMixin, OrganizationPermissionsMixin,
+class OrganizationBase(SparseFieldsMixin, SetUserMixin,
+                       OrganizationPermissionsMixin,
                        OverrideParamsMixin,
                        viewsets.ModelViewSet):
     pass
@@ -10,14 +10,24 @@ PRODUCTION_CRONJOBS = [  # noqa
         ['update_auto_channels']),
     ('0 20 * * *', 'django.core.management.call_command',
         ['create_table_partition']),
-    ('5 * * * *', 'django.core.management.call_command', ['evaluate_alarms']),
+    ('10 20 * * *', 'django.core.management.call_command',
+        ['create_alert_partition']),
+    ('0 4 * * *', 'django.core.management.call_command', ['compact_alerts']),
+    ('5 * * * *', 'django.core.management.call_command',
+        ['evaluate_alarms', '--workers=4', '--budget-seconds=300']),
+    ('* * * * *', 'django.core.management.call_command',
+        ['evaluate_incremental_alarms', '--debounce-seconds=30']),
+    ('* * * * *', 'django.core.management.call_command',
+        ['dispatch_emails']),
     ('0 5 * * *', 'django.core.management.call_command', ['s3_query_export']),
     ('0 6 1,10 * *', 'django.core.management.call_command',
         ['archive_measurements', 'month']),
     ('0 7 * * 1', 'django.core.management.call_command',
         ['backfill_archives', 'week', '--overwrite'], {'period_size': 1}),
     ('30 5 * * *', 'django.core.management.call_command',
-        ['backfill_archives', 'day', '--overwrite'], {'period_size': 6})
+        ['backfill_archives', 'day', '--overwrite'], {'period_size': 6}),
+    ('15 * * * *', 'django.core.management.call_command',
+        ['backfill_archives', 'hour', '--overwrite'], {'period_size': 2})
 ]
 
 STAGING_CRONJOBS = [  # noqa
@@ -25,10 +35,21 @@ STAGING_CRONJOBS = [  # noqa
     ('30 10 * * *', 'django.core.management.call_command',
         ['update_auto_channels']),
     ('5 * * * *', 'django.core.management.call_command', ['evaluate_alarms']),
+    ('* * * * *', 'django.core.management.call_command',
+        ['evaluate_incremental_alarms', '--debounce-seconds=30']),
+    ('* * * * *', 'django.core.management.call_command',
+        ['dispatch_emails']),
     ('0 6 1,10 * *', 'django.core.management.call_command',
         ['archive_measurements', 'month']),
     ('0 7 * * 1', 'django.core.management.call_command',
         ['backfill_archives', 'week', '--overwrite'], {'period_size': 1}),
     ('30 5 * * *', 'django.core.management.call_command',
-        ['backfill_archives', 'day', '--overwrite'], {'period_size': 6})
+        ['backfill_archives', 'day', '--overwrite'], {'period_size': 6}),
+    ('15 * * * *', 'django.core.management.call_command',
+        ['backfill_archives', 'hour', '--overwrite'], {'period_size': 2})
 ]
+
+# Added by settings only when GROUP_BACKGROUND_UPDATE_SIZE is set
+STALE_GROUPS_CRONJOB = (
+    '* * * * *', 'django.core.management.call_command',
+    ['update_auto_channels', '--stale'])
@@ -1,3 +1,5 @@
+import hashlib
+
 from rest_framework.permissions import IsAuthenticated, \
     DjangoModelPermissions, IsAdminUser
 from squac.permissions import IsAdminOwnerOrShared, IsOrgAdminOrMember,\
@@ -5,6 +7,17 @@ from squac.permissions import IsAdminOwnerOrShared, IsOrgAdminOrMember,\
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from django.core.exceptions import FieldDoesNotExist, \
+    ValidationError as DjangoValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
 
 '''common mixins'''
 
@@ -75,6 +88,117 @@ class OrganizationPermissionsMixin:
         IsAuthenticated, IsOrgAdminOrMember,)
 
 
+class EagerLoadingMixin:
+    """Eager load what the serializer of the current action needs
+
+    Serializers declare their select_related/prefetch_related needs in a
+    setup_eager_loading staticmethod, which is applied to the queryset of
+    list and detail actions
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        setup_eager_loading = getattr(
+            self.get_serializer_class(), 'setup_eager_loading', None)
+        if setup_eager_loading is None:
+            return queryset
+        return setup_eager_loading(queryset)
+
+
+def split_param(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Return only some fields with ?fields=a,b or without some with ?omit=c
+
+    Applies to the top level fields of read requests, unknown names are
+    ignored. The queryset is restricted to the columns the remaining fields
+    need with only(), unless a field reads something other than a model
+    field or annotation, or the serializer customizes to_representation
+    """
+
+    def get_sparse_fields(self, field_names):
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = request.query_params.get('fields')
+        omit = request.query_params.get('omit')
+        if not fields and not omit:
+            return None
+        names = split_param(fields) if fields else set(field_names)
+        if omit:
+            names -= split_param(omit)
+        return [name for name in field_names if name in names]
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        target = getattr(serializer, 'child', serializer)
+        if not isinstance(target, serializers.Serializer):
+            return serializer
+        sparse_fields = self.get_sparse_fields(list(target.fields))
+        if sparse_fields is not None:
+            for name in list(target.fields):
+                if name not in sparse_fields:
+                    del target.fields[name]
+        return serializer
+
+    def get_sparse_columns(self, queryset, serializer):
+        '''Columns the fields of serializer need, None if unknown'''
+        list_serializer = getattr(getattr(serializer, 'Meta', None),
+                                  'list_serializer_class',
+                                  serializers.ListSerializer)
+        if type(serializer).to_representation is not \
+                serializers.Serializer.to_representation or \
+                list_serializer.to_representation is not \
+                serializers.ListSerializer.to_representation:
+            return None
+
+        opts = queryset.model._meta
+        columns = set()
+        for field in serializer.fields.values():
+            if field.source == '*':
+                return None
+            name = field.source_attrs[0]
+            try:
+                model_field = opts.get_field(name)
+            except FieldDoesNotExist:
+                if name in queryset.query.annotations:
+                    continue
+                return None
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(name)
+            elif not model_field.is_relation:
+                return None
+
+        # Keep the foreign keys that related objects are loaded with
+        select_related = queryset.query.select_related
+        if select_related is True:
+            return None
+        if select_related:
+            columns.update(select_related)
+        for lookup in queryset._prefetch_related_lookups:
+            name = getattr(lookup, 'prefetch_through', lookup).split('__')[0]
+            try:
+                if opts.get_field(name).concrete:
+                    columns.add(name)
+            except FieldDoesNotExist:
+                pass
+        return columns
+
+    def filter_queryset(self, queryset):
+        return self.sparse_queryset(super().filter_queryset(queryset))
+
+    def sparse_queryset(self, queryset):
+        '''Restrict queryset to the columns of the requested fields'''
+        if self.get_sparse_fields([]) is None:
+            return queryset
+        columns = self.get_sparse_columns(queryset, self.get_serializer())
+        if columns is None:
+            return queryset
+        return queryset.only(*columns)
+
+
 class EnablePartialUpdateMixin:
     """Enable partial updates
 
@@ -87,6 +211,120 @@ class EnablePartialUpdateMixin:
         return super().update(request, *args, **kwargs)
 
 
+class BulkUpdateMixin:
+    """Partially update a list of objects in one request
+
+    PATCH to <list url>/bulk/ with a list of objects that each include their
+    id. Every object is validated, including the model's clean(), before
+    anything is saved. Errors are returned as a list in the same order as
+    the request. Valid objects are saved together by perform_bulk_update,
+    which gets the instances and the names of the changed fields. The
+    updated objects are returned in the order of the request
+    """
+
+    def perform_bulk_update(self, instances, fields):
+        """
+        Save fields of the instances with a single bulk_update, setting
+        updated_at like save() if the model has it. Override this when
+        saving the model does more than that
+        """
+        model = self.get_queryset().model
+        fields = list(fields)
+        try:
+            model._meta.get_field('updated_at')
+        except FieldDoesNotExist:
+            pass
+        else:
+            now = timezone.now()
+            for instance in instances:
+                instance.updated_at = now
+            fields.append('updated_at')
+        model.objects.bulk_update(instances, fields)
+
+    @action(detail=False, methods=['patch'], url_path='bulk')
+    def bulk_update(self, request):
+        items = request.data
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) and 'id' in item for item in items):
+            raise ValidationError('Expected a list of objects with an id')
+        try:
+            ids = [int(item['id']) for item in items]
+        except (TypeError, ValueError):
+            raise ValidationError('Object ids must be integers')
+        if len(set(ids)) != len(ids):
+            raise ValidationError('Object ids must be unique')
+
+        found = self.get_queryset().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise ValidationError({'id': [f'Not found: {missing}']})
+
+        instances, fields, errors = [], set(), []
+        for pk, item in zip(ids, items):
+            instance = found[pk]
+            self.check_object_permissions(request, instance)
+            serializer = self.get_serializer(instance, data=item,
+                                             partial=True)
+            if not serializer.is_valid():
+                errors.append(serializer.errors)
+                continue
+            for attr, value in serializer.validated_data.items():
+                setattr(instance, attr, value)
+            try:
+                instance.clean()
+            except DjangoValidationError as e:
+                errors.append({'non_field_errors': e.messages})
+                continue
+            errors.append({})
+            instances.append(instance)
+            fields.update(serializer.validated_data)
+        if any(errors):
+            raise ValidationError(errors)
+
+        if fields:
+            self.perform_bulk_update(instances, sorted(fields))
+        updated = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        serializer = self.get_serializer(
+            [updated[pk] for pk in ids if pk in updated], many=True)
+        return Response(serializer.data)
+
+
+class ConditionalListMixin:
+    """Answer unchanged list requests with 304 Not Modified
+
+    The ETag of a list is derived from the count and latest updated_at of
+    the filtered queryset, together with the query string and the media
+    type, so If-None-Match is checked with one aggregate query before the
+    list is serialized. Last-Modified is sent for information only:
+    deleting a row doesn't change max(updated_at), so If-Modified-Since
+    isn't trusted to validate a list
+    """
+
+    def get_list_etag(self, request, queryset):
+        version = queryset.order_by().aggregate(
+            count=Count('pk'), updated_at=Max('updated_at'))
+        updated_at = version['updated_at']
+        tag = '|'.join((
+            queryset.model._meta.label_lower, str(version['count']),
+            updated_at.isoformat() if updated_at else '',
+            request.META.get('QUERY_STRING', ''),
+            request.accepted_media_type or ''))
+        return quote_etag(hashlib.md5(tag.encode()).hexdigest()), updated_at
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, updated_at = self.get_list_etag(request, queryset)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            response = not_modified
+        else:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        if updated_at is not None:
+            response['Last-Modified'] = http_date(updated_at.timestamp())
+        return response
+
+
 id_params = [
     openapi.Parameter(
         'id',
@@ -1,4 +1,5 @@
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import CursorPagination, \
+    LimitOffsetPagination
 '''Custom pagination '''
 
 
@@ -11,3 +12,15 @@ class OptionalPagination(LimitOffsetPagination):
         if 'offset' not in request.query_params:
             return None
         return super().paginate_queryset(queryset, request)
+
+
+class KeysetPagination(CursorPagination):
+    '''Pagination by id for large lists
+
+        pages continue after the last id of the previous page, so each one
+        is an index range scan however deep it is
+    '''
+    ordering = 'id'
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
@@ -7,7 +7,8 @@ env variables config
 import requests
 from requests.exceptions import RequestException, MissingSchema
 import os
-from squac.cronjobs import PRODUCTION_CRONJOBS, STAGING_CRONJOBS
+from squac.cronjobs import (PRODUCTION_CRONJOBS, STAGING_CRONJOBS,
+                            STALE_GROUPS_CRONJOB)
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -23,6 +24,29 @@ DEBUG = os.environ.get('SQUAC_DEBUG_MODE') == 'True'
 
 CACHE_ENABLED = os.environ.get('SQUAC_CACHE_ENABLED') == 'True'
 
+# Update minute monitor windows as measurements are posted so they can be
+# evaluated every minute, see measurement.incremental
+INCREMENTAL_ALARMS_ENABLED = \
+    os.environ.get('SQUAC_INCREMENTAL_ALARMS') == 'True'
+
+# Aggregate long hour and day monitor windows from ArchiveDay/ArchiveHour
+# where they have been archived, see measurement.archive_windows
+ARCHIVE_ALARMS_ENABLED = \
+    os.environ.get('SQUAC_ARCHIVE_ALARMS') == 'True'
+
+# Channel groups with more channels than this are updated in the background
+# by update_auto_channels --stale instead of during requests. 0 disables
+GROUP_BACKGROUND_UPDATE_SIZE = int(
+    os.environ.get('SQUAC_GROUP_BACKGROUND_UPDATE_SIZE', 0)) or None
+
+# Alert retention, see measurement compact_alerts command. Repeated in alarm
+# alerts are compacted after ALERT_COMPACT_AFTER_DAYS and alerts older than
+# ALERT_DELETE_AFTER_DAYS are deleted. Set to 0 to disable either
+ALERT_COMPACT_AFTER_DAYS = int(
+    os.environ.get('SQUAC_ALERT_COMPACT_AFTER_DAYS', 30)) or None
+ALERT_DELETE_AFTER_DAYS = int(
+    os.environ.get('SQUAC_ALERT_DELETE_AFTER_DAYS', 0)) or None
+
 try:
     ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS_LIST').split(',')
 except AttributeError:
@@ -53,6 +77,10 @@ CRONJOBS = STAGING_CRONJOBS
 if os.environ.get('SQUAC_ENVIRONMENT') == 'production':
     CRONJOBS = PRODUCTION_CRONJOBS
 
+# Stale groups only exist when large groups are updated in the background
+if GROUP_BACKGROUND_UPDATE_SIZE:
+    CRONJOBS = CRONJOBS + [STALE_GROUPS_CRONJOB]
+
 # tricks to have debug toolbar when developing with docker
 if os.environ.get('USE_DOCKER') == 'yes':
     import socket
@@ -335,5 +363,9 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'measurement.mailer': {
+            'handlers': ['console', 'mail_admins', 'console_on_not_debug'],
+            'level': 'INFO',
+        },
     }
 }
@@ -0,0 +1,85 @@
+--
+-- Convert measurement_alert into a table range partitioned by month on
+-- timestamp. Run once, after the measurement migrations. Partitions for new
+-- months are then created by the create_alert_partition command.
+--
+-- Partitions named measurement_alert_YYYY_MM are created for every month
+-- that has alerts, up to three months ahead. Anything outside of those
+-- lands in measurement_alert_default.
+--
+
+SET TIME ZONE 'UTC';
+
+BEGIN;
+
+ALTER TABLE public.measurement_alert RENAME TO measurement_alert_old;
+
+CREATE TABLE public.measurement_alert (
+    LIKE public.measurement_alert_old INCLUDING DEFAULTS
+) PARTITION BY RANGE("timestamp");
+
+-- Keep the id sequence when the old table is dropped
+ALTER SEQUENCE public.measurement_alert_id_seq
+    OWNED BY public.measurement_alert.id;
+
+
+--
+-- Partitions
+--
+
+CREATE TABLE public.measurement_alert_default
+    PARTITION OF public.measurement_alert DEFAULT;
+
+DO $$
+DECLARE
+    month date;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE(min("timestamp"), now())),
+            date_trunc('month', now()) + interval '3 months',
+            interval '1 month')::date
+        FROM public.measurement_alert_old
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE public.measurement_alert_%s
+                PARTITION OF public.measurement_alert
+                FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+    END LOOP;
+END $$;
+
+INSERT INTO public.measurement_alert SELECT * FROM public.measurement_alert_old;
+
+DROP TABLE public.measurement_alert_old;
+
+
+--
+-- Constraints and indexes, with the names Django gave them. Created after
+-- the old table is gone since the names are taken until then
+--
+
+-- The partition key has to be part of the primary key
+ALTER TABLE public.measurement_alert ADD PRIMARY KEY (id, "timestamp");
+
+CREATE INDEX measurement_alert_trigger_id_a1830b12 ON public.measurement_alert USING btree (trigger_id);
+
+CREATE INDEX measurement_alert_user_id_7f16cccc ON public.measurement_alert USING btree (user_id);
+
+CREATE INDEX measurement_timesta_d31e16_idx ON public.measurement_alert USING btree ("timestamp" DESC);
+
+CREATE INDEX measurement_trigger_7ed4e0_idx ON public.measurement_alert USING btree (trigger_id, "timestamp" DESC);
+
+
+--
+-- Foreign keys
+--
+
+ALTER TABLE public.measurement_alert
+    ADD CONSTRAINT measurement_alert_trigger_id_a1830b12_fk_measurement_trigger_id FOREIGN KEY (trigger_id) REFERENCES public.measurement_trigger(id) DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE public.measurement_alert
+    ADD CONSTRAINT measurement_alert_user_id_7f16cccc_fk_core_user_id FOREIGN KEY (user_id) REFERENCES public.core_user(id) DEFERRABLE INITIALLY DEFERRED;
+
+
+COMMIT;